@@ -1,6 +1,6 @@
 from django.contrib import admin
 from .models import Site, Command, Log
-from .models import CommandRun
+from .models import CommandRun, RetentionPolicy
 
 
 @admin.register(Site)
@@ -10,19 +10,30 @@ class SiteAdmin(admin.ModelAdmin):
 
 @admin.register(Command)
 class CommandAdmin(admin.ModelAdmin):
-    list_display = ('name', 'site', 'command_string', 'active')
+    list_display = ('name', 'site', 'command_string', 'active', 'log_rate_limit', 'crash_looping_since')
     list_filter = ('site', 'active')
 
 
 @admin.register(Log)
 class LogAdmin(admin.ModelAdmin):
-    list_display = ('created_at', 'site', 'command', 'level')
+    list_display = ('created_at', 'site', 'command', 'level', 'repeat_count')
     list_filter = ('level', 'site')
-    readonly_fields = ('created_at', 'message')
+    readonly_fields = ('created_at', 'last_seen_at', 'logged_at', 'message', 'fields')
+    # logs may live in their own database, so never join them to sites/commands
+    list_select_related = ()
+
+    def get_queryset(self, request):
+        return super().get_queryset(request).prefetch_related('site', 'command__site')
+
+
+@admin.register(RetentionPolicy)
+class RetentionPolicyAdmin(admin.ModelAdmin):
+    list_display = ('__str__', 'site', 'command', 'level', 'days')
+    list_filter = ('site', 'level')
 
 
 @admin.register(CommandRun)
 class CommandRunAdmin(admin.ModelAdmin):
-    list_display = ('command', 'pid', 'started_at', 'stopped_at', 'manually_stopped', 'killed', 'restart_count')
+    list_display = ('command', 'pid', 'pgid', 'started_at', 'stopped_at', 'manually_stopped', 'killed', 'restart_count')
     list_filter = ('manually_stopped', 'command__site', 'killed')
-    readonly_fields = ('pid', 'started_at', 'stopped_at', 'exit_code', 'restart_count', 'killed')
+    readonly_fields = ('pid', 'pgid', 'started_at', 'stopped_at', 'exit_code', 'restart_count', 'killed')
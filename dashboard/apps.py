@@ -5,10 +5,10 @@ class DashboardConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'dashboard'
 
+    # The supervisor is not started here, so management commands (migrate,
+    # shell, collectstatic, ...) never clean up or spawn processes. The web
+    # entry point starts it through `supervisor.start_for_web()` and
+    # `manage.py run_supervisor` runs it as a daemon.
+
     def ready(self):
-        # start the supervisor thread when the app is ready
-        try:
-            from . import supervisor
-            supervisor.supervisor.start()
-        except Exception:
-            pass
+        from . import signals  # noqa: F401
@@ -0,0 +1,316 @@
+import json
+import os
+import random
+import resource
+import shlex
+import subprocess
+import sys
+import threading
+import time
+from datetime import timedelta
+
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.db import close_old_connections, connections
+from django.test import Client
+from django.utils import timezone
+
+from .models import LOG_LEVELS, Command, CommandRun, Log, Site
+
+# Run by each synthetic command: prints `bench <emit time> <seq> <padding>`
+# lines at `rate` per second and exits with status 1 after `crash_after`
+# seconds (0 = never).
+CHILD_SCRIPT = '''
+import sys, time
+rate, size, crash_after = float(sys.argv[1]), int(sys.argv[2]), float(sys.argv[3])
+pad = "x" * max(size - 32, 0)
+start = time.time()
+n = 0
+while True:
+    now = time.time()
+    if crash_after and now - start >= crash_after:
+        sys.stdout.flush()
+        sys.exit(1)
+    due = start + n / rate
+    if due > now:
+        sys.stdout.flush()
+        time.sleep(min(due - now, 0.05))
+        continue
+    sys.stdout.write(f"bench {now:.6f} {n} {pad}\\n")
+    n += 1
+'''
+
+BENCH_PREFIX = 'bench '
+BENCH_SITE = 'bench'
+SEED_SITE = 'bench-seed'
+_WORDS = (
+    'request', 'served', 'timeout', 'connection', 'refused', 'worker', 'started', 'stopped', 'cache',
+    'miss', 'hit', 'query', 'slow', 'retry', 'failed', 'user', 'login', 'upload', 'complete', 'queue',
+)
+
+
+def summary(values, scale=1000.0) -> dict:
+    """Count and p50/p95/p99/max of `values` (seconds), in milliseconds by default."""
+    if not values:
+        return {'count': 0}
+    values = sorted(values)
+
+    def pct(p):
+        return round(values[min(len(values) - 1, int(len(values) * p))] * scale, 3)
+
+    return {'count': len(values), 'p50': pct(0.5), 'p95': pct(0.95), 'p99': pct(0.99), 'max': round(values[-1] * scale, 3)}
+
+
+def use_bench_databases(keepdb=False) -> list:
+    """Switch every database to a separate bench copy, created and migrated like Django's test databases.
+
+    SQLite databases get a `bench-` prefixed file next to the real one, others
+    a `bench_` prefixed database, unless TEST NAME is set. With `keepdb` an
+    existing copy (and its seeded rows) is reused. Returns what
+    `restore_databases()` needs.
+    """
+    old = []
+    for alias in connections:
+        connection = connections[alias]
+        test = connection.settings_dict.setdefault('TEST', {})
+        name = connection.settings_dict['NAME']
+        if not test.get('NAME'):
+            if connection.vendor == 'sqlite':
+                test['NAME'] = os.path.join(os.path.dirname(str(name)), f'bench-{os.path.basename(str(name))}')
+            else:
+                test['NAME'] = f'bench_{name}'
+        old.append((connection, name))
+        connection.creation.create_test_db(verbosity=0, autoclobber=True, keepdb=keepdb, serialize=False)
+    return old
+
+
+def restore_databases(old, keepdb=False):
+    for connection, name in old:
+        connection.creation.destroy_test_db(name, verbosity=0, keepdb=keepdb)
+
+
+def db_connections() -> dict:
+    """Open connections to each database: file handles on SQLite, server backends elsewhere."""
+    counts = {}
+    for alias in connections:
+        connection = connections[alias]
+        if connection.vendor == 'sqlite':
+            path = os.path.realpath(str(connection.settings_dict['NAME']))
+            fds = 0
+            for fd in os.listdir('/proc/self/fd'):
+                try:
+                    fds += os.readlink(f'/proc/self/fd/{fd}') == path
+                except OSError:
+                    pass
+            counts[alias] = fds
+        elif connection.vendor == 'postgresql':
+            with connection.cursor() as cursor:
+                cursor.execute('SELECT count(*) FROM pg_stat_activity WHERE datname = current_database()')
+                counts[alias] = cursor.fetchone()[0]
+    return counts
+
+
+def bench_ingest(commands=4, rate=1000.0, line_bytes=120, crash_every=0.0, duration=30.0) -> dict:
+    """Run synthetic commands under a real supervisor and measure the log pipeline.
+
+    This process becomes the supervisor leader (on a private lock file and
+    control socket, so a dashboard running on the host is not disturbed) with
+    immediate restarts and no crash-loop parking, so restart latency is the
+    supervisor's own overhead.
+    """
+    from . import supervisor as sup
+    from .logwriter import log_writer
+    from .notify import notifier
+
+    notifier.url = ''
+    run_dir = os.path.join(str(settings.BASE_DIR), '.bench')
+    os.makedirs(run_dir, exist_ok=True)
+    sup.elector.path = os.path.join(run_dir, 'supervisor.lock')
+    sup.control_server.path = os.path.join(run_dir, 'supervisor.sock')
+    sup.supervisor.stable_after = 0
+    sup.supervisor.crash_loop_threshold = 10 ** 9
+
+    site, _ = Site.objects.get_or_create(name=BENCH_SITE, defaults={'base_dir': '', 'base_command': ''})
+    cmd_line = f'{shlex.quote(sys.executable)} -c {shlex.quote(CHILD_SCRIPT)} {rate} {line_bytes} {crash_every}'
+    targets = []
+    for i in range(commands):
+        # distinct command lines: the supervisor matches leftover processes by command line
+        command, _ = Command.objects.update_or_create(
+            site=site, name=f'bench-{i}', defaults={'command_string': f'{cmd_line} bench-{i}'},
+        )
+        targets.append(command)
+    ids = [c.id for c in targets]
+    writer_before = log_writer.stats()
+    first_id = Log.objects.order_by('-id').values_list('id', flat=True).first() or 0
+    first_run = CommandRun.objects.order_by('-id').values_list('id', flat=True).first() or 0
+
+    sup.elector.start(on_elected=sup.become_leader)
+    usage = resource.getrusage(resource.RUSAGE_SELF)
+    started = time.monotonic()
+    for command in targets:
+        sup.supervisor.manual_start(command)
+
+    done = threading.Event()
+    persist, peaks = [], {'threads': 0, 'open_files': 0, 'db_connections': {}}
+
+    def probe():
+        # how far behind the newest stored line is, and resource peaks
+        last = None
+        while not done.wait(0.2):
+            message = (
+                Log.objects.filter(id__gt=first_id, command_id__in=ids, message__startswith=BENCH_PREFIX)
+                .order_by('-id').values_list('message', flat=True).first()
+            )
+            if message and message != last:
+                persist.append(time.time() - float(message.split()[1]))
+                last = message
+            peaks['threads'] = max(peaks['threads'], threading.active_count())
+            peaks['open_files'] = max(peaks['open_files'], len(os.listdir('/proc/self/fd')))
+            for alias, n in db_connections().items():
+                peaks['db_connections'][alias] = max(peaks['db_connections'].get(alias, 0), n)
+        close_old_connections()
+
+    prober = threading.Thread(target=probe, name='bench-probe', daemon=True)
+    prober.start()
+    try:
+        time.sleep(duration)
+    finally:
+        for command in targets:
+            sup.supervisor.stop_command(command)
+        elapsed = time.monotonic() - started
+        end_usage = resource.getrusage(resource.RUSAGE_SELF)
+        done.set()
+        prober.join()
+        # let the readers drain what the children wrote before they died
+        time.sleep(1)
+        for service in (sup.elector, sup.control_server, sup.supervisor, sup.pruner, sup.sampler, sup.rollups):
+            service.stop()
+        log_writer.flush()
+
+    capture = []
+    for message, created_at in (
+        Log.objects.filter(id__gt=first_id, command_id__in=ids, message__startswith=BENCH_PREFIX)
+        .values_list('message', 'created_at').iterator(chunk_size=5000)
+    ):
+        capture.append(created_at.timestamp() - float(message.split()[1]))
+
+    restart = []
+    previous = {}
+    for run in CommandRun.objects.filter(id__gt=first_run, command_id__in=ids).order_by('started_at'):
+        before = previous.get(run.command_id)
+        if before is not None and before.stopped_at and run.restart_count:
+            restart.append((run.started_at - before.stopped_at).total_seconds())
+        previous[run.command_id] = run
+
+    writer_after = log_writer.stats()
+    cpu = (end_usage.ru_utime + end_usage.ru_stime) - (usage.ru_utime + usage.ru_stime)
+    return {
+        'duration': round(elapsed, 3),
+        'lines_stored': len(capture),
+        'lines_per_second': round(len(capture) / elapsed, 1),
+        'capture_latency_ms': summary(capture),
+        'persist_latency_ms': summary(persist),
+        'restarts': len(restart),
+        'restart_latency_ms': summary(restart),
+        'supervisor_cpu_percent': round(100 * cpu / elapsed, 2),
+        'peak_threads': peaks['threads'],
+        'peak_open_files': peaks['open_files'],
+        'peak_db_connections': peaks['db_connections'],
+        'log_writer': {
+            key: writer_after[key] - writer_before[key]
+            for key in ('dropped', 'spilled', 'replayed', 'flush_errors', 'flushes')
+        },
+    }
+
+
+def seed_logs(rows: int, batch_size=10000, days=30) -> float:
+    """Top the log table up to `rows` synthetic rows across a few sites and commands; returns seconds taken."""
+    started = time.monotonic()
+    missing = rows - Log.objects.count()
+    if missing <= 0:
+        return 0.0
+    commands = []
+    for s in range(2):
+        site, _ = Site.objects.get_or_create(name=f'{SEED_SITE}-{s}', defaults={'base_dir': '', 'base_command': ''})
+        for c in range(10):
+            # never started, but the supervisor's startup sweep kills host
+            # processes whose command line contains any command string, so
+            # this must not match anything real
+            command, _ = Command.objects.update_or_create(
+                site=site, name=f'seed-{c}', defaults={'command_string': f'ukb-bench-seed:{s}-{c}:not-a-command'},
+            )
+            commands.append(command)
+    rng = random.Random(rows)
+    levels = LOG_LEVELS[1:]
+    now = timezone.now()
+    step = timedelta(days=days) / missing
+    at = now - timedelta(days=days)
+    while missing > 0:
+        batch = []
+        for _ in range(min(batch_size, missing)):
+            command = rng.choice(commands)
+            at += step
+            batch.append(Log(
+                site_id=command.site_id,
+                command=command,
+                created_at=at,
+                level=rng.choices(levels, weights=(85, 8, 6, 1))[0],
+                message=' '.join(rng.choices(_WORDS, k=rng.randint(4, 14))),
+            ))
+        Log.objects.bulk_create(batch, batch_size=batch_size)
+        missing -= len(batch)
+    return time.monotonic() - started
+
+
+def bench_views(repeat=5) -> dict:
+    """Response times of the log and command pages, as a superuser."""
+    user = get_user_model().objects.filter(username='bench').first()
+    if user is None:
+        user = get_user_model().objects.create_superuser('bench', 'bench@example.com', None)
+    client = Client()
+    client.force_login(user)
+    command = Command.objects.filter(site__name__startswith=SEED_SITE).first()
+    urls = ['/logs/', '/logs/?level=ERROR', '/logs/?q=timeout+refused', '/commands/']
+    if command:
+        urls.insert(1, f'/logs/?command={command.id}')
+    results = {}
+    for url in urls:
+        times, status = [], None
+        for _ in range(repeat):
+            started = time.perf_counter()
+            response = client.get(url)
+            times.append(time.perf_counter() - started)
+            status = response.status_code
+        results[url] = dict(summary(times), status=status)
+    return results
+
+
+def git_revision() -> str:
+    try:
+        return subprocess.run(
+            ['git', 'rev-parse', '--short', 'HEAD'], cwd=settings.BASE_DIR,
+            capture_output=True, text=True, timeout=5,
+        ).stdout.strip()
+    except (OSError, subprocess.SubprocessError):
+        return ''
+
+
+def flatten(data, prefix='') -> dict:
+    """Numeric leaves of a result as {'dotted.key': value}, for comparing runs."""
+    flat = {}
+    if isinstance(data, dict):
+        for key, value in data.items():
+            flat.update(flatten(value, f'{prefix}{key}.'))
+    elif isinstance(data, list):
+        for item in data:
+            # row-count tiers are matched by size, not position
+            label = f"rows={item['rows']}" if isinstance(item, dict) and 'rows' in item else str(data.index(item))
+            flat.update(flatten(item, f'{prefix}{label}.'))
+    elif isinstance(data, (int, float)) and not isinstance(data, bool):
+        flat[prefix.rstrip('.')] = data
+    return flat
+
+
+def load_results(path) -> dict:
+    with open(path) as f:
+        return json.load(f)
@@ -0,0 +1,128 @@
+import inspect
+import json
+import os
+import socket
+import socketserver
+import threading
+
+from django.db import connections
+
+
+class ControlError(RuntimeError):
+    """The supervisor could not be reached or refused the request."""
+
+
+class _Handler(socketserver.StreamRequestHandler):
+    def handle(self):
+        try:
+            line = self.rfile.readline(64 * 1024)
+            if not line:
+                return
+            request = json.loads(line)
+            op = request.pop('op')
+            handler = self.server.handlers.get(op)
+            if handler is None:
+                response = {'ok': False, 'error': f'unknown op: {op}'}
+            else:
+                response = {'ok': True, 'result': handler(**request)}
+        except Exception as e:
+            response = {'ok': False, 'error': str(e)}
+        finally:
+            # each request runs on its own thread; don't leak its DB connection
+            connections.close_all()
+        result = response.get('result')
+        if not inspect.isgenerator(result):
+            self.wfile.write(json.dumps(response).encode() + b'\n')
+            return
+        # streaming op: a header line, then one line per item until the client goes away
+        try:
+            self.wfile.write(b'{"ok": true, "stream": true}\n')
+            for item in result:
+                self.wfile.write(json.dumps(item).encode() + b'\n')
+                self.wfile.flush()
+        except OSError:
+            pass
+        finally:
+            result.close()
+
+
+class _Server(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    daemon_threads = True
+
+
+class ControlServer:
+    """Line-delimited JSON request/response server on a Unix domain socket.
+
+    `handlers` maps an op name to a callable taking the request's remaining
+    keys as keyword arguments; its return value must be JSON serialisable.
+    """
+
+    def __init__(self, path, handlers):
+        self.path = str(path)
+        self.handlers = handlers
+        self._server = None
+        self._thread = None
+
+    def start(self):
+        if self._server:
+            return
+        # only the leader binds, so a leftover socket file is from a dead process
+        try:
+            os.unlink(self.path)
+        except FileNotFoundError:
+            pass
+        self._server = _Server(self.path, _Handler)
+        self._server.handlers = self.handlers
+        os.chmod(self.path, 0o660)
+        self._thread = threading.Thread(target=self._server.serve_forever, name='supervisor-control', daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        if self._server:
+            self._server.shutdown()
+            self._server.server_close()
+            self._server = None
+
+
+def request(path, op, timeout=10.0, **kwargs):
+    """Send one request to the control socket at `path` and return its result."""
+    payload = json.dumps(dict(kwargs, op=op)).encode() + b'\n'
+    try:
+        with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as sock:
+            sock.settimeout(timeout)
+            sock.connect(str(path))
+            sock.sendall(payload)
+            with sock.makefile('rb') as f:
+                line = f.readline()
+    except OSError as e:
+        raise ControlError(f'Supervisor is not reachable: {e}')
+    if not line:
+        raise ControlError('Supervisor closed the connection')
+    response = json.loads(line)
+    if not response.get('ok'):
+        raise ControlError(response.get('error') or 'Supervisor request failed')
+    return response.get('result')
+
+
+def stream(path, op, timeout=60.0, **kwargs):
+    """Like `request`, for ops that return a stream; yields items until the server stops sending."""
+    payload = json.dumps(dict(kwargs, op=op)).encode() + b'\n'
+    sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        sock.settimeout(timeout)
+        try:
+            sock.connect(str(path))
+            sock.sendall(payload)
+        except OSError as e:
+            raise ControlError(f'Supervisor is not reachable: {e}')
+        with sock.makefile('rb') as f:
+            header = json.loads(f.readline() or b'{}')
+            if not header.get('ok'):
+                raise ControlError(header.get('error') or 'Supervisor request failed')
+            try:
+                for line in f:
+                    yield json.loads(line)
+            except OSError as e:
+                raise ControlError(f'Lost connection to supervisor: {e}')
+    finally:
+        sock.close()
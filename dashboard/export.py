@@ -0,0 +1,101 @@
+import csv
+import io
+import json
+import zlib
+
+from .models import Command, Site
+
+EXPORT_FORMATS = {
+    'ndjson': 'application/x-ndjson',
+    'csv': 'text/csv',
+}
+CSV_HEADER = ['id', 'created_at', 'site_id', 'site', 'command_id', 'command', 'level', 'message', 'repeat_count', 'last_seen_at', 'logged_at', 'fields']
+
+_FIELDS = ('id', 'created_at', 'site_id', 'command_id', 'level', 'message', 'repeat_count', 'last_seen_at', 'logged_at', 'fields')
+
+
+def iter_log_rows(qs, chunk_size=2000):
+    """Yield every log in `qs` as a tuple of _FIELDS, oldest first.
+
+    Rows are read in keyset-paged chunks on (created_at, id), each streamed
+    with `.iterator()`, so memory stays at one chunk however large the export,
+    and no single query holds a read transaction open for the whole export
+    (which on SQLite would stall the log writer).
+    """
+    if chunk_size <= 0:
+        raise ValueError(f'chunk_size must be positive, not {chunk_size}')
+    qs = qs.order_by('created_at', 'id').values_list(*_FIELDS)
+    last = None
+    while True:
+        page = qs
+        if last is not None:
+            page = qs.after(*last)
+        count = 0
+        for row in page[:chunk_size].iterator(chunk_size=chunk_size):
+            count += 1
+            yield row
+        if count < chunk_size:
+            return
+        last = (row[1], row[0])
+
+
+def export_logs(qs, fmt='ndjson', compress=False, chunk_size=2000):
+    """Yield `qs` serialised as NDJSON or CSV, in byte chunks of about `chunk_size` rows.
+
+    With `compress` the output is one gzip stream, compressed as it is produced.
+    """
+    # sites and commands are few; look them up once instead of joining (logs
+    # may live in their own database)
+    sites = dict(Site.objects.values_list('id', 'name'))
+    commands = dict(Command.objects.values_list('id', 'name'))
+    gzip = zlib.compressobj(6, zlib.DEFLATED, 31) if compress else None
+    buffer = io.StringIO()
+    writer = csv.writer(buffer) if fmt == 'csv' else None
+    if writer:
+        writer.writerow(CSV_HEADER)
+
+    def drain():
+        data = buffer.getvalue().encode()
+        buffer.seek(0)
+        buffer.truncate()
+        return gzip.compress(data) if gzip else data
+
+    pending = 0
+    for row in iter_log_rows(qs, chunk_size):
+        pk, created_at, site_id, command_id, level, message, repeat_count, last_seen_at, logged_at, fields = row
+        site = sites.get(site_id, '')
+        command = commands.get(command_id, '')
+        last_seen_at = last_seen_at.isoformat() if last_seen_at else None
+        logged_at = logged_at.isoformat() if logged_at else None
+        if writer:
+            writer.writerow([
+                pk, created_at.isoformat(), site_id or '', site, command_id or '', command, level, message,
+                repeat_count, last_seen_at or '', logged_at or '', json.dumps(fields) if fields else '',
+            ])
+        else:
+            buffer.write(json.dumps({
+                'id': pk,
+                'created_at': created_at.isoformat(),
+                'site_id': site_id,
+                'site': site,
+                'command_id': command_id,
+                'command': command,
+                'level': level,
+                'message': message,
+                'repeat_count': repeat_count,
+                'last_seen_at': last_seen_at,
+                'logged_at': logged_at,
+                'fields': fields,
+            }))
+            buffer.write('\n')
+        pending += 1
+        if pending >= chunk_size:
+            pending = 0
+            data = drain()
+            if data:
+                yield data
+    data = drain()
+    if gzip:
+        data += gzip.flush()
+    if data:
+        yield data
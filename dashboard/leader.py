@@ -0,0 +1,71 @@
+import fcntl
+import os
+import threading
+
+
+class LeaderElection:
+    """Elect one process on this host to own supervision, using an exclusive file lock.
+
+    Every process calls `start()`; the first to take the lock becomes leader
+    and runs `on_elected`. The others keep retrying every `retry_interval`
+    seconds. The kernel drops the lock when the leader's process exits (even
+    on SIGKILL), so a follower takes over on its next attempt.
+    """
+
+    def __init__(self, path, retry_interval=2.0):
+        self.path = str(path)
+        self.retry_interval = retry_interval
+        self.is_leader = False
+        self._fd = None
+        self._thread = None
+        self._stop = threading.Event()
+        self._on_elected = None
+
+    def start(self, on_elected):
+        if self._thread and self._thread.is_alive():
+            return
+        self._on_elected = on_elected
+        if self.try_acquire():
+            return
+        self._thread = threading.Thread(target=self._run, name='leader-election', daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+
+    def try_acquire(self) -> bool:
+        if self.is_leader:
+            return True
+        fd = os.open(self.path, os.O_RDWR | os.O_CREAT, 0o644)
+        try:
+            fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except OSError:
+            os.close(fd)
+            return False
+        # keep the fd open for the life of the process; closing it releases the lock
+        self._fd = fd
+        os.ftruncate(fd, 0)
+        os.write(fd, f"{os.getpid()}\n".encode())
+        self.is_leader = True
+        if self._on_elected:
+            try:
+                self._on_elected()
+            except Exception:
+                pass
+        return True
+
+    def leader_pid(self):
+        """Pid recorded by the current leader, if any."""
+        try:
+            with open(self.path) as f:
+                return int(f.read().strip() or 0) or None
+        except (OSError, ValueError):
+            return None
+
+    def _run(self):
+        while not self._stop.wait(self.retry_interval):
+            try:
+                if self.try_acquire():
+                    return
+            except Exception:
+                pass
@@ -0,0 +1,155 @@
+import json
+import queue
+import threading
+from collections import deque
+
+from django.conf import settings
+
+
+class Subscription:
+    """A single live-tail viewer: a bounded queue plus the filters it asked for."""
+
+    def __init__(self, site_id=None, command_id=None, level=None, max_pending=1000):
+        self.site_id = site_id
+        self.command_id = command_id
+        self.level = level
+        self.dropped = 0
+        self._queue = queue.Queue(maxsize=max_pending)
+
+    def matches(self, entry: dict) -> bool:
+        if self.site_id is not None and entry['site_id'] != self.site_id:
+            return False
+        if self.command_id is not None and entry['command_id'] != self.command_id:
+            return False
+        if self.level and entry['level'] != self.level:
+            return False
+        return True
+
+    def offer(self, payload: str):
+        try:
+            self._queue.put_nowait(payload)
+        except queue.Full:
+            # a slow viewer loses its oldest lines rather than holding up ingestion
+            try:
+                self._queue.get_nowait()
+            except queue.Empty:
+                pass
+            self.dropped += 1
+            try:
+                self._queue.put_nowait(payload)
+            except queue.Full:
+                pass
+
+    def get_batch(self, timeout: float, limit: int = 200) -> list:
+        """Block up to `timeout` seconds for at least one line, then take whatever else is ready."""
+        try:
+            batch = [self._queue.get(timeout=timeout)]
+        except queue.Empty:
+            return []
+        while len(batch) < limit:
+            try:
+                batch.append(self._queue.get_nowait())
+            except queue.Empty:
+                break
+        return batch
+
+
+class LogBroadcaster:
+    """Fan newly ingested log lines out to live-tail subscribers in this process.
+
+    Each line is serialised once and offered to every matching subscriber, so
+    the cost of a viewer is a queue put per line, never a database query.
+    """
+
+    def __init__(self):
+        self._subs = []
+        self._lock = threading.Lock()
+
+    def subscribe(self, **filters) -> Subscription:
+        sub = Subscription(**filters)
+        with self._lock:
+            self._subs = self._subs + [sub]
+        return sub
+
+    def unsubscribe(self, sub: Subscription):
+        with self._lock:
+            self._subs = [s for s in self._subs if s is not sub]
+
+    def subscriber_count(self) -> int:
+        return len(self._subs)
+
+    def publish(self, entry: dict):
+        subs = self._subs
+        if not subs:
+            return
+        payload = None
+        for sub in subs:
+            if not sub.matches(entry):
+                continue
+            if payload is None:
+                payload = json.dumps(entry)
+            sub.offer(payload)
+
+
+class TailBuffer:
+    """The most recent `size` lines of each command, kept in memory.
+
+    Lines are stored as (created_at, level, message) tuples in a fixed-size
+    deque per command, so memory is bounded by commands x size and reading a
+    tail never touches the database.
+    """
+
+    def __init__(self, size=500):
+        self.size = size
+        self._buffers = {}
+        self._lock = threading.Lock()
+
+    def append(self, command_id, created_at, level, message):
+        if command_id is None or self.size <= 0:
+            return
+        buf = self._buffers.get(command_id)
+        if buf is None:
+            with self._lock:
+                buf = self._buffers.setdefault(command_id, deque(maxlen=self.size))
+        buf.append((created_at, level, message))
+
+    def get(self, command_id, limit=None) -> list:
+        buf = self._buffers.get(command_id)
+        if not buf:
+            return []
+        # copying a deque happens in one C call, so it can't see a half-done append
+        lines = list(buf)
+        if limit is not None:
+            lines = lines[-limit:] if limit > 0 else []
+        return lines
+
+    def discard(self, command_id):
+        with self._lock:
+            self._buffers.pop(command_id, None)
+
+
+def follow(keepalive=15, **filters):
+    """Subscribe to live lines and yield them in batches; an empty batch is a keepalive tick."""
+    sub = broadcaster.subscribe(**filters)
+    try:
+        while True:
+            yield sub.get_batch(timeout=keepalive)
+    finally:
+        broadcaster.unsubscribe(sub)
+
+
+def log_entry(log) -> dict:
+    """Serialisable view of an unsaved or saved Log row for live viewers."""
+    return {
+        'created_at': log.created_at.isoformat(),
+        'site_id': log.site_id,
+        'site': log.site.name if log.site_id else '',
+        'command_id': log.command_id,
+        'command': log.command.name if log.command_id else '',
+        'level': log.level,
+        'message': log.message,
+    }
+
+
+broadcaster = LogBroadcaster()
+tail_buffer = TailBuffer(size=getattr(settings, 'LOG_TAIL_LINES', 500))
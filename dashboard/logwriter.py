@@ -0,0 +1,547 @@
+import atexit
+import json
+import os
+import queue
+import threading
+import time
+from pathlib import Path
+
+from django.conf import settings
+from django.db import DataError, IntegrityError, close_old_connections
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+
+from .models import Log
+from .logstream import broadcaster, log_entry, tail_buffer
+from .parsers import parse_line
+from .rollups import rollups
+
+# what the database raises for a row it will never take (bad JSON, NUL bytes,
+# out-of-range values), as opposed to being locked or unreachable
+_BAD_ROW = (DataError, IntegrityError, ValueError)
+
+
+def _pid_alive(pid: int) -> bool:
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+
+class SpillBuffer:
+    """Append-only NDJSON overflow for log lines the database can't take yet.
+
+    Each process appends to its own `spill-<pid>.ndjson`. To replay, the
+    file is renamed to `replay-<pid>-<n>.ndjson` and read back in batches;
+    after each committed batch the read offset is saved beside it, so a crash
+    mid-replay resumes instead of inserting the same lines twice. Files left
+    by processes that have died are claimed and replayed the same way.
+    """
+
+    def __init__(self, directory, max_bytes=1 << 30):
+        self.directory = Path(directory)
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        self._file = None
+        self._seq = 0
+        self._replay = None
+        self._last_scan = 0.0
+        self.spilled = 0
+        self.spilled_bytes = 0
+        self.replayed = 0
+        self.errors = 0
+
+    def append(self, entries: list) -> bool:
+        """Write entries to the active spill file. Returns False if they could not be kept."""
+        data = ''.join(
+            json.dumps({
+                't': e.created_at.isoformat(),
+                's': e.site_id,
+                'c': e.command_id,
+                'l': e.level,
+                'm': e.message,
+                'n': e.repeat_count,
+                'u': e.last_seen_at.isoformat() if e.last_seen_at else None,
+                'o': e.logged_at.isoformat() if e.logged_at else None,
+                'f': e.fields,
+            }) + '\n'
+            for e in entries
+        ).encode()
+        with self._lock:
+            try:
+                if self._file is None:
+                    self.directory.mkdir(parents=True, exist_ok=True)
+                    self._file = open(self.directory / f'spill-{os.getpid()}.ndjson', 'ab')
+                if self.pending_bytes() + len(data) > self.max_bytes:
+                    return False
+                self._file.write(data)
+            except OSError:
+                self.errors += 1
+                return False
+        self.spilled += len(entries)
+        self.spilled_bytes += len(data)
+        return True
+
+    def sync(self):
+        """Hand buffered spill writes to the OS, so they survive this process dying."""
+        with self._lock:
+            if self._file is not None:
+                try:
+                    self._file.flush()
+                except OSError:
+                    self.errors += 1
+
+    def pending_bytes(self) -> int:
+        pending = self._file.tell() if self._file is not None else 0
+        if self._replay is not None:
+            path, f = self._replay
+            try:
+                pending += os.fstat(f.fileno()).st_size - f.tell()
+            except (OSError, ValueError):
+                pass
+        return pending
+
+    def has_pending(self) -> bool:
+        if self._replay is not None or (self._file is not None and self._file.tell()):
+            return True
+        # look for files left by dead processes now and then
+        if time.monotonic() - self._last_scan > 60:
+            self._last_scan = time.monotonic()
+            return bool(self._orphans())
+        return False
+
+    def read_batch(self, size: int) -> list:
+        """Up to `size` spilled lines as unsaved Log objects; call `commit()` once they are stored."""
+        if self._replay is None and not self._open_next():
+            return []
+        path, f = self._replay
+        entries = []
+        self._batch_start = f.tell()
+        while len(entries) < size:
+            line = f.readline()
+            if not line:
+                break
+            try:
+                row = json.loads(line)
+                entries.append(Log(
+                    site_id=row['s'], command_id=row['c'], level=row['l'], message=row['m'],
+                    created_at=parse_datetime(row['t']), repeat_count=row.get('n', 1),
+                    last_seen_at=parse_datetime(row['u']) if row.get('u') else None,
+                    logged_at=parse_datetime(row['o']) if row.get('o') else None, fields=row.get('f'),
+                ))
+            except (ValueError, KeyError, TypeError):
+                # a torn last line from a crash; nothing to recover
+                self.errors += 1
+        if not entries:
+            self._finish()
+        return entries
+
+    def commit(self, count: int):
+        path, f = self._replay
+        self.replayed += count
+        try:
+            Path(f'{path}.offset').write_text(str(f.tell()))
+        except OSError:
+            self.errors += 1
+        if f.tell() >= os.fstat(f.fileno()).st_size:
+            self._finish()
+
+    def rollback(self):
+        """The batch from `read_batch` was not stored; read it again next time."""
+        self._replay[1].seek(self._batch_start)
+
+    def close(self):
+        with self._lock:
+            if self._file is not None:
+                try:
+                    self._file.close()
+                except OSError:
+                    pass
+                self._file = None
+
+    def _finish(self):
+        path, f = self._replay
+        self._replay = None
+        f.close()
+        for p in (path, Path(f'{path}.offset')):
+            try:
+                p.unlink()
+            except FileNotFoundError:
+                pass
+
+    def _claim(self, path: Path) -> Path:
+        self._seq += 1
+        claimed = self.directory / f'replay-{os.getpid()}-{self._seq}.ndjson'
+        os.rename(path, claimed)
+        offset = Path(f'{path}.offset')
+        if offset.exists():
+            os.rename(offset, f'{claimed}.offset')
+        return claimed
+
+    def _orphans(self) -> list:
+        found = []
+        try:
+            names = sorted(os.listdir(self.directory))
+        except OSError:
+            return found
+        for name in names:
+            if not name.endswith('.ndjson'):
+                continue
+            try:
+                pid = int(name.split('-')[1].split('.')[0])
+            except (IndexError, ValueError):
+                continue
+            if pid != os.getpid() and not _pid_alive(pid):
+                found.append(self.directory / name)
+        return found
+
+    def _open_next(self) -> bool:
+        path = None
+        for candidate in self._orphans():
+            try:
+                path = self._claim(candidate)
+                break
+            except OSError:
+                # another process claimed it first
+                continue
+        if path is None:
+            with self._lock:
+                if self._file is None or not self._file.tell():
+                    return False
+                self._file.close()
+                self._file = None
+                path = self._claim(self.directory / f'spill-{os.getpid()}.ndjson')
+        f = open(path, 'rb')
+        try:
+            f.seek(int(Path(f'{path}.offset').read_text()))
+        except (OSError, ValueError):
+            pass
+        self._replay = (path, f)
+        return True
+
+
+class _Suppressed:
+    """Lines of one command held back by its rate limit since `first`."""
+
+    __slots__ = ('site', 'command', 'first', 'last', 'count')
+
+    def __init__(self, site, command, first):
+        self.site = site
+        self.command = command
+        self.first = first
+        self.last = first
+        self.count = 0
+
+    def entry(self) -> Log:
+        entry = Log(
+            site=self.site, command=self.command, level='WARNING', created_at=self.first, last_seen_at=self.last,
+            message=f'{self.count} lines suppressed (over {self.command.log_rate_limit} lines/s)',
+        )
+        tail_buffer.append(entry.command_id, entry.created_at, entry.level, entry.message)
+        if broadcaster.subscriber_count():
+            broadcaster.publish(log_entry(entry))
+        return entry
+
+
+class LogWriter:
+    """Collect log lines from every supervised process and persist them in batches.
+
+    Producers call `write()`, which only enqueues and never touches the
+    database. A single background thread drains the queue and flushes with
+    `bulk_create` once `batch_size` lines are pending or `flush_interval`
+    seconds have passed since the first pending line. The caller is never
+    blocked: when the queue is full, or a batch can't be written, lines go to
+    the `spill` buffer on local disk and are replayed once the database keeps
+    up again (live lines first). Lines are only dropped (and counted) when
+    there is no spill buffer or it is full. A row the database rejects
+    outright is set aside (and counted) so it can't hold up the rest of its
+    batch.
+
+    Each command's ingestion policy is applied before a line is queued. With
+    `collapse_repeats`, consecutive identical lines become one row carrying a
+    repeat count and the last time seen; the row is held until a different
+    line arrives, the repeats pause for `flush_interval`, or it spans
+    `collapse_window` seconds. A `log_rate_limit` is a token bucket holding
+    `rate_burst` seconds' worth of lines; lines over it are not stored but
+    counted, and a "N lines suppressed" row records how many and when.
+    """
+
+    def __init__(self, batch_size=500, flush_interval=0.25, max_queue=50000, spill=None,
+                 collapse_window=60.0, rate_burst=5.0):
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.spill = spill
+        self.collapse_window = collapse_window
+        self.rate_burst = rate_burst
+        self._queue = queue.Queue(maxsize=max_queue)
+        self._lock = threading.Lock()
+        self._thread = None
+        self._stop = threading.Event()
+        # command id -> row collapsing repeats / [tokens, refilled at] / _Suppressed
+        self._policy_lock = threading.Lock()
+        self._held = {}
+        self._buckets = {}
+        self._suppressed = {}
+        self.collapsed = 0
+        self.suppressed = 0
+        self.queued = 0
+        self.flushed = 0
+        self.dropped = 0
+        self.rejected = 0
+        self.flush_errors = 0
+        self.flushes = 0
+        self.flush_seconds_total = 0.0
+        self.max_flush_seconds = 0.0
+
+    def start(self):
+        with self._lock:
+            if self._thread and self._thread.is_alive():
+                return
+            self._stop.clear()
+            self._thread = threading.Thread(target=self._run, name='log-writer', daemon=True)
+            self._thread.start()
+
+    def stop(self, timeout=2.0):
+        self._stop.set()
+        if self._thread:
+            self._thread.join(timeout=timeout)
+
+    def write(self, site, command, level, message) -> bool:
+        """Queue one line for persistence. Returns False if the line was dropped.
+
+        `level` is used unless the line's own format (see dashboard.parsers)
+        gives one. Lines collapsed into a repeat or suppressed by the rate
+        limit count as kept.
+        """
+        if not self._thread or not self._thread.is_alive():
+            self.start()
+        now = timezone.now()
+        level, message, logged_at, fields = parse_line(message, level, command.log_format if command else '')
+        if command is not None and (command.collapse_repeats or command.log_rate_limit):
+            with self._policy_lock:
+                held = self._held.get(command.id)
+                if held is not None and held.message == message and held.level == level and held.fields == fields:
+                    held.repeat_count += 1
+                    held.last_seen_at = now
+                    self.collapsed += 1
+                    return True
+                if command.log_rate_limit and not self._take_token(command, now):
+                    self._suppress(site, command, now)
+                    return True
+                release = []
+                if held is not None:
+                    release.append(self._held.pop(command.id))
+                marker = self._suppressed.get(command.id)
+                # at most one marker a second, however the limit interleaves with stored lines
+                if marker is not None and (now - marker.first).total_seconds() >= 1:
+                    release.append(self._suppressed.pop(command.id).entry())
+                entry = self._entry(site, command, level, message, now, logged_at, fields)
+                if command.collapse_repeats:
+                    self._held[command.id] = entry
+                else:
+                    release.append(entry)
+            for ready in release:
+                self._enqueue(ready)
+            return True
+        return self._enqueue(self._entry(site, command, level, message, now, logged_at, fields))
+
+    def _entry(self, site, command, level, message, now, logged_at=None, fields=None) -> Log:
+        entry = Log(
+            site=site, command=command, level=level, message=message, created_at=now,
+            logged_at=logged_at, fields=fields,
+        )
+        tail_buffer.append(entry.command_id, entry.created_at, level, message)
+        # live viewers see the line straight away, before it reaches the database
+        if broadcaster.subscriber_count():
+            broadcaster.publish(log_entry(entry))
+        return entry
+
+    def _take_token(self, command, now) -> bool:
+        rate = command.log_rate_limit
+        capacity = max(rate * self.rate_burst, 1)
+        bucket = self._buckets.get(command.id)
+        if bucket is None:
+            bucket = self._buckets[command.id] = [capacity, now]
+        else:
+            bucket[0] = min(capacity, bucket[0] + (now - bucket[1]).total_seconds() * rate)
+            bucket[1] = now
+        if bucket[0] < 1:
+            return False
+        bucket[0] -= 1
+        return True
+
+    def _suppress(self, site, command, now):
+        marker = self._suppressed.get(command.id)
+        if marker is None:
+            marker = self._suppressed[command.id] = _Suppressed(site, command, now)
+        marker.count += 1
+        marker.last = now
+        self.suppressed += 1
+
+    def _release(self, force=False):
+        """Queue collapsed rows that are done repeating, and suppression markers over a second old."""
+        now = timezone.now()
+        release = []
+        with self._policy_lock:
+            for command_id, held in list(self._held.items()):
+                last = held.last_seen_at or held.created_at
+                if (force or (now - last).total_seconds() >= self.flush_interval
+                        or (now - held.created_at).total_seconds() >= self.collapse_window):
+                    release.append(self._held.pop(command_id))
+            for command_id, marker in list(self._suppressed.items()):
+                if force or (now - marker.first).total_seconds() >= 1:
+                    release.append(self._suppressed.pop(command_id).entry())
+        for entry in release:
+            self._enqueue(entry)
+
+    def _enqueue(self, entry) -> bool:
+        try:
+            self._queue.put_nowait(entry)
+        except queue.Full:
+            if self.spill is not None and self.spill.append([entry]):
+                return True
+            self.dropped += 1
+            return False
+        self.queued += 1
+        return True
+
+    def stats(self) -> dict:
+        return {
+            'queued': self.queued,
+            'flushed': self.flushed,
+            'dropped': self.dropped,
+            'rejected': self.rejected,
+            'flush_errors': self.flush_errors,
+            'pending': self._queue.qsize(),
+            'flushes': self.flushes,
+            'flush_seconds_total': self.flush_seconds_total,
+            'max_flush_seconds': self.max_flush_seconds,
+            'spilled': self.spill.spilled if self.spill else 0,
+            'spilled_bytes': self.spill.spilled_bytes if self.spill else 0,
+            'replayed': self.spill.replayed if self.spill else 0,
+            'spill_pending_bytes': self.spill.pending_bytes() if self.spill else 0,
+            'spill_errors': self.spill.errors if self.spill else 0,
+            'collapsed': self.collapsed,
+            'suppressed': self.suppressed,
+        }
+
+    def _run(self):
+        close_old_connections()
+        healthy = True
+        while not self._stop.is_set():
+            self._release()
+            batch = self._collect()
+            if batch:
+                healthy = self._flush(batch)
+            if self.spill is not None:
+                self.spill.sync()
+                # replay only while live lines aren't backing up
+                if healthy and self._queue.qsize() < self.batch_size and self.spill.has_pending():
+                    healthy = self._replay()
+        # drain whatever is left on shutdown
+        self.flush()
+
+    def _collect(self) -> list:
+        try:
+            batch = [self._queue.get(timeout=0.5)]
+        except queue.Empty:
+            return []
+        deadline = time.monotonic() + self.flush_interval
+        while len(batch) < self.batch_size:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            try:
+                batch.append(self._queue.get(timeout=remaining))
+            except queue.Empty:
+                break
+        return batch
+
+    def flush(self):
+        """Synchronously write everything currently queued, including rows still collapsing repeats."""
+        self._release(force=True)
+        batch = []
+        while True:
+            try:
+                batch.append(self._queue.get_nowait())
+            except queue.Empty:
+                break
+            if len(batch) >= self.batch_size:
+                self._flush(batch)
+                batch = []
+        if batch:
+            self._flush(batch)
+        if self.spill is not None:
+            self.spill.sync()
+
+    def _replay(self) -> bool:
+        """Write spilled batches for up to `flush_interval` seconds, yielding to live lines."""
+        deadline = time.monotonic() + self.flush_interval
+        while time.monotonic() < deadline and self._queue.qsize() < self.batch_size:
+            batch = self.spill.read_batch(self.batch_size)
+            if not batch:
+                break
+            try:
+                stored = self._insert(batch)
+            except Exception:
+                self.flush_errors += 1
+                self.spill.rollback()
+                close_old_connections()
+                return False
+            # rejected rows are skipped too, or they would be retried forever
+            self.spill.commit(len(stored))
+            rollups.count_logs(stored)
+        return True
+
+    def _insert(self, batch: list) -> list:
+        """bulk_create `batch` and return the rows stored.
+
+        If the database rejects a row, the batch is halved until the bad rows
+        are on their own; those are counted in `rejected` and left out.
+        Any other error (database locked or down) is raised.
+        """
+        try:
+            Log.objects.bulk_create(batch, batch_size=self.batch_size)
+            return batch
+        except _BAD_ROW:
+            if len(batch) == 1:
+                self.rejected += 1
+                return []
+        close_old_connections()
+        middle = len(batch) // 2
+        return self._insert(batch[:middle]) + self._insert(batch[middle:])
+
+    def _flush(self, batch: list) -> bool:
+        started = time.perf_counter()
+        try:
+            stored = self._insert(batch)
+            self.flushed += len(stored)
+            rollups.count_logs(stored)
+            elapsed = time.perf_counter() - started
+            self.flushes += 1
+            self.flush_seconds_total += elapsed
+            self.max_flush_seconds = max(self.max_flush_seconds, elapsed)
+            return True
+        except Exception:
+            self.flush_errors += 1
+            if self.spill is None or not self.spill.append(batch):
+                self.dropped += len(batch)
+            # the connection may be broken; get a fresh one for the next batch
+            close_old_connections()
+            return False
+
+
+log_writer = LogWriter(
+    batch_size=getattr(settings, 'LOG_BATCH_SIZE', 500),
+    flush_interval=getattr(settings, 'LOG_FLUSH_INTERVAL', 0.25),
+    max_queue=getattr(settings, 'LOG_QUEUE_SIZE', 50000),
+    collapse_window=getattr(settings, 'LOG_COLLAPSE_WINDOW', 60.0),
+    rate_burst=getattr(settings, 'LOG_RATE_BURST', 5.0),
+    spill=SpillBuffer(
+        settings.LOG_SPILL_DIR, max_bytes=getattr(settings, 'LOG_SPILL_MAX_BYTES', 1 << 30),
+    ) if getattr(settings, 'LOG_SPILL_DIR', '') else None,
+)
+atexit.register(log_writer.flush)
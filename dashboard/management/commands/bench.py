@@ -0,0 +1,99 @@
+import json
+import os
+import platform
+
+import django
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connections
+from django.utils import timezone
+
+from dashboard import bench
+
+
+class Command(BaseCommand):
+    help = (
+        'Benchmark the supervisor and log pipeline on a separate bench database: ingest from synthetic '
+        'commands, then page response times at growing log table sizes. Results are saved as JSON.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--commands', type=int, default=4, help='Synthetic commands to run at once')
+        parser.add_argument('--rate', type=float, default=1000.0, help='Lines per second per command')
+        parser.add_argument('--line-bytes', type=int, default=120, help='Approximate length of each line')
+        parser.add_argument('--crash-every', type=float, default=0.0, help='Each command exits with an error after this many seconds (0 = never)')
+        parser.add_argument('--duration', type=float, default=30.0, help='Seconds to run the commands for')
+        parser.add_argument('--rows', default='10000,1000000,10000000', help='Comma-separated log table sizes to time pages at')
+        parser.add_argument('--repeat', type=int, default=5, help='Requests per page and table size')
+        parser.add_argument('--skip-ingest', action='store_true', help='Only time the pages')
+        parser.add_argument('--skip-views', action='store_true', help='Only run the ingest benchmark')
+        parser.add_argument('--keepdb', action='store_true', help='Keep the bench database (and seeded rows) for the next run')
+        parser.add_argument('-o', '--output', help='Results file (default: bench-results/<time>.json)')
+        parser.add_argument('--compare', help='Earlier results file to compare against')
+
+    def handle(self, *args, **options):
+        try:
+            tiers = sorted(int(n) for n in options['rows'].split(',') if n.strip())
+        except ValueError:
+            raise CommandError(f"Invalid --rows: {options['rows']}")
+        baseline = bench.load_results(options['compare']) if options['compare'] else None
+
+        results = {
+            'started_at': timezone.now().isoformat(),
+            'revision': bench.git_revision(),
+            'python': platform.python_version(),
+            'django': django.get_version(),
+            'databases': {alias: connections[alias].vendor for alias in connections},
+            'options': {key: options[key] for key in (
+                'commands', 'rate', 'line_bytes', 'crash_every', 'duration', 'repeat',
+            )},
+        }
+        old = bench.use_bench_databases(keepdb=options['keepdb'])
+        try:
+            if not options['skip_ingest']:
+                self.stdout.write(f"Ingest: {options['commands']} commands for {options['duration']:.0f}s...")
+                results['ingest'] = bench.bench_ingest(
+                    commands=options['commands'],
+                    rate=options['rate'],
+                    line_bytes=options['line_bytes'],
+                    crash_every=options['crash_every'],
+                    duration=options['duration'],
+                )
+                ingest = results['ingest']
+                self.stdout.write(
+                    f"  {ingest['lines_per_second']} lines/s, persist p95 {ingest['persist_latency_ms'].get('p95')} ms, "
+                    f"{ingest['restarts']} restarts, supervisor CPU {ingest['supervisor_cpu_percent']}%"
+                )
+            if not options['skip_views']:
+                results['views'] = []
+                for rows in tiers:
+                    self.stdout.write(f"Pages at {rows} log rows...")
+                    seeded = bench.seed_logs(rows)
+                    pages = bench.bench_views(repeat=options['repeat'])
+                    results['views'].append({'rows': rows, 'seed_seconds': round(seeded, 1), 'pages': pages})
+                    for url, times in pages.items():
+                        self.stdout.write(f"  {url}: p50 {times['p50']} ms, max {times['max']} ms ({times['status']})")
+        finally:
+            bench.restore_databases(old, keepdb=options['keepdb'])
+
+        path = options['output'] or os.path.join(
+            str(settings.BASE_DIR), 'bench-results', f"{timezone.now():%Y%m%d-%H%M%S}.json",
+        )
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        with open(path, 'w') as f:
+            json.dump(results, f, indent=2)
+        self.stdout.write(self.style.SUCCESS(f"Results written to {path}"))
+
+        if baseline:
+            self._compare(baseline, results)
+
+    def _compare(self, baseline, results):
+        before, after = bench.flatten(baseline), bench.flatten(results)
+        self.stdout.write(f"Compared with {baseline.get('revision') or 'baseline'} ({baseline.get('started_at', '?')}):")
+        if baseline.get('options') != results['options']:
+            self.stdout.write(self.style.WARNING(f"  options differ: {baseline.get('options')} -> {results['options']}"))
+        for key in sorted(after.keys() & before.keys()):
+            if key.startswith('options.') or before[key] == after[key]:
+                continue
+            change = f"{100 * (after[key] - before[key]) / before[key]:+.1f}%" if before[key] else 'new'
+            self.stdout.write(f"  {key}: {before[key]} -> {after[key]} ({change})")
@@ -0,0 +1,60 @@
+import sys
+from datetime import datetime, time
+
+from django.core.management.base import BaseCommand, CommandError
+from django.utils import timezone
+from django.utils.dateparse import parse_date, parse_datetime
+
+from dashboard.export import EXPORT_FORMATS, export_logs
+from dashboard.models import LOG_LEVELS, Log
+
+
+def _datetime(value):
+    if not value:
+        return None
+    try:
+        dt = parse_datetime(value)
+        day = None if dt else parse_date(value)
+    except ValueError:
+        dt = day = None
+    if dt is None and day is None:
+        raise CommandError(f"Invalid date/time: {value} (use e.g. 2024-05-01 or '2024-05-01 12:00')")
+    if dt is None:
+        dt = datetime.combine(day, time.min)
+    return timezone.make_aware(dt) if timezone.is_naive(dt) else dt
+
+
+class Command(BaseCommand):
+    help = 'Stream logs as NDJSON or CSV to a file or stdout, oldest first, optionally gzip-compressed.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--site', type=int, help='Site id')
+        parser.add_argument('--command', type=int, help='Command id')
+        parser.add_argument('--level', choices=LOG_LEVELS)
+        parser.add_argument('--since', help='Only logs at or after this time')
+        parser.add_argument('--until', help='Only logs before this time')
+        parser.add_argument('--format', choices=sorted(EXPORT_FORMATS), default='ndjson')
+        parser.add_argument('--gzip', action='store_true', help='Compress the output with gzip')
+        parser.add_argument('--chunk-size', type=int, default=2000, help='Rows fetched per query')
+        parser.add_argument('-o', '--output', help='File to write (default: stdout)')
+
+    def handle(self, *args, **options):
+        if options['chunk_size'] <= 0:
+            raise CommandError('--chunk-size must be at least 1')
+        qs = Log.objects.matching(
+            site=options['site'],
+            command=options['command'],
+            level=options['level'],
+            since=_datetime(options['since']),
+            until=_datetime(options['until']),
+        )
+        chunks = export_logs(qs, options['format'], compress=options['gzip'], chunk_size=options['chunk_size'])
+        out = open(options['output'], 'wb') if options['output'] else sys.stdout.buffer
+        try:
+            for chunk in chunks:
+                out.write(chunk)
+        finally:
+            if options['output']:
+                out.close()
+            else:
+                out.flush()
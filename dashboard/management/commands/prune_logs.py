@@ -0,0 +1,36 @@
+from django.core.management.base import BaseCommand
+
+from dashboard.retention import LogArchive, default_archive, prune_logs
+
+
+class Command(BaseCommand):
+    help = 'Delete logs older than their retention policy, optionally archiving them to compressed NDJSON first.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--dry-run', action='store_true', help='Only report how many rows each policy would delete')
+        parser.add_argument('--batch-size', type=int, default=1000, help='Rows deleted per transaction')
+        parser.add_argument('--pause', type=float, default=0.0, help='Seconds to sleep between batches')
+        parser.add_argument('--archive-dir', help='Archive deleted rows here (default: LOG_ARCHIVE_DIR)')
+        parser.add_argument('--compression', choices=['gzip', 'zstd'], default='gzip', help='Archive compression with --archive-dir')
+        parser.add_argument('--no-archive', action='store_true', help='Delete without archiving, even if LOG_ARCHIVE_DIR is set')
+
+    def handle(self, *args, **options):
+        if options['no_archive']:
+            archive = None
+        elif options['archive_dir']:
+            archive = LogArchive(options['archive_dir'], options['compression'])
+        else:
+            archive = default_archive()
+
+        results = prune_logs(
+            batch_size=options['batch_size'],
+            pause=options['pause'],
+            archive=archive,
+            dry_run=options['dry_run'],
+        )
+        verb = 'would delete' if options['dry_run'] else 'deleted'
+        for rule, count in results:
+            self.stdout.write(f"{rule.label}: {verb} {count}")
+        total = sum(count for _, count in results)
+        where = f", archived to {archive.directory}" if archive and not options['dry_run'] and total else ''
+        self.stdout.write(self.style.SUCCESS(f"{verb.capitalize()} {total} log rows{where}."))
@@ -0,0 +1,17 @@
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+
+from dashboard.rollups import rebuild_rollups
+
+
+class Command(BaseCommand):
+    help = 'Recompute the overview rollups from stored logs and runs, e.g. after upgrading or restoring a backup.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--days', type=int, default=2, help='How far back to recompute')
+
+    def handle(self, *args, **options):
+        written = rebuild_rollups(timezone.now() - timedelta(days=options['days']))
+        self.stdout.write(self.style.SUCCESS(f"Rebuilt rollups for {written} command-minutes."))
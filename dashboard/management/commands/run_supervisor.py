@@ -0,0 +1,38 @@
+import os
+import signal
+import threading
+
+from django.core.management.base import BaseCommand
+
+
+class Command(BaseCommand):
+    help = 'Run the process supervisor as a standalone daemon serving the local control socket.'
+
+    def handle(self, *args, **options):
+        from dashboard import supervisor
+        from dashboard.logwriter import log_writer
+        from dashboard.notify import notifier
+
+        stop = threading.Event()
+        for sig in (signal.SIGTERM, signal.SIGINT):
+            signal.signal(sig, lambda *_: stop.set())
+
+        supervisor.elector.start(on_elected=supervisor.become_leader)
+        if not supervisor.elector.is_leader:
+            self.stdout.write(f"Waiting for supervisor lock held by pid {supervisor.elector.leader_pid()}...")
+            while not supervisor.elector.is_leader and not stop.wait(0.5):
+                pass
+        if supervisor.elector.is_leader:
+            self.stdout.write(self.style.SUCCESS(
+                f"Supervisor running (pid {os.getpid()}), control socket {supervisor.control_server.path}"
+            ))
+            stop.wait()
+
+        supervisor.elector.stop()
+        supervisor.control_server.stop()
+        supervisor.supervisor.stop()
+        supervisor.pruner.stop()
+        supervisor.sampler.stop()
+        supervisor.rollups.stop()
+        log_writer.flush()
+        notifier.stop()
@@ -0,0 +1,332 @@
+import os
+import threading
+import time
+from datetime import timedelta
+
+from django.db import close_old_connections
+from django.utils import timezone
+
+from .models import ProcessSample
+
+_CLK_TCK = os.sysconf('SC_CLK_TCK') if hasattr(os, 'sysconf') else 100
+_PAGE_SIZE = os.sysconf('SC_PAGE_SIZE') if hasattr(os, 'sysconf') else 4096
+
+
+def _read_stats() -> dict:
+    """pid -> (ppid, pgid, cpu ticks incl. reaped children, rss pages) for every process, from /proc."""
+    stats = {}
+    for entry in os.listdir('/proc'):
+        if not entry.isdigit():
+            continue
+        try:
+            with open(f'/proc/{entry}/stat', 'rb') as f:
+                raw = f.read()
+        except OSError:
+            continue
+        # the command name can contain spaces and parentheses; fields start after the last ')'
+        fields = raw[raw.rfind(b')') + 2:].split()
+        try:
+            stats[int(entry)] = (
+                int(fields[1]),
+                int(fields[2]),
+                int(fields[11]) + int(fields[12]) + int(fields[13]) + int(fields[14]),
+                int(fields[21]),
+            )
+        except (IndexError, ValueError):
+            continue
+    return stats
+
+
+def _open_fds(pid) -> int:
+    try:
+        return len(os.listdir(f'/proc/{pid}/fd'))
+    except OSError:
+        # e.g. a root-owned `sudo` in the tree
+        return 0
+
+
+def _io_bytes(pid):
+    read = write = 0
+    try:
+        with open(f'/proc/{pid}/io', 'rb') as f:
+            for line in f:
+                if line.startswith(b'read_bytes:'):
+                    read = int(line.split()[1])
+                elif line.startswith(b'write_bytes:'):
+                    write = int(line.split()[1])
+    except (OSError, ValueError):
+        pass
+    return read, write
+
+
+def _tree(leader, stats, children, groups) -> set:
+    """The leader's process group plus anything descended from it (e.g. children that called setsid)."""
+    members = set(groups.get(leader, ()))
+    stack = [leader]
+    while stack:
+        pid = stack.pop()
+        if pid in stats:
+            members.add(pid)
+        stack.extend(children.get(pid, ()))
+    return members
+
+
+class _Bucket:
+    __slots__ = ('start', 'count', 'cpu', 'rss', 'fds', 'procs', 'read', 'write')
+
+    def __init__(self, start):
+        self.start = start
+        self.count = 0
+        self.cpu = 0.0
+        self.rss = self.fds = self.procs = self.read = self.write = 0
+
+
+class ProcessSampler:
+    """Sample CPU, memory, open files and disk I/O of every supervised process tree.
+
+    Every `interval` seconds one pass over /proc/<pid>/stat finds each
+    command's processes (its process group plus descendants) and sums them;
+    open FDs and /proc/<pid>/io are read only for those processes. The latest
+    sample per command is kept in memory for /metrics, and one row per command
+    per minute (average CPU, peak RSS/FDs, bytes read/written in the minute) is
+    stored as ProcessSample; rows older than `history_days` are deleted.
+
+    `targets` returns (command_id, site, command, pgid) for each running command.
+    """
+
+    def __init__(self, targets, interval=10.0, history_days=7):
+        self.targets = targets
+        self.interval = interval
+        self.history_days = history_days
+        self.latest = {}
+        self._previous = {}
+        self._buckets = {}
+        self._closed = []
+        self._thread = None
+        self._stop = threading.Event()
+        self._last_prune = 0.0
+        self.ticks = 0
+        self.last_duration = 0.0
+        self.duration_total = 0.0
+        self.errors = 0
+
+    def start(self):
+        if not self.interval or not os.path.isdir('/proc') or (self._thread and self._thread.is_alive()):
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name='process-sampler', daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+
+    def stats(self) -> dict:
+        return {
+            'interval': self.interval,
+            'ticks': self.ticks,
+            'last_duration': self.last_duration,
+            'duration_total': self.duration_total,
+            'errors': self.errors,
+        }
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            started = time.perf_counter()
+            try:
+                self.sample()
+            except Exception:
+                self.errors += 1
+            self.last_duration = time.perf_counter() - started
+            self.duration_total += self.last_duration
+            self.ticks += 1
+            try:
+                self._persist()
+            except Exception:
+                self.errors += 1
+                close_old_connections()
+
+    def sample(self):
+        targets = self.targets()
+        if not targets:
+            self.latest = {}
+            return
+        now = time.monotonic()
+        stats = _read_stats()
+        children = {}
+        groups = {}
+        for pid, (ppid, pgid, _, _) in stats.items():
+            children.setdefault(ppid, []).append(pid)
+            groups.setdefault(pgid, []).append(pid)
+        latest = {}
+        for command_id, site, command, leader in targets:
+            members = _tree(leader, stats, children, groups) if leader else set()
+            cpu = sum(stats[pid][2] for pid in members) / _CLK_TCK
+            read = write = 0
+            for pid in members:
+                r, w = _io_bytes(pid)
+                read += r
+                write += w
+            sample = {
+                'site': site,
+                'command': command,
+                'pid': leader,
+                'processes': len(members),
+                'cpu_seconds': cpu,
+                'cpu_percent': 0.0,
+                'rss_bytes': sum(stats[pid][3] for pid in members) * _PAGE_SIZE,
+                'open_fds': sum(_open_fds(pid) for pid in members),
+                'read_bytes': read,
+                'write_bytes': write,
+            }
+            previous = self._previous.get(command_id)
+            if previous and previous[1]['pid'] == leader and now > previous[0]:
+                sample['cpu_percent'] = max(0.0, 100.0 * (cpu - previous[1]['cpu_seconds']) / (now - previous[0]))
+                # the first sample of a run has no rate yet, so it only seeds the next one
+                self._add_to_bucket(
+                    command_id, sample,
+                    max(0, read - previous[1]['read_bytes']),
+                    max(0, write - previous[1]['write_bytes']),
+                )
+            self._previous[command_id] = (now, sample)
+            latest[command_id] = sample
+        for command_id in set(self._previous) - set(latest):
+            del self._previous[command_id]
+        self.latest = latest
+
+    def _add_to_bucket(self, command_id, sample, read_delta, write_delta):
+        minute = timezone.now().replace(second=0, microsecond=0)
+        bucket = self._buckets.get(command_id)
+        if bucket is None or bucket.start != minute:
+            if bucket is not None:
+                self._closed.append((command_id, bucket))
+            bucket = self._buckets[command_id] = _Bucket(minute)
+        bucket.count += 1
+        bucket.cpu += sample['cpu_percent']
+        bucket.rss = max(bucket.rss, sample['rss_bytes'])
+        bucket.fds = max(bucket.fds, sample['open_fds'])
+        bucket.procs = max(bucket.procs, sample['processes'])
+        bucket.read += read_delta
+        bucket.write += write_delta
+
+    def _persist(self):
+        minute = timezone.now().replace(second=0, microsecond=0)
+        # minutes of commands that have since stopped are complete too
+        for command_id, bucket in list(self._buckets.items()):
+            if bucket.start < minute:
+                self._closed.append((command_id, bucket))
+                del self._buckets[command_id]
+        if self._closed:
+            closed, self._closed = self._closed, []
+            ProcessSample.objects.bulk_create([
+                ProcessSample(
+                    command_id=command_id,
+                    at=bucket.start,
+                    cpu_percent=round(bucket.cpu / bucket.count, 2),
+                    rss_bytes=bucket.rss,
+                    open_fds=bucket.fds,
+                    processes=bucket.procs,
+                    read_bytes=bucket.read,
+                    write_bytes=bucket.write,
+                )
+                for command_id, bucket in closed
+            ])
+        if self.history_days and time.monotonic() - self._last_prune > 3600:
+            self._last_prune = time.monotonic()
+            ProcessSample.objects.filter(at__lt=timezone.now() - timedelta(days=self.history_days)).delete()
+
+
+def _escape(value) -> str:
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+class _Exposition:
+    """Builds the Prometheus text format, one HELP/TYPE block per metric family."""
+
+    def __init__(self):
+        self.lines = []
+
+    def family(self, name, kind, help_text, samples):
+        """`samples` is a list of (labels dict, value); families without samples are left out."""
+        if not samples:
+            return
+        self.lines.append(f'# HELP {name} {help_text}')
+        self.lines.append(f'# TYPE {name} {kind}')
+        for labels, value in samples:
+            label_str = ','.join(f'{k}="{_escape(v)}"' for k, v in labels.items())
+            self.lines.append(f'{name}{{{label_str}}} {value}' if label_str else f'{name} {value}')
+
+    def render(self) -> str:
+        return '\n'.join(self.lines) + '\n'
+
+
+# (key in a process sample, metric name, type, help)
+PROCESS_METRICS = [
+    ('processes', 'ukb_process_count', 'gauge', 'Processes in the command\'s process tree.'),
+    ('cpu_seconds', 'ukb_process_cpu_seconds_total', 'counter', 'CPU time used by the process tree, including reaped children.'),
+    ('cpu_percent', 'ukb_process_cpu_percent', 'gauge', 'CPU use over the last sampling interval (100 = one core).'),
+    ('rss_bytes', 'ukb_process_resident_memory_bytes', 'gauge', 'Resident memory of the process tree.'),
+    ('open_fds', 'ukb_process_open_fds', 'gauge', 'Open file descriptors in the process tree.'),
+    ('read_bytes', 'ukb_process_read_bytes_total', 'counter', 'Bytes read from storage by the process tree.'),
+    ('write_bytes', 'ukb_process_write_bytes_total', 'counter', 'Bytes written to storage by the process tree.'),
+]
+
+
+def render_prometheus(data) -> str:
+    """Render the leader's metrics snapshot (see supervisor.metrics_snapshot) as Prometheus text."""
+    out = _Exposition()
+    out.family('ukb_supervisor_up', 'gauge', 'Whether the supervisor answered this scrape.', [({}, 1 if data else 0)])
+    if not data:
+        return out.render()
+
+    processes = data['processes']
+    for key, name, kind, help_text in PROCESS_METRICS:
+        out.family(name, kind, help_text, [
+            ({'site': p['site'], 'command': p['command']}, round(p[key], 3)) for p in processes
+        ])
+
+    commands = data['commands']
+    labels = [{'site': c['site'], 'command': c['command']} for c in commands]
+    out.family('ukb_command_running', 'gauge', 'Whether the command has a live supervised run.',
+               [(l, int(c['running'])) for l, c in zip(labels, commands)])
+    out.family('ukb_command_crash_looping', 'gauge', 'Whether the command is parked after repeated quick crashes.',
+               [(l, int(c['crash_looping'])) for l, c in zip(labels, commands)])
+    out.family('ukb_command_crashes_total', 'counter', 'Unexpected exits since the supervisor started.',
+               [(l, c['crashes']) for l, c in zip(labels, commands)])
+    out.family('ukb_command_restarts_total', 'counter', 'Automatic restarts since the supervisor started.',
+               [(l, c['restarts']) for l, c in zip(labels, commands)])
+
+    sup = data['supervisor']
+    out.family('ukb_supervisor_pending_restarts', 'gauge', 'Restarts waiting out their backoff.', [({}, sup['pending_restarts'])])
+    out.family('ukb_live_log_subscribers', 'gauge', 'Open live log / follow streams.', [({}, sup['live_subscribers'])])
+
+    writer = data['log_writer']
+    out.family('ukb_log_queue_depth', 'gauge', 'Log lines waiting to be written.', [({}, writer['pending'])])
+    out.family('ukb_log_lines_queued_total', 'counter', 'Log lines accepted by the log writer.', [({}, writer['queued'])])
+    out.family('ukb_log_lines_flushed_total', 'counter', 'Log lines written to the database.', [({}, writer['flushed'])])
+    out.family('ukb_log_lines_dropped_total', 'counter', 'Log lines lost (queue and spill buffer full, or spilling off).', [({}, writer['dropped'])])
+    out.family('ukb_log_spilled_lines_total', 'counter', 'Log lines written to the disk spill buffer.', [({}, writer['spilled'])])
+    out.family('ukb_log_spilled_bytes_total', 'counter', 'Bytes written to the disk spill buffer.', [({}, writer['spilled_bytes'])])
+    out.family('ukb_log_replayed_lines_total', 'counter', 'Spilled log lines written to the database.', [({}, writer['replayed'])])
+    out.family('ukb_log_spill_pending_bytes', 'gauge', 'Spilled bytes not yet replayed.', [({}, writer['spill_pending_bytes'])])
+    out.family('ukb_log_lines_collapsed_total', 'counter', 'Repeated log lines folded into the previous row.', [({}, writer['collapsed'])])
+    out.family('ukb_log_lines_rejected_total', 'counter', 'Log lines the database refused to store (e.g. invalid JSON fields).', [({}, writer['rejected'])])
+    out.family('ukb_log_lines_suppressed_total', 'counter', 'Log lines held back by a command rate limit.', [({}, writer['suppressed'])])
+    out.family('ukb_log_spill_errors_total', 'counter', 'Spill buffer write or read errors.', [({}, writer['spill_errors'])])
+    out.family('ukb_log_flush_errors_total', 'counter', 'Failed log batch writes.', [({}, writer['flush_errors'])])
+    out.family('ukb_log_flush_max_seconds', 'gauge', 'Slowest log batch write so far.', [({}, round(writer['max_flush_seconds'], 6))])
+    out.lines.append('# HELP ukb_log_flush_duration_seconds Time spent writing log batches.')
+    out.lines.append('# TYPE ukb_log_flush_duration_seconds summary')
+    out.lines.append(f"ukb_log_flush_duration_seconds_sum {round(writer['flush_seconds_total'], 6)}")
+    out.lines.append(f"ukb_log_flush_duration_seconds_count {writer['flushes']}")
+
+    notifier = data['notifier']
+    out.family('ukb_notifications_sent_total', 'counter', 'Discord messages delivered.', [({}, notifier['sent'])])
+    out.family('ukb_notifications_coalesced_total', 'counter', 'Notifications folded into a summary message.', [({}, notifier['coalesced'])])
+    out.family('ukb_notifications_failed_total', 'counter', 'Notifications that could not be delivered or were dropped.',
+               [({}, notifier['failed'] + notifier['dropped'])])
+
+    sampler = data['sampler']
+    out.family('ukb_sampler_duration_seconds', 'gauge', 'Duration of the last process sampling pass.', [({}, round(sampler['last_duration'], 6))])
+    out.family('ukb_sampler_seconds_total', 'counter', 'Total time spent sampling processes.', [({}, round(sampler['duration_total'], 6))])
+    out.family('ukb_sampler_passes_total', 'counter', 'Process sampling passes.', [({}, sampler['ticks'])])
+    return out.render()
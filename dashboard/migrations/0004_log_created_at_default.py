@@ -0,0 +1,19 @@
+# Generated by Django 5.2.18 on 2026-10-18 15:09
+
+import django.utils.timezone
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('dashboard', '0003_commandrun_killed'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='log',
+            name='created_at',
+            field=models.DateTimeField(default=django.utils.timezone.now, editable=False),
+        ),
+    ]
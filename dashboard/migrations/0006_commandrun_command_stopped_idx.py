@@ -0,0 +1,17 @@
+# Generated by Django 5.2.18 on 2026-10-18 15:14
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('dashboard', '0005_log_indexes'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='commandrun',
+            index=models.Index(fields=['command', 'stopped_at'], name='commandrun_command_stopped_idx'),
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 5.2.18 on 2026-10-18 15:18
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('dashboard', '0006_commandrun_command_stopped_idx'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='command',
+            name='crash_looping_since',
+            field=models.DateTimeField(blank=True, editable=False, null=True),
+        ),
+    ]
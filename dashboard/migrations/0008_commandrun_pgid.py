@@ -0,0 +1,18 @@
+# Generated by Django 5.2.18 on 2026-10-18 15:20
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('dashboard', '0007_command_crash_looping_since'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='commandrun',
+            name='pgid',
+            field=models.IntegerField(blank=True, null=True),
+        ),
+    ]
@@ -0,0 +1,24 @@
+# Generated by Django 5.2.18 on 2026-10-18 15:29
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('dashboard', '0009_retentionpolicy'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='log',
+            name='command',
+            field=models.ForeignKey(blank=True, db_constraint=False, null=True, on_delete=django.db.models.deletion.DO_NOTHING, to='dashboard.command'),
+        ),
+        migrations.AlterField(
+            model_name='log',
+            name='site',
+            field=models.ForeignKey(blank=True, db_constraint=False, null=True, on_delete=django.db.models.deletion.DO_NOTHING, to='dashboard.site'),
+        ),
+    ]
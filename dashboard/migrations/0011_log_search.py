@@ -0,0 +1,69 @@
+from django.db import migrations
+from django.db.utils import OperationalError
+
+# External-content FTS5 index over Log.message, kept in step by triggers so
+# every insert (including the log writer's batched bulk_create) and every
+# retention delete updates it in the same transaction.
+SQLITE_FORWARDS = [
+    "CREATE VIRTUAL TABLE dashboard_log_fts USING fts5(message, content='dashboard_log', content_rowid='id')",
+    """CREATE TRIGGER dashboard_log_fts_ai AFTER INSERT ON dashboard_log BEGIN
+        INSERT INTO dashboard_log_fts(rowid, message) VALUES (new.id, new.message);
+    END""",
+    """CREATE TRIGGER dashboard_log_fts_ad AFTER DELETE ON dashboard_log BEGIN
+        INSERT INTO dashboard_log_fts(dashboard_log_fts, rowid, message) VALUES ('delete', old.id, old.message);
+    END""",
+    """CREATE TRIGGER dashboard_log_fts_au AFTER UPDATE OF message ON dashboard_log BEGIN
+        INSERT INTO dashboard_log_fts(dashboard_log_fts, rowid, message) VALUES ('delete', old.id, old.message);
+        INSERT INTO dashboard_log_fts(rowid, message) VALUES (new.id, new.message);
+    END""",
+    # index the rows that already exist
+    "INSERT INTO dashboard_log_fts(dashboard_log_fts) VALUES ('rebuild')",
+]
+SQLITE_BACKWARDS = [
+    "DROP TRIGGER IF EXISTS dashboard_log_fts_ai",
+    "DROP TRIGGER IF EXISTS dashboard_log_fts_ad",
+    "DROP TRIGGER IF EXISTS dashboard_log_fts_au",
+    "DROP TABLE IF EXISTS dashboard_log_fts",
+]
+
+# 'simple' config: log lines aren't prose, so no stemming or stop words
+POSTGRES_FORWARDS = [
+    "CREATE INDEX IF NOT EXISTS log_message_search_idx ON dashboard_log USING gin (to_tsvector('simple', message))",
+]
+POSTGRES_BACKWARDS = [
+    "DROP INDEX IF EXISTS log_message_search_idx",
+]
+
+
+def _run(schema_editor, sqlite, postgres):
+    vendor = schema_editor.connection.vendor
+    if vendor == 'sqlite':
+        try:
+            for sql in sqlite:
+                schema_editor.execute(sql)
+        except OperationalError:
+            # SQLite built without FTS5: search falls back to a substring scan
+            pass
+    elif vendor == 'postgresql':
+        for sql in postgres:
+            schema_editor.execute(sql)
+
+
+def forwards(apps, schema_editor):
+    _run(schema_editor, SQLITE_FORWARDS, POSTGRES_FORWARDS)
+
+
+def backwards(apps, schema_editor):
+    _run(schema_editor, SQLITE_BACKWARDS, POSTGRES_BACKWARDS)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('dashboard', '0010_log_fk_without_constraint'),
+    ]
+
+    operations = [
+        # the hint routes this to the database that holds Log (see dashboard.routers)
+        migrations.RunPython(forwards, backwards, hints={'model_name': 'log'}),
+    ]
@@ -0,0 +1,31 @@
+# Generated by Django 5.2.18 on 2026-10-18 15:46
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('dashboard', '0011_log_search'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ProcessSample',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('at', models.DateTimeField(help_text='Start of the minute')),
+                ('processes', models.IntegerField(default=0)),
+                ('cpu_percent', models.FloatField(help_text='Average over the minute; 100 = one core')),
+                ('rss_bytes', models.BigIntegerField(help_text='Peak resident memory')),
+                ('open_fds', models.IntegerField(help_text='Peak open file descriptors')),
+                ('read_bytes', models.BigIntegerField(help_text='Read from storage during the minute')),
+                ('write_bytes', models.BigIntegerField(help_text='Written to storage during the minute')),
+                ('command', models.ForeignKey(db_constraint=False, on_delete=django.db.models.deletion.DO_NOTHING, related_name='+', to='dashboard.command')),
+            ],
+            options={
+                'indexes': [models.Index(fields=['command', 'at'], name='processsample_command_at_idx'), models.Index(fields=['at'], name='processsample_at_idx')],
+            },
+        ),
+    ]
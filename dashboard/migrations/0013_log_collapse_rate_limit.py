@@ -0,0 +1,60 @@
+# Generated by Django 5.2.18 on 2026-10-18 15:57
+
+from django.db import migrations, models
+
+# Adding a NOT NULL column makes Django rebuild dashboard_log on SQLite, which
+# drops the full-text triggers from 0011; put them back (row ids are kept, so
+# the index itself is still valid).
+FTS_TRIGGERS = [
+    """CREATE TRIGGER IF NOT EXISTS dashboard_log_fts_ai AFTER INSERT ON dashboard_log BEGIN
+        INSERT INTO dashboard_log_fts(rowid, message) VALUES (new.id, new.message);
+    END""",
+    """CREATE TRIGGER IF NOT EXISTS dashboard_log_fts_ad AFTER DELETE ON dashboard_log BEGIN
+        INSERT INTO dashboard_log_fts(dashboard_log_fts, rowid, message) VALUES ('delete', old.id, old.message);
+    END""",
+    """CREATE TRIGGER IF NOT EXISTS dashboard_log_fts_au AFTER UPDATE OF message ON dashboard_log BEGIN
+        INSERT INTO dashboard_log_fts(dashboard_log_fts, rowid, message) VALUES ('delete', old.id, old.message);
+        INSERT INTO dashboard_log_fts(rowid, message) VALUES (new.id, new.message);
+    END""",
+]
+
+
+def restore_fts_triggers(apps, schema_editor):
+    connection = schema_editor.connection
+    if connection.vendor != 'sqlite' or 'dashboard_log_fts' not in connection.introspection.table_names():
+        return
+    for sql in FTS_TRIGGERS:
+        schema_editor.execute(sql)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('dashboard', '0012_processsample'),
+    ]
+
+    operations = [
+        # (when unapplied, removing the fields rebuilds the table too)
+        migrations.RunPython(migrations.RunPython.noop, restore_fts_triggers, hints={'model_name': 'log'}),
+        migrations.AddField(
+            model_name='command',
+            name='collapse_repeats',
+            field=models.BooleanField(default=True, help_text='Store consecutive identical lines as one log entry with a repeat count'),
+        ),
+        migrations.AddField(
+            model_name='command',
+            name='log_rate_limit',
+            field=models.PositiveIntegerField(default=0, help_text='Most lines per second to store (0 = no limit); the rest are counted in a "lines suppressed" entry'),
+        ),
+        migrations.AddField(
+            model_name='log',
+            name='last_seen_at',
+            field=models.DateTimeField(blank=True, editable=False, null=True),
+        ),
+        migrations.AddField(
+            model_name='log',
+            name='repeat_count',
+            field=models.PositiveIntegerField(default=1),
+        ),
+        migrations.RunPython(restore_fts_triggers, migrations.RunPython.noop, hints={'model_name': 'log'}),
+    ]
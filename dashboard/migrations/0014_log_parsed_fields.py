@@ -0,0 +1,32 @@
+# Generated by Django 5.2.18 on 2026-10-18 16:00
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('dashboard', '0013_log_collapse_rate_limit'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='command',
+            name='log_format',
+            field=models.CharField(blank=True, choices=[('', 'Detect'), ('plain', 'Plain text'), ('json', 'JSON lines'), ('python', 'Python logging'), ('runserver', 'Django runserver')], help_text="How to read level, time and fields from the output; 'Detect' tries each known format", max_length=20),
+        ),
+        migrations.AddField(
+            model_name='log',
+            name='fields',
+            field=models.JSONField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='log',
+            name='logged_at',
+            field=models.DateTimeField(blank=True, editable=False, null=True),
+        ),
+        migrations.AddIndex(
+            model_name='log',
+            index=models.Index(fields=['command', 'level', 'created_at', 'id'], name='log_command_level_created_idx'),
+        ),
+    ]
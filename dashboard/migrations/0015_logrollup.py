@@ -0,0 +1,36 @@
+# Generated by Django 5.2.18 on 2026-10-18 16:02
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('dashboard', '0014_log_parsed_fields'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='LogRollup',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('period', models.PositiveIntegerField(choices=[(60, 'minute'), (3600, 'hour')])),
+                ('bucket', models.DateTimeField(help_text='Start of the minute or hour (UTC)')),
+                ('debug', models.PositiveIntegerField(default=0)),
+                ('info', models.PositiveIntegerField(default=0)),
+                ('warning', models.PositiveIntegerField(default=0)),
+                ('error', models.PositiveIntegerField(default=0)),
+                ('critical', models.PositiveIntegerField(default=0)),
+                ('starts', models.PositiveIntegerField(default=0)),
+                ('restarts', models.PositiveIntegerField(default=0)),
+                ('crashes', models.PositiveIntegerField(default=0)),
+                ('uptime_seconds', models.FloatField(default=0)),
+                ('command', models.ForeignKey(db_constraint=False, on_delete=django.db.models.deletion.DO_NOTHING, related_name='+', to='dashboard.command')),
+            ],
+            options={
+                'indexes': [models.Index(fields=['period', 'bucket'], name='logrollup_period_bucket_idx')],
+                'constraints': [models.UniqueConstraint(fields=('command', 'period', 'bucket'), name='logrollup_command_bucket_uniq')],
+            },
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 5.2.18 on 2026-10-18 16:07
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('dashboard', '0015_logrollup'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='command',
+            name='start_order',
+            field=models.PositiveIntegerField(default=0, help_text='Order in bulk starts: lower numbers start first, equal numbers start together'),
+        ),
+    ]
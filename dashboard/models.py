@@ -1,7 +1,21 @@
+from django.core.exceptions import ValidationError
 from django.db import models
+from django.db.models import Q
+from django.utils import timezone
 from django.contrib.auth import get_user_model
 
 
+LOG_LEVELS = ['DEBUG', 'INFO', 'WARNING', 'ERROR', 'CRITICAL']
+# Command.log_format: a parser in dashboard.parsers, 'plain' for none, or '' to detect
+LOG_FORMATS = [
+    ('', 'Detect'),
+    ('plain', 'Plain text'),
+    ('json', 'JSON lines'),
+    ('python', 'Python logging'),
+    ('runserver', 'Django runserver'),
+]
+
+
 class Site(models.Model):
     name = models.CharField(max_length=200)
     base_dir = models.CharField(max_length=1024, help_text='Base directory for site')
@@ -16,6 +30,22 @@ class Command(models.Model):
     name = models.CharField(max_length=200)
     command_string = models.CharField(max_length=1024)
     active = models.BooleanField(default=True)
+    # set when the supervisor stops auto-restarting after repeated quick crashes
+    crash_looping_since = models.DateTimeField(null=True, blank=True, editable=False)
+    # ingestion policy, applied by the log writer from the next start
+    collapse_repeats = models.BooleanField(
+        default=True, help_text='Store consecutive identical lines as one log entry with a repeat count',
+    )
+    log_rate_limit = models.PositiveIntegerField(
+        default=0, help_text='Most lines per second to store (0 = no limit); the rest are counted in a "lines suppressed" entry',
+    )
+    log_format = models.CharField(
+        max_length=20, blank=True, choices=LOG_FORMATS,
+        help_text="How to read level, time and fields from the output; 'Detect' tries each known format",
+    )
+    start_order = models.PositiveIntegerField(
+        default=0, help_text='Order in bulk starts: lower numbers start first, equal numbers start together',
+    )
 
     class Meta:
         # Django automatically creates add/change/delete permissions for models.
@@ -28,20 +58,149 @@ class Command(models.Model):
         return f"{self.site.name} - {self.name}"
 
 
+class LogQuerySet(models.QuerySet):
+    def matching(self, site=None, command=None, level=None, since=None, until=None):
+        """The filters the logs page, export and `export_logs` share; None means any."""
+        qs = self
+        if site:
+            qs = qs.filter(site_id=site)
+        if command:
+            qs = qs.filter(command_id=command)
+        if level:
+            qs = qs.filter(level=level)
+        if since:
+            qs = qs.filter(created_at__gte=since)
+        if until:
+            qs = qs.filter(created_at__lt=until)
+        return qs
+
+    # Keyset bounds on (created_at, id). The plain created_at range in front of
+    # the OR gives the database an index start point; without it SQLite walks
+    # the index from the beginning on every page.
+    def after(self, created_at, pk):
+        return self.filter(Q(created_at__gt=created_at) | Q(id__gt=pk), created_at__gte=created_at)
+
+    def before(self, created_at, pk):
+        return self.filter(Q(created_at__lt=created_at) | Q(id__lt=pk), created_at__lte=created_at)
+
+
 class Log(models.Model):
-    site = models.ForeignKey(Site, on_delete=models.SET_NULL, null=True, blank=True)
-    command = models.ForeignKey(Command, on_delete=models.SET_NULL, null=True, blank=True)
-    created_at = models.DateTimeField(auto_now_add=True)
+    # No database constraint so the table can live in its own database
+    # (LOG_DATABASE_URL); dashboard.signals nulls these when a site or command is deleted.
+    site = models.ForeignKey(Site, on_delete=models.DO_NOTHING, db_constraint=False, null=True, blank=True)
+    command = models.ForeignKey(Command, on_delete=models.DO_NOTHING, db_constraint=False, null=True, blank=True)
+    # Set when the line is captured rather than when it is written, since
+    # lines are persisted in batches by the log writer.
+    created_at = models.DateTimeField(default=timezone.now, editable=False)
     level = models.CharField(max_length=20, default='INFO')
     message = models.TextField()
+    # consecutive identical lines collapsed into this row, the last seen at last_seen_at
+    repeat_count = models.PositiveIntegerField(default=1)
+    last_seen_at = models.DateTimeField(null=True, blank=True, editable=False)
+    # the line's own timestamp and key/value fields, when dashboard.parsers recognised its format
+    logged_at = models.DateTimeField(null=True, blank=True, editable=False)
+    fields = models.JSONField(null=True, blank=True)
+
+    objects = LogQuerySet.as_manager()
+
+    class Meta:
+        # (created_at, id) is the keyset the log pages paginate on; each filter
+        # the logs page supports gets its own prefix so a page is one index range scan.
+        indexes = [
+            models.Index(fields=['created_at', 'id'], name='log_created_idx'),
+            models.Index(fields=['site', 'created_at', 'id'], name='log_site_created_idx'),
+            models.Index(fields=['command', 'created_at', 'id'], name='log_command_created_idx'),
+            models.Index(fields=['level', 'created_at', 'id'], name='log_level_created_idx'),
+            models.Index(fields=['command', 'level', 'created_at', 'id'], name='log_command_level_created_idx'),
+        ]
 
     def __str__(self):
         return f"[{self.created_at}] {self.level} - {self.message[:80]}"
 
 
+class RetentionPolicy(models.Model):
+    """How long logs are kept for a site, a command and/or a level.
+
+    Blank fields match anything. The most specific matching policy wins
+    (a command beats a site beats the LOG_RETENTION_DAYS default, and a
+    policy naming a level beats one that doesn't).
+    """
+    site = models.ForeignKey(Site, on_delete=models.CASCADE, null=True, blank=True, related_name='retention_policies')
+    command = models.ForeignKey(Command, on_delete=models.CASCADE, null=True, blank=True, related_name='retention_policies')
+    level = models.CharField(max_length=20, blank=True, choices=[(lv, lv) for lv in LOG_LEVELS])
+    days = models.PositiveIntegerField(help_text='Delete logs older than this many days; 0 keeps them forever')
+
+    class Meta:
+        verbose_name_plural = 'retention policies'
+
+    def clean(self):
+        if self.command_id and self.site_id and self.command.site_id != self.site_id:
+            raise ValidationError({'command': 'Command does not belong to the selected site.'})
+
+    def __str__(self):
+        scope = self.command or self.site or 'All logs'
+        level = f" [{self.level}]" if self.level else ''
+        return f"{scope}{level}: {self.days} days" if self.days else f"{scope}{level}: kept forever"
+
+
+class ProcessSample(models.Model):
+    """One minute of resource use by a command's process tree, recorded by the supervisor."""
+    # no database constraint: lives with the logs (LOG_DATABASE_URL) when that is set
+    command = models.ForeignKey(Command, on_delete=models.DO_NOTHING, db_constraint=False, related_name='+')
+    at = models.DateTimeField(help_text='Start of the minute')
+    processes = models.IntegerField(default=0)
+    cpu_percent = models.FloatField(help_text='Average over the minute; 100 = one core')
+    rss_bytes = models.BigIntegerField(help_text='Peak resident memory')
+    open_fds = models.IntegerField(help_text='Peak open file descriptors')
+    read_bytes = models.BigIntegerField(help_text='Read from storage during the minute')
+    write_bytes = models.BigIntegerField(help_text='Written to storage during the minute')
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['command', 'at'], name='processsample_command_at_idx'),
+            models.Index(fields=['at'], name='processsample_at_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.command_id} @ {self.at}: {self.cpu_percent}% {self.rss_bytes} B"
+
+
+class LogRollup(models.Model):
+    """Lines by level and run events of one command over one minute or hour, kept up to date by dashboard.rollups."""
+    MINUTE = 60
+    HOUR = 3600
+
+    # no database constraint: lives with the logs (LOG_DATABASE_URL) when that is set
+    command = models.ForeignKey(Command, on_delete=models.DO_NOTHING, db_constraint=False, related_name='+')
+    period = models.PositiveIntegerField(choices=[(MINUTE, 'minute'), (HOUR, 'hour')])
+    bucket = models.DateTimeField(help_text='Start of the minute or hour (UTC)')
+    debug = models.PositiveIntegerField(default=0)
+    info = models.PositiveIntegerField(default=0)
+    warning = models.PositiveIntegerField(default=0)
+    error = models.PositiveIntegerField(default=0)
+    critical = models.PositiveIntegerField(default=0)
+    starts = models.PositiveIntegerField(default=0)
+    restarts = models.PositiveIntegerField(default=0)
+    crashes = models.PositiveIntegerField(default=0)
+    uptime_seconds = models.FloatField(default=0)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['command', 'period', 'bucket'], name='logrollup_command_bucket_uniq'),
+        ]
+        indexes = [
+            models.Index(fields=['period', 'bucket'], name='logrollup_period_bucket_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.command_id} @ {self.bucket} ({self.get_period_display()})"
+
+
 class CommandRun(models.Model):
     command = models.ForeignKey(Command, on_delete=models.CASCADE, related_name='runs')
     pid = models.IntegerField(null=True, blank=True)
+    # process group the run was spawned in; signalled as a unit on stop/restart
+    pgid = models.IntegerField(null=True, blank=True)
     started_at = models.DateTimeField(auto_now_add=True)
     stopped_at = models.DateTimeField(null=True, blank=True)
     exit_code = models.IntegerField(null=True, blank=True)
@@ -51,6 +210,10 @@ class CommandRun(models.Model):
 
     class Meta:
         ordering = ['-started_at']
+        indexes = [
+            # serves the "current run" and "last exit" lookups on the commands page
+            models.Index(fields=['command', 'stopped_at'], name='commandrun_command_stopped_idx'),
+        ]
 
     def __str__(self):
         status = 'stopped' if self.stopped_at else 'running'
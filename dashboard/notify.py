@@ -0,0 +1,234 @@
+import atexit
+import queue
+import threading
+import time
+
+from django.conf import settings
+
+# Discord rejects messages longer than this
+MAX_MESSAGE_LENGTH = 2000
+
+
+class _Pending:
+    __slots__ = ('count', 'text', 'summary', 'first_at')
+
+    def __init__(self, text, summary, first_at):
+        self.count = 1
+        self.text = text
+        self.summary = summary
+        self.first_at = first_at
+
+
+class DiscordNotifier:
+    """Post notifications to a Discord webhook from a background thread.
+
+    `notify()` only enqueues, so callers never wait on the network. The first
+    event for a key is sent straight away; further events for that key within
+    `window` seconds are counted and sent as one summary line when the window
+    ends (e.g. "... crashed 14 times in the last 60s"). Lines that are due
+    together are packed into as few messages as Discord allows, over one
+    pooled HTTP session. A 429 response or an exhausted rate-limit bucket
+    pauses sending until Discord says to retry; events keep coalescing
+    meanwhile. When the queue is full new events are dropped (and counted).
+    """
+
+    def __init__(self, url, window=60.0, max_queue=1000, timeout=5.0, retries=3):
+        self.url = url
+        self.window = window
+        self.timeout = timeout
+        self.retries = retries
+        self._queue = queue.Queue(maxsize=max_queue)
+        self._lock = threading.Lock()
+        self._thread = None
+        self._stop = threading.Event()
+        self._session = None
+        self._last_sent = {}
+        self._pending = {}
+        self._outbox = []
+        self._blocked_until = 0.0
+        self.sent = 0
+        self.coalesced = 0
+        self.dropped = 0
+        self.failed = 0
+        self.rate_limited = 0
+
+    def notify(self, key, text, summary=None) -> bool:
+        """Queue `text` for delivery. Returns False if notifications are off or the event was dropped.
+
+        `key` groups events for coalescing. `summary` describes one event
+        without a count (e.g. "Command 'x' on site 'y' crashed") and is used
+        when several events for the key are sent together.
+        """
+        if not self.url:
+            return False
+        if not self._thread or not self._thread.is_alive():
+            self.start()
+        try:
+            self._queue.put_nowait((key, text, summary, time.monotonic()))
+        except queue.Full:
+            self.dropped += 1
+            return False
+        return True
+
+    def start(self):
+        with self._lock:
+            if self._thread and self._thread.is_alive():
+                return
+            self._stop.clear()
+            self._thread = threading.Thread(target=self._run, name='discord-notifier', daemon=True)
+            self._thread.start()
+
+    def stop(self, timeout=2.0):
+        """Send whatever is still pending (best effort) and stop the worker."""
+        self._stop.set()
+        if self._thread:
+            self._thread.join(timeout=timeout)
+
+    def stats(self) -> dict:
+        return {
+            'sent': self.sent,
+            'coalesced': self.coalesced,
+            'dropped': self.dropped,
+            'failed': self.failed,
+            'rate_limited': self.rate_limited,
+            'pending': self._queue.qsize() + len(self._pending) + len(self._outbox),
+        }
+
+    def _run(self):
+        while not self._stop.is_set():
+            self._take(self._next_wakeup())
+            self._release_due(time.monotonic())
+            if self._outbox and time.monotonic() >= self._blocked_until:
+                self._send_outbox()
+        # flush summaries that are still waiting for their window to close
+        self._take(0)
+        self._release_due(float('inf'))
+        if self._outbox:
+            self._blocked_until = 0.0
+            self._send_outbox()
+
+    def _next_wakeup(self) -> float:
+        now = time.monotonic()
+        wakeups = [self._last_sent[key] + self.window for key in self._pending]
+        if self._outbox:
+            wakeups.append(self._blocked_until)
+        if not wakeups:
+            return 0.5
+        return min(0.5, max(0.0, min(wakeups) - now))
+
+    def _take(self, timeout: float):
+        """Move queued events into the outbox or the per-key pending counts."""
+        try:
+            event = self._queue.get(timeout=timeout) if timeout > 0 else self._queue.get_nowait()
+        except queue.Empty:
+            return
+        while True:
+            key, text, summary, at = event
+            pending = self._pending.get(key)
+            if pending is not None:
+                pending.count += 1
+                pending.text = text
+                self.coalesced += 1
+            elif at - self._last_sent.get(key, float('-inf')) >= self.window:
+                self._last_sent[key] = at
+                self._outbox.append(text)
+            else:
+                self._pending[key] = _Pending(text, summary, at)
+            try:
+                event = self._queue.get_nowait()
+            except queue.Empty:
+                return
+
+    def _release_due(self, now: float):
+        for key, pending in list(self._pending.items()):
+            if now < self._last_sent[key] + self.window:
+                continue
+            del self._pending[key]
+            self._last_sent[key] = time.monotonic()
+            if pending.count == 1 or not pending.summary:
+                self._outbox.append(pending.text)
+            else:
+                # the count covers every event since the last message for this key
+                window = time.monotonic() - pending.first_at
+                self._outbox.append(f"{pending.summary} {pending.count} times in the last {max(window, 1):.0f}s.")
+        # forget keys that have been quiet for a whole window
+        if len(self._last_sent) > 1000:
+            cutoff = time.monotonic() - self.window
+            self._last_sent = {k: t for k, t in self._last_sent.items() if t >= cutoff or k in self._pending}
+
+    def _send_outbox(self):
+        while self._outbox:
+            if time.monotonic() < self._blocked_until and not self._stop.is_set():
+                # rate limited: keep the lines and try again once allowed
+                return
+            message, rest = _pack(self._outbox)
+            ok = self._post(message)
+            if ok is None:
+                continue
+            if not ok:
+                self.failed += len(self._outbox) - len(rest)
+            self._outbox = rest
+
+    def _post(self, content: str):
+        """Send one message. Returns True on success, None if rate limited (retry later), else False."""
+        import requests
+
+        if self._session is None:
+            self._session = requests.Session()
+        for attempt in range(self.retries):
+            try:
+                response = self._session.post(self.url, json={'content': content}, timeout=self.timeout)
+            except requests.RequestException:
+                time.sleep(min(2 ** attempt, 5))
+                continue
+            if response.status_code == 429:
+                self.rate_limited += 1
+                self._blocked_until = time.monotonic() + _retry_after(response)
+                if self._stop.is_set():
+                    time.sleep(min(self._blocked_until - time.monotonic(), 1.0))
+                    continue
+                return None
+            if response.status_code >= 500:
+                time.sleep(min(2 ** attempt, 5))
+                continue
+            # respect the bucket before the next message rather than waiting for a 429
+            if response.headers.get('X-RateLimit-Remaining') == '0':
+                self._blocked_until = time.monotonic() + _float(response.headers.get('X-RateLimit-Reset-After'))
+            if response.ok:
+                self.sent += 1
+                return True
+            return False
+        return False
+
+
+def _pack(lines: list):
+    """Join as many leading lines as fit in one Discord message; return it and the rest."""
+    message = ''
+    for i, line in enumerate(lines):
+        line = line[:MAX_MESSAGE_LENGTH]
+        candidate = f"{message}\n{line}" if message else line
+        if len(candidate) > MAX_MESSAGE_LENGTH:
+            return message, lines[i:]
+        message = candidate
+    return message, []
+
+
+def _retry_after(response) -> float:
+    try:
+        return float(response.json().get('retry_after'))
+    except (ValueError, TypeError, AttributeError):
+        return _float(response.headers.get('Retry-After'), default=1.0)
+
+
+def _float(value, default=0.0) -> float:
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return default
+
+
+notifier = DiscordNotifier(
+    getattr(settings, 'DISCORD_WEBHOOK_URL', ''),
+    window=getattr(settings, 'DISCORD_COALESCE_WINDOW', 60.0),
+)
+atexit.register(notifier.stop)
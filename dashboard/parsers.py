@@ -0,0 +1,185 @@
+import json
+import re
+from datetime import datetime, timezone as dt_timezone
+
+from django.conf import settings
+from django.utils import timezone
+from django.utils.module_loading import import_string
+
+# Spellings seen in the wild for the levels the dashboard knows
+LEVEL_NAMES = {
+    'DEBUG': 'DEBUG', 'TRACE': 'DEBUG',
+    'INFO': 'INFO', 'NOTICE': 'INFO',
+    'WARNING': 'WARNING', 'WARN': 'WARNING',
+    'ERROR': 'ERROR', 'ERR': 'ERROR', 'EXCEPTION': 'ERROR',
+    'CRITICAL': 'CRITICAL', 'FATAL': 'CRITICAL', 'PANIC': 'CRITICAL',
+}
+_LEVEL = r'(?P<level>DEBUG|INFO|WARNING|WARN|ERROR|CRITICAL|FATAL)'
+_TIMESTAMP = r'(?P<ts>\d{4}-\d{2}-\d{2}[ T]\d{2}:\d{2}:\d{2}(?:[.,]\d+)?(?:Z|[+-]\d{2}:?\d{2})?)'
+
+# `logging.basicConfig()` default: "WARNING:name:message"
+_BASIC = re.compile(rf'^{_LEVEL}:(?P<name>[\w.\-]+):(?P<msg>.*)$', re.S)
+# "<asctime> LEVEL name: message", "[<asctime>] [LEVEL] [name] message",
+# "<asctime> - name - LEVEL - message" and similar
+_STAMPED = re.compile(
+    rf'^\[?{_TIMESTAMP}\]?[\s|-]+'
+    r'(?:(?P<pre>[\w.\-]+)\s+-\s+)?'
+    rf'\[?{_LEVEL}\]?[\s:|-]+'
+    r'(?:\[(?P<name>[\w.\-]+)\]\s*|(?P<name2>[\w.\-]+)(?::\s+|\s+-\s+))?'
+    r'(?P<msg>.*)$',
+    re.S,
+)
+# django.server's "[18/Oct/2026 15:58:47] message"
+_RUNSERVER = re.compile(r'^\[(\d{2})/(\w{3})/(\d{4}) (\d{2}):(\d{2}):(\d{2})\] (?P<msg>.*)$', re.S)
+_MONTHS = {name: i for i, name in enumerate(('Jan', 'Feb', 'Mar', 'Apr', 'May', 'Jun', 'Jul', 'Aug', 'Sep', 'Oct', 'Nov', 'Dec'), 1)}
+_REQUEST = re.compile(r'^"(?P<method>[A-Z]+) (?P<path>\S+) (?P<protocol>[^"]+)" (?P<status>\d{3}) (?P<size>\d+)')
+# runserver's startup and autoreload lines, which carry no level and go to stderr
+_RUNSERVER_INFO = re.compile(
+    r'^(?:Watching for file changes with |Performing system checks|System check identified |Django version '
+    r'|Starting development server at |Quit the server with |\S+ changed, reloading\.)'
+)
+
+_JSON_LEVEL = ('level', 'levelname', 'severity', 'lvl', 'log.level')
+_JSON_MESSAGE = ('message', 'msg', 'event')
+_JSON_TIME = ('timestamp', 'time', 'ts', '@timestamp', 'asctime', 'created')
+
+
+def _level(value):
+    return LEVEL_NAMES.get(str(value).strip().upper()) if value is not None else None
+
+
+def _timestamp(value):
+    """An aware datetime from an ISO string or epoch seconds/milliseconds, or None."""
+    if isinstance(value, (int, float)) and not isinstance(value, bool):
+        try:
+            return datetime.fromtimestamp(value / 1000 if value > 1e11 else value, tz=dt_timezone.utc)
+        except (OverflowError, OSError, ValueError):
+            return None
+    if not isinstance(value, str):
+        return None
+    try:
+        dt = datetime.fromisoformat(value.replace(',', '.').replace('Z', '+00:00'))
+    except ValueError:
+        return None
+    # formatters without an offset write local time
+    return timezone.make_aware(dt) if timezone.is_naive(dt) else dt
+
+
+def _json_safe(fields):
+    """`fields` as strict JSON, which is all Log.fields can store.
+
+    NaN and infinities become strings, and values JSON can't hold become
+    their str(), so one odd value can't get the whole line rejected.
+    """
+    try:
+        json.dumps(fields, allow_nan=False)
+        return fields
+    except (TypeError, ValueError):
+        return json.loads(json.dumps(fields, default=str), parse_constant=str)
+
+
+def parse_json(text):
+    """One JSON object per line, as written by structlog, python-json-logger and most services."""
+    if not text.startswith('{'):
+        return None
+    try:
+        # NaN/Infinity are not JSON; keep them as the strings they were written as
+        data = json.loads(text, parse_constant=str)
+    except ValueError:
+        return None
+    if not isinstance(data, dict):
+        return None
+    level = logged_at = message = None
+    for key in _JSON_LEVEL:
+        if key in data:
+            level = _level(data.pop(key))
+            break
+    for key in _JSON_TIME:
+        if key in data:
+            logged_at = _timestamp(data.pop(key))
+            break
+    for key in _JSON_MESSAGE:
+        if key in data:
+            message = str(data.pop(key))
+            break
+    if message is None:
+        # not a log record after all; keep the line as it was
+        return level, text, logged_at, None
+    return level, message, logged_at, data or None
+
+
+def parse_python(text):
+    """Lines from Python's logging module in its usual formats."""
+    match = _BASIC.match(text)
+    if match:
+        return _level(match['level']), match['msg'], None, {'logger': match['name']}
+    match = _STAMPED.match(text)
+    if not match:
+        return None
+    name = match['name'] or match['name2'] or match['pre']
+    return _level(match['level']), match['msg'], _timestamp(match['ts']), {'logger': name} if name else None
+
+
+def parse_runserver(text):
+    """Django's development server: request lines get a level from their status code, as Django logs them."""
+    match = _RUNSERVER.match(text)
+    if not match:
+        return ('INFO', text, None, None) if _RUNSERVER_INFO.match(text) else None
+    day, month, year, hour, minute, second = match.groups()[:6]
+    try:
+        # cheaper than strptime, which this would otherwise spend most of its time in
+        logged_at = timezone.make_aware(datetime(
+            int(year), _MONTHS[month], int(day), int(hour), int(minute), int(second),
+        ))
+    except (KeyError, ValueError):
+        return None
+    message = match['msg']
+    request = _REQUEST.match(message)
+    if not request:
+        return 'INFO', message, logged_at, None
+    status = int(request['status'])
+    level = 'ERROR' if status >= 500 else 'WARNING' if status >= 400 else 'INFO'
+    return level, message, logged_at, {
+        'method': request['method'], 'path': request['path'], 'status': status, 'size': int(request['size']),
+    }
+
+
+PARSERS = {
+    'json': parse_json,
+    'python': parse_python,
+    'runserver': parse_runserver,
+}
+
+_detect = None
+
+
+def _detectors() -> list:
+    # loaded on first use: custom parsers may import models
+    global _detect
+    if _detect is None:
+        _detect = [
+            PARSERS[name] if name in PARSERS else import_string(name)
+            for name in getattr(settings, 'LOG_PARSERS', list(PARSERS))
+        ]
+    return _detect
+
+
+def parse_line(text, level, fmt=''):
+    """Split a captured line into (level, message, logged_at, fields).
+
+    `level` is the fallback from the stream the line came from (stdout INFO,
+    stderr ERROR). `fmt` is the command's log_format: one parser, 'plain' for
+    none, or '' to try each of LOG_PARSERS in turn. A parser takes the text
+    and returns None if the line isn't its format, else a (level, message,
+    logged_at, fields) tuple whose level, logged_at and fields may be None.
+    """
+    if fmt == 'plain':
+        return level, text, None, None
+    for parser in (PARSERS[fmt],) if fmt in PARSERS else _detectors():
+        parsed = parser(text)
+        if parsed is not None:
+            parsed_level, message, logged_at, fields = parsed
+            if fields is not None:
+                fields = _json_safe(fields)
+            return parsed_level or level, message, logged_at, fields
+    return level, text, None, None
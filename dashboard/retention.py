@@ -0,0 +1,229 @@
+import gzip
+import json
+import os
+import threading
+import time
+from datetime import timedelta
+from pathlib import Path
+
+from django.conf import settings
+from django.core.exceptions import ImproperlyConfigured
+from django.db import close_old_connections
+from django.db.models import Q
+from django.utils import timezone
+
+from .models import Command, Log, RetentionPolicy, Site
+
+
+class Rule:
+    """One retention scope: logs matching site/command/level are kept for `days` (0 = forever)."""
+
+    __slots__ = ('site_id', 'command_id', 'level', 'days', 'label')
+
+    def __init__(self, site_id=None, command_id=None, level='', days=0, label='All logs'):
+        self.site_id = site_id
+        self.command_id = command_id
+        self.level = level
+        self.days = days
+        self.label = label
+
+    @property
+    def specificity(self) -> int:
+        return (4 if self.command_id else 2 if self.site_id else 0) + (1 if self.level else 0)
+
+    def q(self) -> Q:
+        q = Q()
+        if self.command_id:
+            q &= Q(command_id=self.command_id)
+        elif self.site_id:
+            q &= Q(site_id=self.site_id)
+        if self.level:
+            q &= Q(level=self.level)
+        return q
+
+    def overlaps(self, other) -> bool:
+        return all(
+            not a or not b or a == b
+            for a, b in ((self.site_id, other.site_id), (self.command_id, other.command_id), (self.level, other.level))
+        )
+
+
+def retention_rules(default_days=None) -> list:
+    """Every configured rule plus the global default, most specific first."""
+    if default_days is None:
+        default_days = getattr(settings, 'LOG_RETENTION_DAYS', 0)
+    rules = [Rule(days=default_days, label=f'All logs: {default_days} days')]
+    for policy in RetentionPolicy.objects.select_related('site', 'command'):
+        rules.append(Rule(
+            # a command rule only ever matches rows of that command's site
+            site_id=policy.command.site_id if policy.command_id else policy.site_id,
+            command_id=policy.command_id,
+            level=policy.level,
+            days=policy.days,
+            label=str(policy),
+        ))
+    rules.sort(key=lambda r: r.specificity, reverse=True)
+    return rules
+
+
+class LogArchive:
+    """Append pruned rows to compressed NDJSON segments, one file per day and command.
+
+    Each write appends a new gzip member (or zstd frame) to the segment, which
+    standard tools read back as one stream (`zcat`, `zstdcat`). Rows are
+    archived before they are deleted, so an interrupted prune can archive a
+    batch twice but never lose one.
+    """
+
+    def __init__(self, directory, compression='gzip'):
+        self.directory = Path(directory)
+        self.compression = compression
+        if compression == 'gzip':
+            self.suffix = '.ndjson.gz'
+            self._compress = gzip.compress
+        elif compression == 'zstd':
+            try:
+                import zstandard
+            except ImportError:
+                raise ImproperlyConfigured("LOG_ARCHIVE_COMPRESSION='zstd' requires the zstandard package")
+            self.suffix = '.ndjson.zst'
+            self._compress = zstandard.ZstdCompressor().compress
+        else:
+            raise ImproperlyConfigured(f"Unknown LOG_ARCHIVE_COMPRESSION: {compression!r}")
+
+    def path_for(self, day, command_id) -> Path:
+        return self.directory / day.isoformat() / f"command-{command_id or 'none'}{self.suffix}"
+
+    def write(self, rows: list):
+        # names are looked up separately: logs may live in another database
+        sites = dict(Site.objects.filter(id__in={r['site_id'] for r in rows}).values_list('id', 'name'))
+        commands = dict(Command.objects.filter(id__in={r['command_id'] for r in rows}).values_list('id', 'name'))
+        segments = {}
+        for row in rows:
+            created_at = timezone.localtime(row['created_at'])
+            line = json.dumps({
+                'id': row['id'],
+                'created_at': created_at.isoformat(),
+                'site_id': row['site_id'],
+                'site': sites.get(row['site_id'], ''),
+                'command_id': row['command_id'],
+                'command': commands.get(row['command_id'], ''),
+                'level': row['level'],
+                'message': row['message'],
+                'repeat_count': row['repeat_count'],
+                'last_seen_at': timezone.localtime(row['last_seen_at']).isoformat() if row['last_seen_at'] else None,
+                'logged_at': timezone.localtime(row['logged_at']).isoformat() if row['logged_at'] else None,
+                'fields': row['fields'],
+            })
+            segments.setdefault((created_at.date(), row['command_id']), []).append(line)
+        for (day, command_id), lines in segments.items():
+            path = self.path_for(day, command_id)
+            path.parent.mkdir(parents=True, exist_ok=True)
+            data = self._compress(('\n'.join(lines) + '\n').encode())
+            with open(path, 'ab') as f:
+                f.write(data)
+                f.flush()
+                os.fsync(f.fileno())
+
+
+ARCHIVE_FIELDS = ('id', 'created_at', 'site_id', 'command_id', 'level', 'message', 'repeat_count', 'last_seen_at', 'logged_at', 'fields')
+
+
+def prune_logs(batch_size=1000, pause=0.0, archive=None, dry_run=False, now=None, stop=None) -> list:
+    """Delete (and optionally archive) logs past their retention, in small batches.
+
+    Each rule only touches rows that no more specific rule claims. Rows are
+    removed `batch_size` at a time, oldest first, each batch in its own short
+    transaction with an optional `pause` in between so ingestion is never
+    locked out for long. Returns a list of (rule, rows) pairs.
+    """
+    now = now or timezone.now()
+    rules = retention_rules()
+    results = []
+    for i, rule in enumerate(rules):
+        if not rule.days:
+            continue
+        qs = Log.objects.filter(rule.q(), created_at__lt=now - timedelta(days=rule.days))
+        for other in rules[:i]:
+            if other.specificity > rule.specificity and other.overlaps(rule):
+                qs = qs.exclude(other.q())
+        if dry_run:
+            results.append((rule, qs.count()))
+            continue
+        results.append((rule, _delete_batches(qs, batch_size, pause, archive, stop)))
+        if stop is not None and stop.is_set():
+            break
+    return results
+
+
+def _delete_batches(qs, batch_size, pause, archive, stop) -> int:
+    qs = qs.order_by('created_at', 'id')
+    deleted = 0
+    while stop is None or not stop.is_set():
+        if archive is not None:
+            rows = list(qs.values(*ARCHIVE_FIELDS)[:batch_size])
+            ids = [row['id'] for row in rows]
+            if rows:
+                archive.write(rows)
+        else:
+            ids = list(qs.values_list('id', flat=True)[:batch_size])
+        if not ids:
+            break
+        Log.objects.filter(id__in=ids).delete()
+        deleted += len(ids)
+        if len(ids) < batch_size:
+            break
+        if pause:
+            time.sleep(pause)
+    return deleted
+
+
+def default_archive():
+    directory = getattr(settings, 'LOG_ARCHIVE_DIR', '')
+    if not directory:
+        return None
+    return LogArchive(directory, getattr(settings, 'LOG_ARCHIVE_COMPRESSION', 'gzip'))
+
+
+class LogPruner:
+    """Run `prune_logs` every `interval` seconds on a background thread (0 disables it)."""
+
+    def __init__(self, interval=3600.0, batch_size=1000, pause=0.05):
+        self.interval = interval
+        self.batch_size = batch_size
+        self.pause = pause
+        self.last_run = None
+        self.last_deleted = 0
+        self._thread = None
+        self._stop = threading.Event()
+
+    def start(self):
+        if not self.interval or (self._thread and self._thread.is_alive()):
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name='log-pruner', daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+
+    def _run(self):
+        # give startup (orphan cleanup, restarts) a head start before the first pass
+        while not self._stop.wait(min(self.interval, 60) if self.last_run is None else self.interval):
+            close_old_connections()
+            try:
+                results = prune_logs(
+                    batch_size=self.batch_size, pause=self.pause, archive=default_archive(), stop=self._stop,
+                )
+                self.last_deleted = sum(n for _, n in results)
+            except Exception:
+                pass
+            finally:
+                self.last_run = timezone.now()
+                close_old_connections()
+
+
+pruner = LogPruner(
+    interval=getattr(settings, 'LOG_PRUNE_INTERVAL', 3600.0),
+    batch_size=getattr(settings, 'LOG_PRUNE_BATCH_SIZE', 1000),
+)
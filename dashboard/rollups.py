@@ -0,0 +1,283 @@
+import threading
+import time
+from datetime import datetime, timedelta, timezone as dt_timezone
+
+from django.conf import settings
+from django.db import close_old_connections, router, transaction
+from django.db.models import F, Sum
+from django.db.models.functions import TruncMinute
+from django.utils import timezone
+
+from .models import Command, CommandRun, Log, LogRollup
+
+PERIODS = (LogRollup.MINUTE, LogRollup.HOUR)
+LEVEL_FIELDS = {'DEBUG': 'debug', 'INFO': 'info', 'WARNING': 'warning', 'ERROR': 'error', 'CRITICAL': 'critical'}
+COUNTERS = ('debug', 'info', 'warning', 'error', 'critical', 'starts', 'restarts', 'crashes', 'uptime_seconds')
+
+
+def bucket_start(at, period) -> datetime:
+    ts = at.timestamp()
+    return datetime.fromtimestamp(ts - ts % period, tz=dt_timezone.utc)
+
+
+def _add(pending, command_id, at, field, amount):
+    counts = pending.setdefault((command_id, bucket_start(at, LogRollup.MINUTE)), {})
+    counts[field] = counts.get(field, 0) + amount
+
+
+def _add_uptime(pending, command_id, start, end):
+    """Spread the running time between `start` and `end` over the minutes it covers."""
+    while start < end:
+        edge = min(end, bucket_start(start, LogRollup.MINUTE) + timedelta(minutes=1))
+        _add(pending, command_id, start, 'uptime_seconds', (edge - start).total_seconds())
+        start = edge
+
+
+def write_rollups(pending: dict):
+    """Add minute counts to their minute and hour rows, in one transaction."""
+    rows = {}
+    for (command_id, minute), counts in pending.items():
+        for period in PERIODS:
+            key = (command_id, period, bucket_start(minute, period))
+            merged = rows.setdefault(key, {})
+            for field, amount in counts.items():
+                merged[field] = merged.get(field, 0) + amount
+    with transaction.atomic(using=router.db_for_write(LogRollup)):
+        for (command_id, period, bucket), counts in rows.items():
+            updated = LogRollup.objects.filter(command_id=command_id, period=period, bucket=bucket).update(
+                **{field: F(field) + amount for field, amount in counts.items()}
+            )
+            if not updated:
+                LogRollup.objects.create(command_id=command_id, period=period, bucket=bucket, **counts)
+
+
+class Rollups:
+    """Keep LogRollup rows current from the ingestion path and the supervisor.
+
+    Stored log lines (by level, counting collapsed repeats), starts,
+    restarts and crashes are added up in memory per command and minute, and
+    every `interval` seconds a background thread adds them to the minute
+    and hour rows, along with the time each command in `targets()` spent
+    running. Reading an overview is then a handful of rows per command,
+    however many log lines there are. Minute rows are kept for
+    `minute_days`, hour rows for `hour_days`.
+    """
+
+    def __init__(self, interval=10.0, minute_days=2, hour_days=90):
+        self.interval = interval
+        self.minute_days = minute_days
+        self.hour_days = hour_days
+        self.targets = None
+        self.flush_errors = 0
+        self._pending = {}
+        self._lock = threading.Lock()
+        self._thread = None
+        self._stop = threading.Event()
+        self._last_tick = None
+        self._last_prune = 0.0
+
+    @property
+    def active(self) -> bool:
+        return self._thread is not None and self._thread.is_alive()
+
+    def start(self, targets):
+        """Start counting; `targets()` returns tuples whose first item is a running command's id."""
+        if self.active:
+            return
+        self.targets = targets
+        self._stop.clear()
+        self._last_tick = timezone.now()
+        self._thread = threading.Thread(target=self._run, name='log-rollups', daemon=True)
+        self._thread.start()
+
+    def stop(self, timeout=2.0):
+        self._stop.set()
+        if self._thread:
+            self._thread.join(timeout=timeout)
+
+    def count_logs(self, entries):
+        # only the supervising process flushes, so only it counts
+        if not self.active:
+            return
+        with self._lock:
+            for entry in entries:
+                if entry.command_id:
+                    _add(self._pending, entry.command_id, entry.created_at,
+                         LEVEL_FIELDS.get(entry.level, 'info'), entry.repeat_count)
+
+    def record_start(self, command, restart=False):
+        if not self.active:
+            return
+        now = timezone.now()
+        with self._lock:
+            _add(self._pending, command.id, now, 'starts', 1)
+            if restart:
+                _add(self._pending, command.id, now, 'restarts', 1)
+
+    def record_crash(self, command):
+        if not self.active:
+            return
+        with self._lock:
+            _add(self._pending, command.id, timezone.now(), 'crashes', 1)
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            self.flush()
+        self.flush()
+
+    def flush(self):
+        now = timezone.now()
+        try:
+            running = {target[0] for target in self.targets()} if self.targets else set()
+        except Exception:
+            running = set()
+        with self._lock:
+            for command_id in running:
+                _add_uptime(self._pending, command_id, self._last_tick, now)
+            self._last_tick = now
+            pending, self._pending = self._pending, {}
+        if not pending:
+            return
+        try:
+            write_rollups(pending)
+        except Exception:
+            self.flush_errors += 1
+            # keep the counts for the next attempt
+            with self._lock:
+                for key, counts in pending.items():
+                    merged = self._pending.setdefault(key, {})
+                    for field, amount in counts.items():
+                        merged[field] = merged.get(field, 0) + amount
+            close_old_connections()
+            return
+        if time.monotonic() - self._last_prune > 3600:
+            self._last_prune = time.monotonic()
+            LogRollup.objects.filter(period=LogRollup.MINUTE, bucket__lt=now - timedelta(days=self.minute_days)).delete()
+            LogRollup.objects.filter(period=LogRollup.HOUR, bucket__lt=now - timedelta(days=self.hour_days)).delete()
+
+
+def rebuild_rollups(since, now=None) -> int:
+    """Recompute rollups from `since` from the stored logs and runs (one pass; for upgrades and repairs).
+
+    Returns the number of command-minutes written. Rows from `since` on are
+    replaced, so run it while the supervisor is stopped or expect the
+    minutes in flight to be counted twice.
+    """
+    now = now or timezone.now()
+    since = bucket_start(since, LogRollup.HOUR)
+    pending = {}
+    lines = (
+        Log.objects.filter(created_at__gte=since, created_at__lt=now, command__isnull=False)
+        .annotate(minute=TruncMinute('created_at', tzinfo=dt_timezone.utc))
+        .values_list('command_id', 'minute', 'level')
+        .annotate(n=Sum('repeat_count'))
+        .order_by()
+    )
+    for command_id, minute, level, n in lines:
+        _add(pending, command_id, minute, LEVEL_FIELDS.get(level, 'info'), n)
+    runs = CommandRun.objects.filter(started_at__lt=now).exclude(stopped_at__lt=since)
+    for run in runs.iterator():
+        if run.started_at >= since:
+            _add(pending, run.command_id, run.started_at, 'starts', 1)
+            if run.restart_count:
+                _add(pending, run.command_id, run.started_at, 'restarts', 1)
+        if run.stopped_at and run.stopped_at >= since and not (run.manually_stopped or run.killed):
+            _add(pending, run.command_id, run.stopped_at, 'crashes', 1)
+        _add_uptime(pending, run.command_id, max(run.started_at, since), min(run.stopped_at or now, now))
+    known = set(Command.objects.values_list('id', flat=True))
+    pending = {key: counts for key, counts in pending.items() if key[0] in known}
+    LogRollup.objects.filter(bucket__gte=since).delete()
+    write_rollups(pending)
+    return len(pending)
+
+
+rollups = Rollups(
+    interval=getattr(settings, 'ROLLUP_FLUSH_INTERVAL', 10.0),
+    minute_days=getattr(settings, 'ROLLUP_MINUTE_DAYS', 2),
+    hour_days=getattr(settings, 'ROLLUP_HOUR_DAYS', 90),
+)
+
+
+def sparkline(values, width=120, height=24) -> str:
+    """SVG polyline points for `values`, scaled to the box (the top is the largest value)."""
+    if not values:
+        return ''
+    top = max(values) or 1
+    step = width / max(len(values) - 1, 1)
+    return ' '.join(
+        f'{i * step:.1f},{height - 1 - (height - 2) * v / top:.1f}' for i, v in enumerate(values)
+    )
+
+
+def _series(rows, start, period, count) -> list:
+    """Per-bucket totals of each counter, oldest first, with empty buckets as zeros."""
+    series = [dict.fromkeys(COUNTERS, 0) for _ in range(count)]
+    for row in rows:
+        i = int((row['bucket'] - start).total_seconds() // period)
+        if 0 <= i < count:
+            for field in COUNTERS:
+                series[i][field] += row[field]
+    return series
+
+
+def _summarise(hours, minutes, elapsed) -> dict:
+    totals = {field: sum(h[field] for h in hours) for field in COUNTERS}
+    lines_per_hour = [sum(h[f] for f in LEVEL_FIELDS.values()) for h in hours]
+    errors_per_hour = [h['error'] + h['critical'] for h in hours]
+    lines_per_minute = [sum(m[f] for f in LEVEL_FIELDS.values()) for m in minutes]
+    return {
+        'lines': sum(lines_per_hour),
+        'warnings': totals['warning'],
+        'errors': totals['error'] + totals['critical'],
+        'starts': totals['starts'],
+        'restarts': totals['restarts'],
+        'crashes': totals['crashes'],
+        'uptime_percent': round(100 * totals['uptime_seconds'] / elapsed, 1),
+        'lines_spark': sparkline(lines_per_hour),
+        'errors_spark': sparkline(errors_per_hour),
+        'minutes_spark': sparkline(lines_per_minute),
+        'lines_last_hour': sum(lines_per_minute),
+    }
+
+
+def overview(hours=24, minutes=60, now=None) -> list:
+    """Each site with per-command and site totals for the last `hours`, from rollups only.
+
+    Reads at most commands x (hours + minutes) rollup rows, so the cost does
+    not depend on how many log lines were stored. Site figures are the sums
+    of their commands' (uptime is averaged).
+    """
+    now = now or timezone.now()
+    hour_start = bucket_start(now, LogRollup.HOUR) - timedelta(hours=hours - 1)
+    minute_start = bucket_start(now, LogRollup.MINUTE) - timedelta(minutes=minutes - 1)
+    hourly, by_minute = {}, {}
+    for row in LogRollup.objects.filter(period=LogRollup.HOUR, bucket__gte=hour_start).values('command_id', 'bucket', *COUNTERS):
+        hourly.setdefault(row['command_id'], []).append(row)
+    for row in LogRollup.objects.filter(period=LogRollup.MINUTE, bucket__gte=minute_start).values('command_id', 'bucket', *COUNTERS):
+        by_minute.setdefault(row['command_id'], []).append(row)
+    running = set(CommandRun.objects.filter(stopped_at__isnull=True).values_list('command_id', flat=True))
+    elapsed = (now - hour_start).total_seconds()
+
+    sites = {}
+    for command in Command.objects.select_related('site').order_by('site__name', 'name'):
+        hours_series = _series(hourly.get(command.id, ()), hour_start, LogRollup.HOUR, hours)
+        minutes_series = _series(by_minute.get(command.id, ()), minute_start, LogRollup.MINUTE, minutes)
+        site = sites.setdefault(command.site_id, {
+            'site': command.site, 'commands': [],
+            'hours': [dict.fromkeys(COUNTERS, 0) for _ in range(hours)],
+            'minutes': [dict.fromkeys(COUNTERS, 0) for _ in range(minutes)],
+        })
+        for total, part in zip(site['hours'] + site['minutes'], hours_series + minutes_series):
+            for field in COUNTERS:
+                total[field] += part[field]
+        site['commands'].append(dict(
+            _summarise(hours_series, minutes_series, elapsed),
+            command=command, running=command.id in running,
+        ))
+    result = []
+    for site in sites.values():
+        count = len(site['commands'])
+        summary = _summarise(site.pop('hours'), site.pop('minutes'), elapsed * count)
+        summary['running'] = sum(c['running'] for c in site['commands'])
+        result.append(dict(site, **summary))
+    return result
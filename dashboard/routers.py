@@ -0,0 +1,33 @@
+LOG_DATABASE = 'logs'
+
+# Write-heavy tables that live in the LOG_DATABASE_URL database when one is set
+ROUTED_MODELS = {'dashboard.log', 'dashboard.processsample', 'dashboard.logrollup'}
+
+
+class LogRouter:
+    """Keep write-heavy log tables off the database that serves logins and start/stop.
+
+    Only installed when LOG_DATABASE_URL is set. Routed models never join to
+    control-plane tables: they refer to sites and commands by id only (no
+    database constraint), and views load those with prefetch_related.
+    """
+
+    def _db(self, model):
+        return LOG_DATABASE if model._meta.label_lower in ROUTED_MODELS else 'default'
+
+    def db_for_read(self, model, **hints):
+        # answer for every model, otherwise Django follows the instance hint
+        # and looks up a log's site in the logs database
+        return self._db(model)
+
+    def db_for_write(self, model, **hints):
+        return self._db(model)
+
+    def allow_relation(self, obj1, obj2, **hints):
+        return True
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        if model_name is None:
+            return db != LOG_DATABASE
+        routed = f'{app_label}.{model_name}' in ROUTED_MODELS
+        return routed == (db == LOG_DATABASE)
@@ -0,0 +1,98 @@
+import re
+
+from django.core.exceptions import EmptyResultSet, FullResultSet
+from django.db import connections, router
+from django.db.models import prefetch_related_objects
+
+from .models import Log
+
+# Created by migration 0011 on SQLite builds with FTS5
+FTS_TABLE = 'dashboard_log_fts'
+
+_TERMS = re.compile(r'"[^"]*"|\S+')
+_available = {}
+
+
+def fts_query(text: str) -> str:
+    """Turn search box input into an FTS5 query that can't be a syntax error.
+
+    Every word or "quoted phrase" must match; a trailing * makes a word a
+    prefix (`conn*`). Operators and punctuation are treated as plain text.
+    """
+    terms = []
+    for term in _TERMS.findall(text):
+        prefix = term.endswith('*') and len(term) > 1
+        term = term.rstrip('*').strip('"')
+        if not term:
+            continue
+        terms.append('"%s"%s' % (term.replace('"', '""'), '*' if prefix else ''))
+    return ' '.join(terms)
+
+
+def search_available(using) -> bool:
+    """Whether the database holding logs has a full-text index to search."""
+    if using not in _available:
+        connection = connections[using]
+        if connection.vendor == 'postgresql':
+            _available[using] = True
+        elif connection.vendor == 'sqlite':
+            _available[using] = FTS_TABLE in connection.introspection.table_names()
+        else:
+            _available[using] = False
+    return _available[using]
+
+
+def search_logs(qs, text: str, limit: int, offset: int = 0) -> list:
+    """Logs in `qs` matching `text`, best match first.
+
+    Uses the FTS5 table on SQLite and the GIN tsvector index on PostgreSQL;
+    `qs`'s own filters (site, command, level, time range) are applied in the
+    same query. Other databases fall back to a newest-first substring scan.
+    """
+    using = router.db_for_read(Log)
+    if not search_available(using):
+        return list(qs.filter(message__icontains=text).order_by('-created_at', '-id')[offset:offset + limit])
+
+    connection = connections[using]
+    compiler = qs.query.get_compiler(using=using)
+    try:
+        where, where_params = compiler.compile(qs.query.where)
+    except FullResultSet:
+        where, where_params = '', []
+    except EmptyResultSet:
+        return []
+    table = connection.ops.quote_name(Log._meta.db_table)
+
+    if connection.vendor == 'sqlite':
+        query = fts_query(text)
+        if not query:
+            return []
+        sql = (
+            f'SELECT {table}."id" FROM {FTS_TABLE} JOIN {table} ON {table}."id" = {FTS_TABLE}.rowid '
+            f'WHERE {FTS_TABLE} MATCH %s'
+        )
+        params = [query]
+        order = f'{FTS_TABLE}.rank, {table}."id" DESC'
+    else:
+        # must match the indexed expression exactly for the GIN index to be used
+        vector = f"to_tsvector('simple', {table}.\"message\")"
+        sql = f"SELECT {table}.\"id\" FROM {table} WHERE {vector} @@ websearch_to_tsquery('simple', %s)"
+        params = [text]
+        order = f"ts_rank_cd({vector}, websearch_to_tsquery('simple', %s)) DESC, {table}.\"id\" DESC"
+    if where:
+        sql += f' AND ({where})'
+        params += where_params
+    sql += f' ORDER BY {order} LIMIT %s OFFSET %s'
+    if connection.vendor != 'sqlite':
+        params.append(text)
+    params += [limit, offset]
+
+    with connection.cursor() as cursor:
+        cursor.execute(sql, params)
+        ids = [row[0] for row in cursor.fetchall()]
+    by_id = qs.model._default_manager.using(using).in_bulk(ids)
+    rows = [by_id[pk] for pk in ids if pk in by_id]
+    # keep the queryset's related-object prefetching for the page
+    if qs._prefetch_related_lookups:
+        prefetch_related_objects(rows, *qs._prefetch_related_lookups)
+    return rows
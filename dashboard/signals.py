@@ -0,0 +1,31 @@
+from django.db.backends.signals import connection_created
+from django.db.models.signals import pre_delete
+from django.dispatch import receiver
+
+from .models import Command, Log, LogRollup, ProcessSample, Site
+from .routers import LOG_DATABASE
+
+
+@receiver(pre_delete, sender=Site)
+def _detach_site_logs(sender, instance, **kwargs):
+    # Log.site has no database constraint (logs may live in another
+    # database), so SET_NULL is done here instead of by the FK
+    Log.objects.filter(site=instance).update(site=None)
+
+
+@receiver(pre_delete, sender=Command)
+def _detach_command_logs(sender, instance, **kwargs):
+    Log.objects.filter(command=instance).update(command=None)
+    ProcessSample.objects.filter(command=instance).delete()
+    LogRollup.objects.filter(command=instance).delete()
+
+
+@receiver(connection_created)
+def _tune_log_database(sender, connection, **kwargs):
+    # The log database only holds data that can be re-collected, so trade a
+    # little durability on power loss for write throughput: WAL lets readers
+    # run alongside the writer, synchronous=NORMAL skips an fsync per commit.
+    if connection.alias == LOG_DATABASE and connection.vendor == 'sqlite':
+        with connection.cursor() as cursor:
+            cursor.execute('PRAGMA journal_mode=WAL')
+            cursor.execute('PRAGMA synchronous=NORMAL')
@@ -1,222 +1,613 @@
+import heapq
 import os
+import queue
+import random
+import selectors
 import signal
 import subprocess
 import threading
 import time
-from datetime import datetime
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
 import shlex
 import shutil
 import sys
 
 from django.conf import settings
 from django.utils import timezone
-from django.db import close_old_connections
+from django.db import close_old_connections, connections
+from django.db.models import Q
 
-from .models import CommandRun, Command, Log, Site
+from .models import CommandRun, Command, Log, ProcessSample, Site
+from .logwriter import log_writer
+from .notify import notifier
+from .logstream import broadcaster, follow, tail_buffer
+from .leader import LeaderElection
+from .retention import pruner
+from .rollups import rollups
+from .metrics import ProcessSampler
+from . import control
 
-import requests
 
+def _process_table() -> list:
+    """One snapshot of (pid, cmdline) for every process on the host.
 
-def _try_kill_pid(pid: int, sig=signal.SIGTERM, wait: float = 1.0) -> None:
+    Reads /proc directly where it exists; otherwise asks psutil.
+    """
+    procs = []
+    if os.path.isdir('/proc'):
+        for entry in os.listdir('/proc'):
+            if not entry.isdigit():
+                continue
+            try:
+                with open(f'/proc/{entry}/cmdline', 'rb') as f:
+                    raw = f.read()
+            except OSError:
+                continue
+            if raw:
+                procs.append((int(entry), raw.rstrip(b'\0').replace(b'\0', b' ').decode('utf-8', errors='replace')))
+        return procs
     try:
-        # Try killing the process group first (covers children)
-        os.killpg(pid, sig)
+        import psutil
+        for proc in psutil.process_iter(['pid', 'cmdline']):
+            cmdline = ' '.join(proc.info.get('cmdline') or [])
+            if cmdline:
+                procs.append((proc.info['pid'], cmdline))
     except Exception:
+        pass
+    return procs
+
+
+def _find_matching_processes(patterns: list) -> set:
+    """Pids whose command line contains any of `patterns`, from a single pass over the process table."""
+    patterns = [p for p in patterns if p]
+    if not patterns:
+        return set()
+    ours = {os.getpid(), os.getppid()}
+    return {
+        pid for pid, cmdline in _process_table()
+        if pid not in ours and any(pat in cmdline for pat in patterns)
+    }
+
+
+def _kill_matching_processes(patterns: list, site: Site = None, command_obj: Command = None) -> None:
+    """Aggressively kill processes whose command line matches any pattern.
+
+    This is the fallback for processes the supervisor has no record of;
+    processes it spawned are killed through their process group instead.
+    """
+    pids = _find_matching_processes(patterns)
+    if not pids:
+        return
+
+    for pid in pids:
         try:
-            os.kill(pid, sig)
+            Log.objects.create(site=site, command=command_obj, level='INFO', message=f'Killing matched process before restart: pid={pid}')
         except Exception:
-            return
+            pass
+    try:
+        _terminate_all(pids)
+    except Exception:
+        pass
+    # mark any DB runs with these pids as stopped and killed
+    try:
+        CommandRun.objects.filter(pid__in=pids, stopped_at__isnull=True).update(stopped_at=timezone.now(), killed=True)
+    except Exception:
+        pass
 
-    # wait briefly for process to exit
-    if wait and _process_exists(pid):
-        end = time.time() + wait
-        while time.time() < end:
-            if not _process_exists(pid):
-                return
-            time.sleep(0.1)
-        # force kill if still alive
+
+def _terminate_all(targets, grace: float = 2.0) -> set:
+    """SIGTERM every target at once, wait for all of them against a single
+    deadline, then SIGKILL whatever is left. Returns the targets that had to
+    be force-killed.
+
+    Targets are os.kill() ids: a pid, or a negated pgid for a whole process group.
+    """
+    alive = set()
+    for target in targets:
         try:
-            os.killpg(pid, signal.SIGKILL)
-        except Exception:
-            try:
-                os.kill(pid, signal.SIGKILL)
-            except Exception:
-                pass
+            os.kill(target, signal.SIGTERM)
+            alive.add(target)
+        except OSError:
+            pass
+    deadline = time.monotonic() + grace
+    while alive and time.monotonic() < deadline:
+        time.sleep(0.05)
+        alive &= _live_targets(alive)
+    for target in alive:
+        try:
+            os.kill(target, signal.SIGKILL)
+        except OSError:
+            pass
+    return alive
 
 
-    def _kill_matching_processes(patterns: list, site: Site = None, command_obj: Command = None) -> None:
-        """Aggressively kill processes whose command line matches any pattern.
+def _live_targets(targets) -> set:
+    """The `targets` (pids, or negated pgids) that still have a running process.
 
-        Tries to use psutil when available; otherwise falls back to `pgrep -f`.
-        """
-        pids = set()
+    Zombies don't count: our own children stay zombies until the I/O loop
+    gets round to reaping them, and waiting for that would make stopping
+    many commands at once as slow as handling their exits one by one.
+    """
+    if not os.path.isdir('/proc'):
+        return {target for target in targets if _process_exists(target)}
+    live = set()
+    for entry in os.listdir('/proc'):
+        if not entry.isdigit():
+            continue
+        try:
+            with open(f'/proc/{entry}/stat', 'rb') as f:
+                stat = f.read()
+            # fields after the command name, which may itself contain ') '
+            state, _, pgid = stat[stat.rindex(b')') + 2:].split()[:3]
+        except (OSError, ValueError):
+            continue
+        if state == b'Z':
+            continue
+        if int(entry) in targets:
+            live.add(int(entry))
+        if -int(pgid) in targets:
+            live.add(-int(pgid))
+    return live
+
+
+# launchers whose real work runs outside the process group we spawn (in a
+# container, or under another session), so killing that group isn't enough
+_DETACHED_LAUNCHERS = {'docker', 'docker-compose', 'podman', 'kubectl', 'ssh', 'sudo'}
+
+
+def _runs_outside_group(cmd_line: str) -> bool:
+    try:
+        parts = shlex.split(cmd_line)
+    except ValueError:
+        parts = cmd_line.split()
+    return any(os.path.basename(part) in _DETACHED_LAUNCHERS for part in parts[:3])
+
+
+def _process_exists(pid: int) -> bool:
+    try:
+        os.kill(pid, 0)
+    except OSError:
+        return False
+    else:
+        return True
+
+
+class _ProcState:
+    """Per-process entry in the I/O loop registry."""
+
+    __slots__ = ('proc', 'site', 'command', 'run', 'partial', 'pidfd')
+
+    def __init__(self, proc, site, command, run):
+        self.proc = proc
+        self.site = site
+        self.command = command
+        self.run = run
+        # unterminated tail of each stream, keyed by fd
+        self.partial = {}
+        self.pidfd = None
+
+
+def _pidfd_open(pid: int):
+    """Return a pidfd for `pid`, or None where pidfds are unsupported (non-Linux, kernel < 5.3)."""
+    try:
+        return os.pidfd_open(pid)
+    except (AttributeError, OSError):
+        return None
+
+
+class _IOLoop:
+    """One thread multiplexing the output pipes and exits of every supervised process.
+
+    Pipes are registered with a selector and read without blocking; complete
+    lines are handed to the log writer. Each child also gets a pidfd, which
+    becomes readable the moment it exits, so exits are handled immediately
+    and an idle loop sleeps without waking up. Where pidfds are unavailable
+    the loop falls back to a non-blocking `poll()` every `tick` seconds.
+    Exits are reported through `on_exit`, which runs on a second thread so
+    its database work never stops the pipes being drained.
+    """
+
+    MAX_LINE = 64 * 1024
+
+    def __init__(self, on_exit, tick=0.5):
+        self.on_exit = on_exit
+        self.tick = tick
+        self._selector = selectors.DefaultSelector()
+        self._procs = {}
+        self._pending = []
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = None
+        self._exits = queue.Queue()
+        self._exit_thread = None
+        self._wake_r, self._wake_w = os.pipe()
+        os.set_blocking(self._wake_r, False)
+        os.set_blocking(self._wake_w, False)
+        self._selector.register(self._wake_r, selectors.EVENT_READ, None)
+
+    def start(self):
+        if self._thread and self._thread.is_alive():
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name='supervisor-io', daemon=True)
+        self._thread.start()
+        if not (self._exit_thread and self._exit_thread.is_alive()):
+            self._exit_thread = threading.Thread(target=self._handle_exits, name='supervisor-exits', daemon=True)
+            self._exit_thread.start()
+
+    def stop(self):
+        self._stop.set()
+        self._wake()
+        if self._thread:
+            self._thread.join(timeout=1)
+        # exits already queued are still handled before the thread ends
+        self._exits.put(None)
+        if self._exit_thread:
+            self._exit_thread.join(timeout=1)
+
+    def add(self, proc, site, command, run):
+        """Register a freshly spawned process; safe to call from any thread."""
+        with self._lock:
+            self._pending.append(_ProcState(proc, site, command, run))
+        self._wake()
 
-        # Try psutil first
+    def running(self) -> int:
+        return len(self._procs)
+
+    def _wake(self):
         try:
-            import psutil
-            for proc in psutil.process_iter(['pid', 'cmdline']):
-                try:
-                    cmdline = ' '.join(proc.info.get('cmdline') or [])
-                    if not cmdline:
-                        continue
-                    for pat in patterns:
-                        if pat in cmdline:
-                            pids.add(proc.info['pid'])
-                            break
-                except Exception:
+            os.write(self._wake_w, b'\0')
+        except (BlockingIOError, OSError):
+            pass
+
+    def _run(self):
+        close_old_connections()
+        while not self._stop.is_set():
+            self._register_pending()
+            # only tick when some child has no pidfd to wake us on exit
+            polled = any(state.pidfd is None for state in self._procs.values())
+            try:
+                events = self._selector.select(timeout=self.tick if polled else None)
+            except Exception:
+                events = []
+            for key, _ in events:
+                if key.fd == self._wake_r:
+                    try:
+                        while os.read(self._wake_r, 512):
+                            pass
+                    except (BlockingIOError, OSError):
+                        pass
+                    continue
+                # an earlier event in this batch (e.g. an exit draining its
+                # pipes) may already have closed and unregistered this fd
+                if self._selector.get_map().get(key.fd) is not key:
                     continue
-        except Exception:
-            # Fallback: use pgrep -f to find pids for each pattern
-            for pat in patterns:
                 try:
-                    cmd = f"pgrep -f {shlex.quote(pat)}"
-                    out = subprocess.run(cmd, shell=True, capture_output=True, text=True)
-                    if out.returncode == 0 and out.stdout:
-                        for line in out.stdout.splitlines():
-                            try:
-                                pids.add(int(line.strip()))
-                            except Exception:
-                                continue
+                    if isinstance(key.data, _ProcState):
+                        self._reap(key.data)
+                    else:
+                        self._read(key)
                 except Exception:
-                    continue
+                    # one misbehaving process must not take the loop down
+                    pass
+            if polled:
+                for state in list(self._procs.values()):
+                    if state.pidfd is None:
+                        self._reap(state)
 
-        for pid in list(pids):
+    def _handle_exits(self):
+        close_old_connections()
+        while True:
+            item = self._exits.get()
+            if item is None:
+                # a stop; ignore it if the loop was started again since
+                if self._stop.is_set():
+                    return
+                continue
             try:
-                Log.objects.create(site=site, command=command_obj, level='INFO', message=f'Killing matched process before restart: pid={pid}')
+                self.on_exit(*item)
             except Exception:
                 pass
+
+    def _register_pending(self):
+        with self._lock:
+            pending, self._pending = self._pending, []
+        for state in pending:
+            self._procs[state.proc.pid] = state
+            for stream, level in ((state.proc.stdout, 'INFO'), (state.proc.stderr, 'ERROR')):
+                if stream is None:
+                    continue
+                fd = stream.fileno()
+                os.set_blocking(fd, False)
+                state.partial[fd] = b''
+                self._selector.register(fd, selectors.EVENT_READ, (state, stream, level))
+            state.pidfd = _pidfd_open(state.proc.pid)
+            if state.pidfd is not None:
+                self._selector.register(state.pidfd, selectors.EVENT_READ, state)
+            # it may have exited before we got here
+            self._reap(state)
+
+    def _read(self, key) -> bool:
+        """Read what is available on one pipe; returns False once nothing more is readable."""
+        state, stream, level = key.data
+        fd = key.fd
+        try:
+            data = os.read(fd, 65536)
+        except BlockingIOError:
+            return False
+        except OSError:
+            data = b''
+        if not data:
+            # EOF: flush any unterminated line and stop watching this pipe
+            self._emit(state, level, state.partial.pop(fd, b''))
+            self._selector.unregister(fd)
             try:
-                _try_kill_pid(pid, signal.SIGTERM, wait=2.0)
+                stream.close()
             except Exception:
                 pass
-            # mark any DB runs with this pid as stopped and killed
+            return False
+        buf = state.partial.get(fd, b'') + data
+        *lines, rest = buf.split(b'\n')
+        for line in lines:
+            self._emit(state, level, line)
+        if len(rest) > self.MAX_LINE:
+            self._emit(state, level, rest)
+            rest = b''
+        state.partial[fd] = rest
+        return True
+
+    def _drain(self, state):
+        # pick up output written just before exit so it is logged ahead of the exit
+        for fd in list(state.partial):
             try:
-                runs = CommandRun.objects.filter(pid=pid, stopped_at__isnull=True)
-                for r in runs:
-                    try:
-                        r.stopped_at = timezone.now()
-                        r.killed = True
-                        r.save()
-                    except Exception:
-                        pass
+                key = self._selector.get_key(fd)
+            except KeyError:
+                continue
+            while self._read(key):
+                pass
+
+    def _emit(self, state, level, raw: bytes):
+        text = raw.rstrip(b'\r').decode('utf-8', errors='replace')
+        if text:
+            log_writer.write(state.site, state.command, level, text)
+
+    def _reap(self, state):
+        if state.proc.pid not in self._procs:
+            return
+        try:
+            ret = state.proc.poll()
+        except Exception:
+            ret = None
+        if ret is None:
+            return
+        self._drain(state)
+        # pipes stay registered until EOF so output from lingering grandchildren is still captured
+        del self._procs[state.proc.pid]
+        if state.pidfd is not None:
+            try:
+                self._selector.unregister(state.pidfd)
             except Exception:
                 pass
+            os.close(state.pidfd)
+            state.pidfd = None
+        # recording the exit and any restart touches the database; hand it off
+        self._exits.put((state.proc, state.site, state.command, state.run, ret))
 
 
-def _process_exists(pid: int) -> bool:
-    try:
-        os.kill(pid, 0)
-    except OSError:
-        return False
-    else:
+class _RestartScheduler:
+    """Run delayed restarts from a single thread, at most one pending per command."""
+
+    def __init__(self, callback):
+        self.callback = callback
+        self._heap = []
+        self._pending = {}
+        self._cond = threading.Condition()
+        self._thread = None
+
+    def schedule(self, command_id, delay, *args) -> bool:
+        """Queue `callback(command_id, *args)` in `delay` seconds; False if one is already pending."""
+        with self._cond:
+            if command_id in self._pending:
+                return False
+            due = time.monotonic() + delay
+            self._pending[command_id] = due
+            heapq.heappush(self._heap, (due, command_id, args))
+            if not self._thread or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self._run, name='supervisor-restarts', daemon=True)
+                self._thread.start()
+            self._cond.notify()
         return True
 
+    def cancel(self, command_id):
+        with self._cond:
+            self._pending.pop(command_id, None)
+
+    def pending(self) -> dict:
+        """Seconds until each pending restart, keyed by command id."""
+        now = time.monotonic()
+        return {command_id: max(0.0, due - now) for command_id, due in list(self._pending.items())}
+
+    def _run(self):
+        close_old_connections()
+        while True:
+            with self._cond:
+                while True:
+                    # drop entries that were cancelled (or superseded) since being queued
+                    while self._heap and self._pending.get(self._heap[0][1]) != self._heap[0][0]:
+                        heapq.heappop(self._heap)
+                    if not self._heap:
+                        self._cond.wait()
+                        continue
+                    wait = self._heap[0][0] - time.monotonic()
+                    if wait <= 0:
+                        break
+                    self._cond.wait(wait)
+                _, command_id, args = heapq.heappop(self._heap)
+                del self._pending[command_id]
+            try:
+                self.callback(command_id, *args)
+            except Exception:
+                pass
+
 
 class ProcessSupervisor:
-    def __init__(self, poll_interval=5):
-        self.poll_interval = poll_interval
-        self._stop = threading.Event()
-        self._thread = None
+    def __init__(self, io_mode='selector', backoff_base=1.0, backoff_max=300.0,
+                 stable_after=60.0, crash_loop_threshold=5, cleanup_grace=2.0, stop_grace=5.0, start_concurrency=0):
+        self.cleanup_grace = cleanup_grace
+        # bulk actions: one shared SIGTERM grace period, and how many starts run at once (0 = all)
+        self.stop_grace = stop_grace
+        self.start_concurrency = start_concurrency
+        self.io_mode = io_mode
+        # Restart policy: the first crash restarts at once; the n-th
+        # consecutive quick crash (n >= 2) waits between half of and
+        # backoff_base * 2**(n-2) seconds, capped at backoff_max;
+        # a run that lasted stable_after seconds resets the count, and
+        # crash_loop_threshold consecutive quick crashes park the command.
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self.stable_after = stable_after
+        self.crash_loop_threshold = crash_loop_threshold
+        self._started = False
+        self._io = _IOLoop(self._handle_exit) if io_mode == 'selector' else None
+        # command id -> CommandRun for processes we spawned and are watching
+        self._current = {}
+        # command id -> consecutive quick crashes, and the last run whose death was handled
+        self._failures = {}
+        self._last_death = {}
+        self._death_lock = threading.Lock()
+        self._restarts = _RestartScheduler(self._restart)
+        # command id -> unexpected exits / automatic restarts since start, for /metrics
+        self.crashes = {}
+        self.restarts = {}
 
     def start(self):
-        if self._thread and self._thread.is_alive():
+        if self._started:
             return
+        self._started = True
         # On supervisor start, aggressively clean up any leftover runs from previous process
+        # Runs left open by a previous supervisor can't be watched (their
+        # output pipes went with it), so they are killed and closed here; our
+        # own children report their exit through the I/O loop or their
+        # monitor thread.
         try:
-            self._cleanup_runs_on_startup()
+            interrupted = self._cleanup_runs_on_startup()
         except Exception:
-            pass
-        self._thread = threading.Thread(target=self._run_loop, daemon=True)
-        self._thread.start()
+            interrupted = []
+        # what was running when that supervisor went away (e.g. a fail-over) runs again
+        for run in interrupted:
+            log_writer.write(run.command.site, run.command, 'INFO', 'Restarting after the previous supervisor went away')
+            self._restarts.schedule(run.command_id, 0, run.restart_count + 1)
 
     def _cleanup_runs_on_startup(self):
         """Kill any lingering processes recorded in CommandRun (stopped_at is NULL)
 
         This is important when the webapp or supervisor restarts and orphaned
         processes remain running on the system (e.g. manage.py workers).
+        All orphans are signalled together and share one grace period, so
+        cleanup takes about `cleanup_grace` seconds however many there are.
+        Returns the latest killed run of each command that was running (not
+        being stopped, nor parked), to be restarted.
         """
-        runs = CommandRun.objects.filter(stopped_at__isnull=True)
-        if not runs.exists():
-            return
-        # Build lookup of patterns per site/command
+        runs = list(CommandRun.objects.filter(stopped_at__isnull=True).select_related('command__site'))
+        # negative ids stand for (and signal) the whole process group
+        live = _live_targets({-run.pgid for run in runs if run.pgid} | {run.pid for run in runs if run.pid})
+        targets = set()
         for run in runs:
-            # Only act on runs not already marked killed
-            if getattr(run, 'killed', False):
-                continue
-            pid = run.pid
-            try:
-                if pid and _process_exists(pid):
-                    Log.objects.create(site=run.command.site, command=run.command, level='INFO', message=f'Cleaning up lingering process on startup: pid={pid}')
-                    _try_kill_pid(pid, signal.SIGTERM, wait=2.0)
-                    if _process_exists(pid):
-                        _try_kill_pid(pid, signal.SIGKILL, wait=0.5)
-            except Exception:
-                pass
-            try:
-                run.stopped_at = timezone.now()
-                run.killed = True
-                run.save()
-            except Exception:
-                pass
+            if run.pgid and -run.pgid in live:
+                targets.add(-run.pgid)
+                log_writer.write(run.command.site, run.command, 'INFO', f'Cleaning up lingering process group on startup: pgid={run.pgid}')
+            elif run.pid and run.pid in live:
+                targets.add(run.pid)
+                log_writer.write(run.command.site, run.command, 'INFO', f'Cleaning up lingering process on startup: pid={run.pid}')
+
         # Additionally, attempt a broader command-line based cleanup for known command strings
         try:
             patterns = []
             for cmd in Command.objects.all():
                 patterns.append(cmd.command_string)
                 patterns.append(f"manage.py {cmd.command_string}")
-            if patterns:
-                _kill_matching_processes(patterns)
+            grouped = {-t for t in targets if t < 0}
+            for pid in _find_matching_processes(patterns):
+                if pid not in targets and pid not in grouped:
+                    targets.add(pid)
         except Exception:
             pass
 
-    def stop(self):
-        self._stop.set()
-        if self._thread:
-            self._thread.join(timeout=1)
+        _terminate_all(targets, grace=self.cleanup_grace)
+        if runs:
+            CommandRun.objects.filter(id__in=[run.id for run in runs]).update(stopped_at=timezone.now(), killed=True)
+        interrupted = {}
+        for run in sorted(runs, key=lambda run: run.started_at):
+            if not run.manually_stopped and not run.command.crash_looping_since:
+                interrupted[run.command_id] = run
+        return list(interrupted.values())
 
-    def _run_loop(self):
-        while not self._stop.is_set():
-            try:
-                self._check_and_restart()
-            except Exception:
-                # avoid crashing the thread
-                pass
-            time.sleep(self.poll_interval)
+    def stop(self):
+        if self._io:
+            self._io.stop()
 
-    def _check_and_restart(self):
-        runs = CommandRun.objects.filter(stopped_at__isnull=True)
-        for run in runs:
-            pid = run.pid
-            if not pid:
-                continue
-            if _process_exists(pid):
-                continue
-            # process died
-            run.stopped_at = timezone.now()
-            run.exit_code = None
-            run.save()
+    def _on_crash(self, command: Command, run: CommandRun):
+        """Handle an unexpected death exactly once: back off, then restart or park the command."""
+        with self._death_lock:
+            if self._last_death.get(command.id) == run.id:
+                return
+            self._last_death[command.id] = run.id
+            self.crashes[command.id] = self.crashes.get(command.id, 0) + 1
+            rollups.record_crash(command)
+            lifetime = (run.stopped_at - run.started_at).total_seconds() if run.stopped_at else 0
+            failures = 0 if lifetime >= self.stable_after else self._failures.get(command.id, 0)
+            failures += 1
+            self._failures[command.id] = failures
 
-            if run.manually_stopped:
-                continue
+        site = command.site
+        if failures >= self.crash_loop_threshold:
+            Command.objects.filter(pk=command.pk).update(crash_looping_since=timezone.now())
+            log_writer.write(site, command, 'ERROR', f'Process crashed {failures} times in a row; not restarting until started manually')
+            self._notify_discord(run, f"Command '{command}' on site '{site}' is crash-looping ({failures} quick crashes in a row) and has been parked.", kind='parked')
+            return
 
-            # unexpected death: notify and restart
-            self._notify_discord(run)
+        delay = self._backoff(failures)
+        log_writer.write(site, command, 'WARNING', f'Process died unexpectedly; restarting in {delay:.1f}s')
+        self._notify_discord(run)
+        self._restarts.schedule(command.id, delay, run.restart_count + 1)
 
-            # attempt restart
-            try:
-                self.start_command(run.command, restart_count=run.restart_count + 1)
-            except Exception:
-                pass
+    def _backoff(self, failures: int) -> float:
+        if failures <= 1:
+            return 0.0
+        delay = min(self.backoff_max, self.backoff_base * 2 ** (failures - 2))
+        # jitter keeps commands that died together from restarting in lockstep
+        return random.uniform(delay / 2, delay)
 
-    def _notify_discord(self, run: CommandRun):
-        url = getattr(settings, 'DISCORD_WEBHOOK_URL', None)
-        if not url:
+    def _restart(self, command_id, restart_count):
+        try:
+            command = Command.objects.select_related('site').get(pk=command_id)
+        except Command.DoesNotExist:
+            return
+        if command.runs.filter(stopped_at__isnull=True).exists():
+            # something else (e.g. an operator) already started it
             return
-        text = f"Command '{run.command}' on site '{run.command.site}' died unexpectedly and will be restarted."
         try:
-            requests.post(url, json={'content': text}, timeout=5)
+            self.start_command(command, restart_count=restart_count)
+            self.restarts[command_id] = self.restarts.get(command_id, 0) + 1
         except Exception:
-            pass
+            log_writer.write(command.site, command, 'ERROR', 'Restart attempt failed')
+            # a failed start counts as another quick crash
+            with self._death_lock:
+                failures = self._failures.get(command_id, 0) + 1
+                self._failures[command_id] = failures
+            if failures >= self.crash_loop_threshold:
+                Command.objects.filter(pk=command_id).update(crash_looping_since=timezone.now())
+                log_writer.write(command.site, command, 'ERROR', f'Restart failed {failures} times in a row; not restarting until started manually')
+                return
+            self._restarts.schedule(command_id, self._backoff(failures), restart_count + 1)
+
+    def _notify_discord(self, run: CommandRun, text: str = None, kind: str = 'crash'):
+        # only enqueues; delivery, coalescing and rate limits are the notifier's job
+        command = run.command
+        summary = f"Command '{command}' on site '{command.site}' crashed"
+        text = text or f"Command '{command}' on site '{command.site}' died unexpectedly and will be restarted."
+        notifier.notify((command.id, kind), text, summary=summary if kind == 'crash' else None)
 
     def start_command(self, command: Command, restart_count: int = 0) -> CommandRun:
         site = command.site
@@ -254,9 +645,12 @@ class ProcessSupervisor:
                         run = CommandRun.objects.create(
                             command=command,
                             pid=proc.pid,
+                            pgid=proc.pid,
                             restart_count=restart_count,
                             manually_stopped=False,
                         )
+                        self._watch(proc, site, command, run)
+                        rollups.record_start(command, restart=restart_count > 0)
                         Log.objects.create(site=site, command=command, level='WARNING', message=f"Fell back to local manage.py for command: {command.command_string}")
                         return run
                     except Exception as e:
@@ -268,34 +662,55 @@ class ProcessSupervisor:
         # If this is an automatic restart, ensure we kill any other active runs
         if restart_count and restart_count > 0:
             try:
-                # build patterns to search for existing processes
-                patterns = [cmd_line, command.command_string, f"manage.py {command.command_string}"]
-                _kill_matching_processes(patterns, site=site, command_obj=command)
+                self._clear_previous(command)
             except Exception:
                 pass
 
-        # Start the process (capture output)
-        proc = subprocess.Popen(
-            cmd_line,
-            shell=True,
-            cwd=site.base_dir or None,
-            preexec_fn=os.setsid,
-            stdout=subprocess.PIPE,
-            stderr=subprocess.PIPE,
-            text=True,
-            bufsize=1,
-        )
+        # Start the process (capture output). The selector loop reads raw
+        # bytes without blocking; thread mode keeps line-buffered text pipes.
+        if self._io:
+            proc = subprocess.Popen(
+                cmd_line,
+                shell=True,
+                cwd=site.base_dir or None,
+                preexec_fn=os.setsid,
+                stdout=subprocess.PIPE,
+                stderr=subprocess.PIPE,
+                bufsize=0,
+            )
+        else:
+            proc = subprocess.Popen(
+                cmd_line,
+                shell=True,
+                cwd=site.base_dir or None,
+                preexec_fn=os.setsid,
+                stdout=subprocess.PIPE,
+                stderr=subprocess.PIPE,
+                text=True,
+                bufsize=1,
+            )
         run = CommandRun.objects.create(
             command=command,
             pid=proc.pid,
+            # setsid above makes the child the leader of its own process group
+            pgid=proc.pid,
             restart_count=restart_count,
             manually_stopped=False,
         )
 
-        # start background threads to stream output and monitor process
-        threading.Thread(target=self._monitor_process, args=(proc, site, command, run), daemon=True).start()
+        self._watch(proc, site, command, run)
+        rollups.record_start(command, restart=restart_count > 0)
         return run
 
+    def _watch(self, proc: subprocess.Popen, site: Site, command: Command, run: CommandRun):
+        self._current[command.id] = run
+        if self._io:
+            self._io.start()
+            self._io.add(proc, site, command, run)
+        else:
+            # start background threads to stream output and monitor process
+            threading.Thread(target=self._monitor_process, args=(proc, site, command, run), daemon=True).start()
+
     def _monitor_process(self, proc: subprocess.Popen, site: Site, command: Command, run: CommandRun):
         # Ensure DB connections are usable in this thread
         close_old_connections()
@@ -305,7 +720,8 @@ class ProcessSupervisor:
                 for line in iter(stream.readline, ''):
                     text = line.rstrip('\n')
                     if text:
-                        Log.objects.create(site=site, command=command, level=level, message=text)
+                        # queued for batched insert; never blocks on the database
+                        log_writer.write(site, command, level, text)
             except Exception:
                 pass
             finally:
@@ -326,35 +742,381 @@ class ProcessSupervisor:
         except Exception as e:
             ret = None
 
+        self._handle_exit(proc, site, command, run, ret)
+
+    def _handle_exit(self, proc, site: Site, command: Command, run: CommandRun, ret):
+        # stop_command may have flagged this run from another thread; don't
+        # overwrite those flags with our stale copy
+        try:
+            run.refresh_from_db(fields=['manually_stopped', 'killed'])
+        except Exception:
+            pass
+
         # Record stop
-        run.stopped_at = timezone.now()
+        run.stopped_at = run.stopped_at or timezone.now()
         run.exit_code = ret
-        run.save()
+        run.save(update_fields=['stopped_at', 'exit_code'])
+        if self._current.get(command.id) is run:
+            del self._current[command.id]
 
         # Log exit
-        Log.objects.create(site=site, command=command, level='INFO', message=f'Process exited with code {ret}')
+        log_writer.write(site, command, 'INFO', f'Process exited with code {ret}')
 
         # Auto-restart if not manually stopped
         if not run.manually_stopped:
-            Log.objects.create(site=site, command=command, level='WARNING', message='Process died unexpectedly; attempting restart')
-            try:
-                self.start_command(command, restart_count=run.restart_count + 1)
-            except Exception:
-                Log.objects.create(site=site, command=command, level='ERROR', message='Restart attempt failed')
+            self._on_crash(command, run)
+
+    def manual_start(self, command: Command) -> dict:
+        """Start `command` on an operator's request, making sure it isn't already running."""
+        if command.id in self._current:
+            return {'started': False, 'pid': self._current[command.id].pid}
+        # First, kill anything lingering from earlier runs of this command
+        try:
+            self._clear_previous(command)
+        except Exception:
+            pass
+
+        # ensure only one running in DB after cleanup
+        if command.runs.filter(stopped_at__isnull=True).exists():
+            return {'started': False, 'pid': None}
+        # an operator start supersedes any pending restart and un-parks the command
+        self._restarts.cancel(command.id)
+        self._failures.pop(command.id, None)
+        if command.crash_looping_since:
+            Command.objects.filter(pk=command.pk).update(crash_looping_since=None)
+            command.crash_looping_since = None
+        run = self.start_command(command)
+        return {'started': True, 'pid': run.pid}
+
+    def _clear_previous(self, command: Command):
+        """Kill whatever is left of earlier runs of `command` that this supervisor isn't watching.
+
+        Runs record the process group they were spawned in, so this signals
+        those groups. The command-line scan of the whole process table is
+        kept for commands with no tracked run at all, and for commands
+        started through e.g. `docker compose exec`, whose group only holds
+        the client while the worker runs in the container.
+        """
+        site = command.site
+        watching = self._current.get(command.id)
+        recent = timezone.now() - timedelta(hours=1)
+        runs = list(
+            CommandRun.objects.filter(command=command, pgid__isnull=False)
+            .filter(Q(stopped_at__isnull=True) | Q(stopped_at__gte=recent))
+            .exclude(pk=watching.pk if watching else None)
+            .values_list('id', 'pgid', 'stopped_at')[:10]
+        )
+        tracked = bool(runs)
+        # a group whose leader exited but hasn't been reaped yet is not leftover
+        live = _live_targets({-pgid for _, pgid, _ in runs})
+        groups = set()
+        open_ids = []
+        for run_id, pgid, stopped_at in runs:
+            if -pgid in live:
+                log_writer.write(site, command, 'INFO', f'Killing leftover process group before restart: pgid={pgid}')
+                groups.add(-pgid)
+            if stopped_at is None:
+                open_ids.append(run_id)
+        _terminate_all(groups)
+        if open_ids:
+            CommandRun.objects.filter(id__in=open_ids, stopped_at__isnull=True).update(stopped_at=timezone.now(), killed=True)
+        cmd_line = f"{site.base_command} {command.command_string}" if site.base_command else command.command_string
+        if not _runs_outside_group(cmd_line) and (tracked or command.runs.filter(pgid__isnull=False).exists()):
+            return
+        patterns = [command.command_string, f"manage.py {command.command_string}"]
+        if site.base_command:
+            patterns.insert(0, f"{site.base_command} {command.command_string}")
+        _kill_matching_processes(patterns, site=site, command_obj=command)
+
+    def status(self) -> dict:
+        """Runs this supervisor is watching, keyed by command id; served from memory."""
+        return {
+            str(command_id): {
+                'run': run.id,
+                'pid': run.pid,
+                'started_at': run.started_at.isoformat(),
+                'restart_count': run.restart_count,
+            }
+            for command_id, run in list(self._current.items())
+        }
+
+    def running(self) -> list:
+        """(command id, site name, command name, process group) of every live run, for the process sampler."""
+        return [
+            (command_id, run.command.site.name, run.command.name, run.pgid or run.pid)
+            for command_id, run in list(self._current.items())
+        ]
+
+    def pending_restarts(self) -> dict:
+        return {str(command_id): round(delay, 1) for command_id, delay in self._restarts.pending().items()}
 
     def stop_command(self, command: Command) -> None:
-        runs = CommandRun.objects.filter(command=command, stopped_at__isnull=True)
+        self._current.pop(command.id, None)
+        self._restarts.cancel(command.id)
+        runs = list(CommandRun.objects.filter(command=command, stopped_at__isnull=True))
+        run_ids = [run.id for run in runs]
+        # flag the runs before signalling, so the exit handler (which fires as
+        # soon as the child dies) never mistakes this for a crash
+        CommandRun.objects.filter(id__in=run_ids).update(manually_stopped=True, killed=True)
         for run in runs:
-            pid = run.pid
-            run.manually_stopped = True
-            run.killed = True
+            pgid = run.pgid or run.pid
             try:
-                if pid:
-                    os.killpg(pid, signal.SIGTERM)
+                if pgid:
+                    os.killpg(pgid, signal.SIGTERM)
             except Exception:
                 pass
-            run.stopped_at = timezone.now()
-            run.save()
+        CommandRun.objects.filter(id__in=run_ids, stopped_at__isnull=True).update(stopped_at=timezone.now())
+
+    def stop_many(self, commands, grace=None) -> dict:
+        """Stop `commands` together and wait for them; returns {command id: 'stopped', 'killed' or 'not running'}.
+
+        Every process group gets SIGTERM at once and they all share one
+        `grace` deadline before SIGKILL, so stopping a whole site takes one
+        grace period rather than one per command.
+        """
+        grace = self.stop_grace if grace is None else grace
+        outcomes = {command.id: 'not running' for command in commands}
+        for command_id in outcomes:
+            self._current.pop(command_id, None)
+            self._restarts.cancel(command_id)
+        runs = list(
+            CommandRun.objects.filter(command_id__in=list(outcomes), stopped_at__isnull=True)
+            .values_list('id', 'command_id', 'pgid', 'pid')
+        )
+        run_ids = [run_id for run_id, _, _, _ in runs]
+        # flagged first, as in stop_command
+        CommandRun.objects.filter(id__in=run_ids).update(manually_stopped=True, killed=True)
+        owners = {}
+        for _, command_id, pgid, pid in runs:
+            outcomes[command_id] = 'stopped'
+            if pgid or pid:
+                owners[-(pgid or pid)] = command_id
+        for target in _terminate_all(owners, grace):
+            outcomes[owners[target]] = 'killed'
+        CommandRun.objects.filter(id__in=run_ids, stopped_at__isnull=True).update(stopped_at=timezone.now())
+        return outcomes
+
+    def start_many(self, commands, concurrency=None) -> dict:
+        """Start `commands` in waves of equal start_order, each wave in parallel; returns {command id: outcome}.
+
+        At most `concurrency` starts run at once (0 = the whole wave). An
+        outcome is {'outcome': 'started', 'running' or 'failed', 'pid': ...,
+        'error': ...}; one command failing does not hold up the others.
+        """
+        concurrency = self.start_concurrency if concurrency is None else concurrency
+        waves = {}
+        for command in commands:
+            waves.setdefault(command.start_order, []).append(command)
+        results = {}
+        for order in sorted(waves):
+            wave = waves[order]
+            workers = min(concurrency or len(wave), len(wave))
+            with ThreadPoolExecutor(max_workers=workers, thread_name_prefix='bulk-start') as pool:
+                for command, result in zip(wave, pool.map(self._start_one, wave)):
+                    results[command.id] = result
+        return results
+
+    def _start_one(self, command: Command) -> dict:
+        try:
+            result = self.manual_start(command)
+        except Exception as e:
+            return {'outcome': 'failed', 'pid': None, 'error': str(e)}
+        finally:
+            # pool threads are discarded; don't leave their connections open
+            connections.close_all()
+        return {'outcome': 'started' if result['started'] else 'running', 'pid': result['pid'], 'error': None}
+
+    def bulk(self, commands, action: str, grace=None, concurrency=None) -> dict:
+        """Start, stop or restart `commands` as one operation.
+
+        A restart stops them all (see stop_many) before starting any (see
+        start_many). Returns the seconds taken and one outcome per command.
+        """
+        if action not in BULK_ACTIONS:
+            raise ValueError(f'Unknown bulk action: {action}')
+        # checked before anything is stopped, so a bad request can't leave a restart half done
+        if concurrency is not None and (type(concurrency) is not int or concurrency < 0):
+            raise ValueError(f'Invalid concurrency: {concurrency!r}')
+        commands = sorted(commands, key=lambda c: (c.start_order, c.site.name, c.name))
+        began = time.monotonic()
+        stopped = self.stop_many(commands, grace) if action in ('stop', 'restart') else {}
+        started = self.start_many(commands, concurrency) if action in ('start', 'restart') else {}
+        return {
+            'seconds': round(time.monotonic() - began, 2),
+            'commands': [
+                dict({'command': c.id, 'site': c.site.name, 'name': c.name, 'stopped': stopped.get(c.id)}, **started.get(c.id, {}))
+                for c in commands
+            ],
+        }
+
+
+BULK_ACTIONS = ('start', 'stop', 'restart')
+
+supervisor = ProcessSupervisor(
+    io_mode=getattr(settings, 'SUPERVISOR_IO_MODE', 'selector'),
+    backoff_base=getattr(settings, 'RESTART_BACKOFF_BASE', 1.0),
+    backoff_max=getattr(settings, 'RESTART_BACKOFF_MAX', 300.0),
+    stable_after=getattr(settings, 'RESTART_STABLE_AFTER', 60.0),
+    crash_loop_threshold=getattr(settings, 'CRASH_LOOP_THRESHOLD', 5),
+    cleanup_grace=getattr(settings, 'SUPERVISOR_CLEANUP_GRACE', 2.0),
+    stop_grace=getattr(settings, 'SUPERVISOR_STOP_GRACE', 5.0),
+    start_concurrency=getattr(settings, 'BULK_START_CONCURRENCY', 0),
+)
+
+# Only one process per host supervises; the others forward requests to it
+# over the control socket.
+elector = LeaderElection(getattr(settings, 'SUPERVISOR_LOCK_FILE', '.supervisor.lock'))
+
+
+sampler = ProcessSampler(
+    supervisor.running,
+    interval=getattr(settings, 'METRICS_SAMPLE_INTERVAL', 10.0),
+    history_days=getattr(settings, 'METRICS_HISTORY_DAYS', 7),
+)
+
+
+def _get_command(pk) -> Command:
+    return Command.objects.select_related('site').get(pk=pk)
+
+
+def _get_commands(pks) -> list:
+    return list(Command.objects.select_related('site').filter(pk__in=pks))
+
+
+def _tail(command, lines=None) -> list:
+    return [
+        {'created_at': created_at.isoformat(), 'level': level, 'message': message}
+        for created_at, level, message in tail_buffer.get(command, lines)
+    ]
+
+
+def metrics_snapshot() -> dict:
+    """Everything /metrics reports, gathered in the supervising process."""
+    running = set(supervisor._current)
+    commands = [
+        {
+            'site': c['site__name'],
+            'command': c['name'],
+            'running': c['id'] in running,
+            'crash_looping': c['crash_looping_since'] is not None,
+            'crashes': supervisor.crashes.get(c['id'], 0),
+            'restarts': supervisor.restarts.get(c['id'], 0),
+        }
+        for c in Command.objects.values('id', 'name', 'site__name', 'crash_looping_since').order_by('site__name', 'name')
+    ]
+    return {
+        'processes': list(sampler.latest.values()),
+        'commands': commands,
+        'supervisor': {
+            'pending_restarts': len(supervisor.pending_restarts()),
+            'live_subscribers': broadcaster.subscriber_count(),
+        },
+        'log_writer': log_writer.stats(),
+        'notifier': notifier.stats(),
+        'sampler': sampler.stats(),
+    }
+
+
+def _history(command, minutes=60) -> dict:
+    """Recent per-minute samples plus the live one, oldest first."""
+    since = timezone.now() - timedelta(minutes=minutes)
+    rows = [
+        {
+            'at': s.at.isoformat(),
+            'processes': s.processes,
+            'cpu_percent': s.cpu_percent,
+            'rss_bytes': s.rss_bytes,
+            'open_fds': s.open_fds,
+            'read_bytes': s.read_bytes,
+            'write_bytes': s.write_bytes,
+        }
+        for s in ProcessSample.objects.filter(command_id=command, at__gte=since).order_by('at')
+    ]
+    return {'history': rows, 'current': sampler.latest.get(command)}
+
+
+control_server = control.ControlServer(getattr(settings, 'SUPERVISOR_SOCKET', '.supervisor.sock'), {
+    'start': lambda command: supervisor.manual_start(_get_command(command)),
+    'stop': lambda command: supervisor.stop_command(_get_command(command)),
+    'bulk': lambda commands, action, concurrency=None: supervisor.bulk(_get_commands(commands), action, concurrency=concurrency),
+    'status': supervisor.status,
+    'tail': _tail,
+    'follow': lambda **filters: follow(keepalive=15, **filters),
+    'metrics': metrics_snapshot,
+    'history': _history,
+})
+
+
+def become_leader():
+    supervisor.start()
+    control_server.start()
+    pruner.start()
+    sampler.start()
+    rollups.start(supervisor.running)
+
+
+def start_for_web():
+    """Let this web process compete to supervise, unless a run_supervisor daemon owns that role."""
+    if getattr(settings, 'SUPERVISOR_MODE', 'embedded') != 'embedded':
+        return
+    elector.start(on_elected=become_leader)
+
+
+def is_local() -> bool:
+    """True when this process owns supervision, so requests can be served in-process."""
+    return elector.is_leader
+
+
+def request_start(command: Command) -> dict:
+    """Start `command` here if this process leads, otherwise ask the leader to."""
+    if is_local():
+        return supervisor.manual_start(command)
+    return control.request(control_server.path, 'start', command=command.pk)
+
+
+def request_stop(command: Command) -> None:
+    if is_local():
+        return supervisor.stop_command(command)
+    return control.request(control_server.path, 'stop', command=command.pk)
+
+
+def request_bulk(commands, action: str, concurrency=None) -> dict:
+    """Start, stop or restart several commands at once; see ProcessSupervisor.bulk."""
+    if is_local():
+        return supervisor.bulk(commands, action, concurrency=concurrency)
+    # the leader answers only once every stop and start is done
+    return control.request(
+        control_server.path, 'bulk', timeout=supervisor.stop_grace + 60,
+        commands=[command.pk for command in commands], action=action, concurrency=concurrency,
+    )
+
+
+def request_status() -> dict:
+    if is_local():
+        return supervisor.status()
+    return control.request(control_server.path, 'status')
+
+
+def request_tail(command_id: int, lines=None) -> list:
+    if is_local():
+        return _tail(command_id, lines)
+    return control.request(control_server.path, 'tail', command=command_id, lines=lines)
+
+
+def request_metrics() -> dict:
+    if is_local():
+        return metrics_snapshot()
+    return control.request(control_server.path, 'metrics')
+
+
+def request_history(command_id: int, minutes=60) -> dict:
+    if is_local():
+        return _history(command_id, minutes)
+    return control.request(control_server.path, 'history', command=command_id, minutes=minutes)
 
 
-supervisor = ProcessSupervisor()
+def request_follow(keepalive=15, **filters):
+    """Yield batches of serialised live log lines; an empty batch means nothing arrived within `keepalive`."""
+    if is_local():
+        return follow(keepalive=keepalive, **filters)
+    return control.stream(control_server.path, 'follow', **filters)
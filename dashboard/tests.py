@@ -0,0 +1,1130 @@
+import csv
+import gzip
+import io
+import json
+import os
+import queue
+import shutil
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from datetime import datetime, timedelta, timezone as dt_timezone
+from pathlib import Path
+from unittest import mock
+
+from django.contrib.auth import get_user_model
+from django.core.management import CommandError, call_command
+from django.db import OperationalError, router
+from django.test import SimpleTestCase, TestCase, TransactionTestCase, override_settings
+from django.urls import reverse
+from django.utils import timezone
+
+from . import bench, control, supervisor
+from .export import CSV_HEADER, export_logs
+from .logstream import Subscription, TailBuffer, broadcaster, log_entry, tail_buffer
+from .leader import LeaderElection
+from .logwriter import LogWriter, SpillBuffer
+from .metrics import ProcessSampler, render_prometheus
+from .models import Command, CommandRun, Log, LogRollup, ProcessSample, RetentionPolicy, Site
+from .notify import DiscordNotifier, _pack
+from .parsers import parse_line
+from .retention import LogArchive, prune_logs
+from .rollups import Rollups, overview, rebuild_rollups, write_rollups
+from .routers import LOG_DATABASE, LogRouter
+from .search import fts_query, search_logs
+from .supervisor import ProcessSupervisor, _IOLoop, _live_targets, _runs_outside_group, _terminate_all
+
+
+def _command(site, name='web', **kwargs):
+    # a command string no real process has, in case a test reaches the command-line scan
+    kwargs.setdefault('command_string', f'ukb-test:{name}:not-a-command')
+    return Command.objects.create(site=site, name=name, **kwargs)
+
+
+class CommandListQueriesTests(TestCase):
+    databases = '__all__'
+
+    def setUp(self):
+        self.site = Site.objects.create(name='site', base_dir='', base_command='')
+        self.client.force_login(get_user_model().objects.create_superuser('admin', 'admin@example.com', 'pw'))
+
+    def _add(self, count):
+        for i in range(count):
+            command = _command(self.site, f'cmd-{Command.objects.count()}')
+            CommandRun.objects.create(command=command, pid=1000 + i, pgid=1000 + i)
+            CommandRun.objects.create(command=command, pid=2000 + i, stopped_at=timezone.now(), exit_code=1)
+
+    def test_query_count_does_not_grow_with_commands(self):
+        # session, user, and the one query for the commands and their run state
+        self._add(1)
+        with self.assertNumQueries(3):
+            response = self.client.get(reverse('dashboard:command_list'))
+        self.assertContains(response, 'cmd-0')
+        self._add(20)
+        with self.assertNumQueries(3):
+            response = self.client.get(reverse('dashboard:command_list'))
+        self.assertContains(response, 'cmd-20')
+
+
+class _Writer(LogWriter):
+    """A log writer with no background thread: tests flush it themselves."""
+
+    def start(self):
+        pass
+
+
+class LogWriterBatchingTests(TestCase):
+    databases = '__all__'
+
+    def setUp(self):
+        self.site = Site.objects.create(name='site', base_dir='', base_command='')
+        self.command = _command(self.site, collapse_repeats=False)
+
+    def test_writes_only_queue_and_flush_in_batches(self):
+        writer = _Writer(batch_size=20)
+        using = router.db_for_write(Log)
+        with self.assertNumQueries(0, using=using):
+            for i in range(50):
+                writer.write(self.site, self.command, 'INFO', f'line {i}')
+        # 20 + 20 + 10
+        with self.assertNumQueries(3, using=using):
+            writer.flush()
+        self.assertEqual(Log.objects.count(), 50)
+        self.assertEqual((writer.queued, writer.flushed), (50, 50))
+
+    def test_lines_without_a_command_are_kept(self):
+        writer = _Writer()
+        writer.write(None, None, 'WARNING', 'supervisor notice')
+        writer.flush()
+        self.assertEqual(Log.objects.get().message, 'supervisor notice')
+
+    def test_full_queue_drops_without_spill(self):
+        writer = _Writer(max_queue=2)
+        results = [writer.write(self.site, self.command, 'INFO', f'line {i}') for i in range(3)]
+        self.assertEqual(results, [True, True, False])
+        self.assertEqual(writer.dropped, 1)
+        writer.flush()
+        self.assertEqual(Log.objects.count(), 2)
+
+
+@mock.patch('dashboard.supervisor.log_writer')
+class IOLoopTests(SimpleTestCase):
+    def setUp(self):
+        self.exits = queue.Queue()
+        self.loop = _IOLoop(self._on_exit)
+        self.loop.start()
+        self.addCleanup(self.loop.stop)
+
+    def _on_exit(self, proc, site, command, run, ret):
+        self.exits.put((threading.current_thread().name, command, ret))
+
+    def _spawn(self, name, script):
+        proc = subprocess.Popen([sys.executable, '-c', script], stdout=subprocess.PIPE, stderr=subprocess.PIPE, bufsize=0)
+        self.addCleanup(proc.wait)
+        self.loop.add(proc, 'site', name, None)
+        return proc
+
+    def test_one_thread_reads_every_process(self, log_writer):
+        threads = []
+        log_writer.write.side_effect = lambda *args: threads.append(threading.current_thread().name)
+        script = 'import sys\nfor i in range(3):\n    print("out", i, flush=True)\n    print("err", i, file=sys.stderr, flush=True)\nprint("no newline", end="")'
+        for name in ('a', 'b', 'c'):
+            self._spawn(name, script)
+        for _ in range(3):
+            self.exits.get(timeout=5)
+        lines = {(call.args[1], call.args[2], call.args[3]) for call in log_writer.write.call_args_list}
+        for name in ('a', 'b', 'c'):
+            for i in range(3):
+                self.assertIn((name, 'INFO', f'out {i}'), lines)
+                self.assertIn((name, 'ERROR', f'err {i}'), lines)
+            self.assertIn((name, 'INFO', 'no newline'), lines)
+        self.assertEqual(set(threads), {'supervisor-io'})
+        self.assertEqual(self.loop.running(), 0)
+
+    def test_exit_is_reported_at_once_off_the_io_thread(self, log_writer):
+        began = time.monotonic()
+        self._spawn('a', 'import sys, time\nprint("bye", flush=True)\ntime.sleep(0.2)\nsys.exit(3)')
+        thread, command, ret = self.exits.get(timeout=5)
+        # well inside the 5 s the old polling loop could take
+        self.assertLess(time.monotonic() - began, 1.5)
+        self.assertEqual((thread, command, ret), ('supervisor-exits', 'a', 3))
+        # the output came before the exit
+        log_writer.write.assert_called_once_with('site', 'a', 'INFO', 'bye')
+
+    def test_slow_exit_handling_does_not_stall_reads(self, log_writer):
+        release = threading.Event()
+        self.loop.on_exit = lambda *args: release.wait(5)
+        self.addCleanup(release.set)
+        self._spawn('a', 'pass')
+        self._spawn('b', 'for i in range(200): print(i)')
+        deadline = time.monotonic() + 5
+        while log_writer.write.call_count < 200 and time.monotonic() < deadline:
+            time.sleep(0.05)
+        self.assertEqual(log_writer.write.call_count, 200)
+        self.assertFalse(release.is_set())
+
+
+class KeysetTests(TestCase):
+    databases = '__all__'
+
+    def setUp(self):
+        self.at = timezone.now()
+        # three rows share a timestamp, so ids break the tie
+        self.logs = [Log.objects.create(message=str(i), created_at=self.at + timedelta(seconds=i // 3)) for i in range(6)]
+
+    def test_after(self):
+        pivot = self.logs[1]
+        ids = list(Log.objects.after(pivot.created_at, pivot.id).order_by('created_at', 'id').values_list('id', flat=True))
+        self.assertEqual(ids, [log.id for log in self.logs[2:]])
+
+    def test_before(self):
+        pivot = self.logs[4]
+        ids = list(Log.objects.before(pivot.created_at, pivot.id).order_by('-created_at', '-id').values_list('id', flat=True))
+        self.assertEqual(ids, [log.id for log in reversed(self.logs[:4])])
+
+
+class LogListPagingTests(TestCase):
+    databases = '__all__'
+
+    def setUp(self):
+        self.client.force_login(get_user_model().objects.create_superuser('admin', 'admin@example.com', 'pw'))
+        at = timezone.now()
+        Log.objects.bulk_create([Log(message=f'line {i}', created_at=at + timedelta(seconds=i // 7)) for i in range(250)])
+        self.newest_first = list(Log.objects.order_by('-created_at', '-id').values_list('id', flat=True))
+
+    def _page(self, query=''):
+        response = self.client.get(reverse('dashboard:log_list') + '?' + query)
+        return [log.id for log in response.context['logs']], response.context
+
+    def test_older_and_newer_pages_cover_every_row_once(self):
+        pages = []
+        ids, ctx = self._page()
+        pages.append(ids)
+        while 'older_query' in ctx:
+            ids, ctx = self._page(ctx['older_query'])
+            pages.append(ids)
+        self.assertEqual([len(page) for page in pages], [100, 100, 50])
+        self.assertEqual(sum(pages, []), self.newest_first)
+        # and back again
+        ids, ctx = self._page(ctx['newer_query'])
+        self.assertEqual(ids, pages[1])
+        ids, ctx = self._page(ctx['newer_query'])
+        self.assertEqual(ids, pages[0])
+        self.assertNotIn('newer_query', ctx)
+
+
+class LiveLogTests(TestCase):
+    databases = '__all__'
+
+    def setUp(self):
+        self.site = Site.objects.create(name='site', base_dir='', base_command='')
+        self.other = Site.objects.create(name='other', base_dir='', base_command='')
+        self.command = _command(self.site)
+
+    def test_slow_viewer_loses_its_oldest_lines(self):
+        sub = Subscription(max_pending=2)
+        for payload in ('a', 'b', 'c'):
+            sub.offer(payload)
+        self.assertEqual(sub.dropped, 1)
+        self.assertEqual(sub.get_batch(timeout=0), ['b', 'c'])
+        self.assertEqual(sub.get_batch(timeout=0), [])
+
+    @mock.patch('dashboard.views.LOG_STREAM_KEEPALIVE', 0.05)
+    def test_stream_sends_matching_lines_as_events(self):
+        self.client.force_login(get_user_model().objects.create_superuser('admin', 'admin@example.com', 'pw'))
+        with mock.patch.object(supervisor.elector, 'is_leader', True):
+            response = self.client.get(reverse('dashboard:log_stream'), {'site': self.site.id})
+        self.assertEqual(response['Content-Type'], 'text/event-stream')
+        events = iter(response.streaming_content)
+        self.assertEqual(next(events), b'retry: 3000\n\n')
+        # nothing published yet: a keepalive, by which time the viewer is subscribed
+        self.assertEqual(next(events), b': keepalive\n\n')
+        self.assertEqual(broadcaster.subscriber_count(), 1)
+        broadcaster.publish(log_entry(Log(site=self.other, level='INFO', message='elsewhere', created_at=timezone.now())))
+        broadcaster.publish(log_entry(Log(site=self.site, command=self.command, level='ERROR', message='boom', created_at=timezone.now())))
+        event = next(events).decode()
+        self.assertTrue(event.startswith('data: ') and event.endswith('\n\n'), event)
+        line = json.loads(event[len('data: '):])
+        self.assertEqual((line['site'], line['command'], line['level'], line['message']), ('site', 'web', 'ERROR', 'boom'))
+        response.close()
+        self.assertEqual(broadcaster.subscriber_count(), 0)
+
+
+class TailBufferTests(TestCase):
+    databases = '__all__'
+
+    def test_keeps_the_last_lines_of_each_command(self):
+        buffer = TailBuffer(size=3)
+        at = timezone.now()
+        for i in range(5):
+            buffer.append(1, at, 'INFO', f'a{i}')
+        buffer.append(2, at, 'INFO', 'b0')
+        buffer.append(None, at, 'INFO', 'no command')
+        self.assertEqual([line[2] for line in buffer.get(1)], ['a2', 'a3', 'a4'])
+        self.assertEqual([line[2] for line in buffer.get(1, 2)], ['a3', 'a4'])
+        self.assertEqual([line[2] for line in buffer.get(2)], ['b0'])
+        self.assertEqual(buffer.get(3), [])
+
+    def test_tail_json_is_served_from_memory(self):
+        site = Site.objects.create(name='site', base_dir='', base_command='')
+        command = _command(site, collapse_repeats=False)
+        self.addCleanup(tail_buffer.discard, command.id)
+        writer = _Writer()
+        for i in range(5):
+            writer.write(site, command, 'INFO', f'line {i}')
+        self.client.force_login(get_user_model().objects.create_superuser('admin', 'admin@example.com', 'pw'))
+        with mock.patch.object(supervisor.elector, 'is_leader', True):
+            # session and user only; nothing has been written to the database
+            with self.assertNumQueries(2):
+                response = self.client.get(reverse('dashboard:command_tail_json', args=[command.id]), {'lines': 2})
+        self.assertEqual([line['message'] for line in response.json()['lines']], ['line 3', 'line 4'])
+
+
+class LeaderElectionTests(SimpleTestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.directory, True)
+
+    def test_one_leader_and_a_follower_takes_over(self):
+        path = os.path.join(self.directory, 'supervisor.lock')
+        elected = []
+        first = LeaderElection(path)
+        second = LeaderElection(path, retry_interval=0.05)
+        first.start(on_elected=lambda: elected.append('first'))
+        second.start(on_elected=lambda: elected.append('second'))
+        self.addCleanup(second.stop)
+        self.assertTrue(first.is_leader)
+        self.assertFalse(second.is_leader)
+        self.assertEqual(second.leader_pid(), os.getpid())
+        # the leader's process dies and the kernel drops its lock
+        os.close(first._fd)
+        deadline = time.monotonic() + 2
+        while not second.is_leader and time.monotonic() < deadline:
+            time.sleep(0.05)
+        self.addCleanup(os.close, second._fd)
+        self.assertEqual(elected, ['first', 'second'])
+
+
+@mock.patch('dashboard.supervisor.log_writer')
+class FailOverTests(TestCase):
+    databases = '__all__'
+
+    def test_new_leader_restarts_what_was_running(self, log_writer):
+        site = Site.objects.create(name='site', base_dir='', base_command='')
+        running = _command(site, 'running')
+        stopping = _command(site, 'stopping')
+        parked = _command(site, 'parked', crash_looping_since=timezone.now())
+        twice = _command(site, 'twice')
+        # left open by the previous leader; no pids, so there is nothing to signal
+        CommandRun.objects.create(command=running)
+        CommandRun.objects.create(command=stopping, manually_stopped=True)
+        CommandRun.objects.create(command=parked)
+        CommandRun.objects.create(command=twice)
+        CommandRun.objects.create(command=twice, restart_count=2)
+        sup = ProcessSupervisor(io_mode='threads', cleanup_grace=0)
+        with mock.patch.object(sup._restarts, 'schedule') as schedule:
+            sup.start()
+        self.assertEqual(
+            sorted(call.args for call in schedule.call_args_list), sorted([(running.id, 0, 1), (twice.id, 0, 3)]),
+        )
+        self.assertFalse(CommandRun.objects.filter(stopped_at__isnull=True).exists())
+        self.assertEqual(CommandRun.objects.filter(killed=True).count(), 5)
+
+
+class ControlSocketTests(SimpleTestCase):
+    def setUp(self):
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory, True)
+        self.path = os.path.join(directory, 'supervisor.sock')
+
+        def fail():
+            raise ValueError('no such command')
+
+        def count(n):
+            yield from range(n)
+
+        self.server = control.ControlServer(self.path, {
+            'echo': lambda **kwargs: kwargs,
+            'fail': fail,
+            'count': count,
+            'status': lambda: {'7': {'pid': 123}},
+        })
+        self.server.start()
+        self.addCleanup(self.server.stop)
+
+    def test_request_round_trip(self):
+        self.assertEqual(control.request(self.path, 'echo', command=3, lines=None), {'command': 3, 'lines': None})
+
+    def test_errors_come_back_as_control_errors(self):
+        with self.assertRaisesMessage(control.ControlError, 'no such command'):
+            control.request(self.path, 'fail')
+        with self.assertRaisesMessage(control.ControlError, 'unknown op: nope'):
+            control.request(self.path, 'nope')
+
+    def test_stream(self):
+        self.assertEqual(list(control.stream(self.path, 'count', n=3)), [0, 1, 2])
+
+    def test_unreachable_supervisor(self):
+        self.server.stop()
+        with self.assertRaisesMessage(control.ControlError, 'Supervisor is not reachable'):
+            control.request(self.path, 'echo')
+
+    def test_followers_forward_to_the_leader(self):
+        with mock.patch.object(supervisor.elector, 'is_leader', False), \
+                mock.patch.object(supervisor.control_server, 'path', self.path):
+            self.assertEqual(supervisor.request_status(), {'7': {'pid': 123}})
+
+
+@mock.patch('dashboard.supervisor.log_writer')
+class RestartPolicyTests(TestCase):
+    databases = '__all__'
+
+    def setUp(self):
+        self.supervisor = ProcessSupervisor(
+            io_mode='threads', backoff_base=1.0, backoff_max=8.0, stable_after=60.0, crash_loop_threshold=4,
+        )
+        self.schedule = mock.patch.object(self.supervisor._restarts, 'schedule').start()
+        mock.patch.object(self.supervisor, '_notify_discord').start()
+        self.addCleanup(mock.patch.stopall)
+        self.command = _command(Site.objects.create(name='site', base_dir='', base_command=''))
+
+    def _crash(self, lifetime=1.0):
+        run = CommandRun.objects.create(command=self.command, pid=1)
+        # started_at is auto_now_add; _on_crash only reads it from the instance
+        run.stopped_at = run.started_at + timedelta(seconds=lifetime)
+        self.supervisor._on_crash(self.command, run)
+
+    def test_backoff(self, log_writer):
+        self.assertEqual(self.supervisor._backoff(1), 0.0)
+        for failures, top in ((2, 1.0), (3, 2.0), (4, 4.0), (5, 8.0), (9, 8.0)):
+            delay = self.supervisor._backoff(failures)
+            self.assertTrue(top / 2 <= delay <= top, (failures, delay))
+
+    def test_quick_crashes_back_off_then_park(self, log_writer):
+        for _ in range(3):
+            self._crash()
+        delays = [call.args[1] for call in self.schedule.call_args_list]
+        self.assertEqual(delays[0], 0.0)
+        self.assertTrue(0.5 <= delays[1] <= 1.0 and 1.0 <= delays[2] <= 2.0, delays)
+        self.command.refresh_from_db()
+        self.assertIsNone(self.command.crash_looping_since)
+
+        self._crash()
+        self.assertEqual(self.schedule.call_count, 3)
+        self.command.refresh_from_db()
+        self.assertIsNotNone(self.command.crash_looping_since)
+
+    def test_stable_run_resets_the_count(self, log_writer):
+        for _ in range(3):
+            self._crash()
+        self._crash(lifetime=120)
+        self.assertEqual(self.schedule.call_args.args[1], 0.0)
+        self.assertEqual(self.supervisor._failures[self.command.id], 1)
+
+    def test_each_death_is_handled_once(self, log_writer):
+        run = CommandRun.objects.create(command=self.command, pid=1, stopped_at=timezone.now())
+        self.supervisor._on_crash(self.command, run)
+        self.supervisor._on_crash(self.command, run)
+        self.assertEqual(self.schedule.call_count, 1)
+
+    def test_failed_restarts_count_as_quick_crashes(self, log_writer):
+        with mock.patch.object(self.supervisor, 'start_command', side_effect=RuntimeError('Executable not found')):
+            for _ in range(4):
+                self.supervisor._restart(self.command.id, 1)
+        self.assertEqual(self.schedule.call_count, 3)
+        self.command.refresh_from_db()
+        self.assertIsNotNone(self.command.crash_looping_since)
+
+
+@mock.patch('dashboard.supervisor.log_writer')
+class ProcessGroupTests(TestCase):
+    databases = '__all__'
+
+    def setUp(self):
+        self.supervisor = ProcessSupervisor(io_mode='threads')
+        self.command = _command(Site.objects.create(name='site', base_dir='', base_command=''))
+
+    def _spawn(self, script):
+        proc = subprocess.Popen([sys.executable, '-c', script], start_new_session=True, stdout=subprocess.PIPE)
+        self.addCleanup(proc.stdout.close)
+        self.addCleanup(proc.wait)
+        self.addCleanup(_terminate_all, {-proc.pid}, 0)
+        return proc
+
+    def test_leftover_group_is_killed_with_its_descendants(self, log_writer):
+        proc = self._spawn(
+            'import subprocess, sys, time\n'
+            'subprocess.Popen([sys.executable, "-c", "import time; time.sleep(30)"])\n'
+            'print("ready", flush=True)\n'
+            'time.sleep(30)'
+        )
+        proc.stdout.readline()
+        run = CommandRun.objects.create(command=self.command, pid=proc.pid, pgid=proc.pid)
+        self.supervisor._clear_previous(self.command)
+        self.assertEqual(_live_targets({-proc.pid}), set())
+        run.refresh_from_db()
+        self.assertTrue(run.killed and run.stopped_at)
+        log_writer.write.assert_called_once_with(
+            self.command.site, self.command, 'INFO', f'Killing leftover process group before restart: pgid={proc.pid}',
+        )
+
+    def test_unreaped_group_is_not_leftover(self, log_writer):
+        proc = self._spawn('pass')
+        # exited but not reaped: the group still "exists" as far as signals go
+        os.waitid(os.P_PID, proc.pid, os.WEXITED | os.WNOWAIT)
+        os.killpg(proc.pid, 0)
+        CommandRun.objects.create(command=self.command, pid=proc.pid, pgid=proc.pid, stopped_at=timezone.now())
+        self.supervisor._clear_previous(self.command)
+        log_writer.write.assert_not_called()
+
+    def test_launchers_that_run_outside_the_group(self, log_writer):
+        self.assertTrue(_runs_outside_group('sudo docker compose exec web python manage.py runworker'))
+        self.assertTrue(_runs_outside_group('/usr/bin/docker exec web python manage.py runworker'))
+        self.assertFalse(_runs_outside_group('python manage.py runworker'))
+        self.assertFalse(_runs_outside_group("python -c 'unbalanced"))
+
+
+class TerminateAllTests(SimpleTestCase):
+    def _spawn(self, ignore_term):
+        script = 'import signal, time\n'
+        if ignore_term:
+            script += 'signal.signal(signal.SIGTERM, signal.SIG_IGN)\n'
+        script += 'print("ready", flush=True)\ntime.sleep(30)'
+        proc = subprocess.Popen([sys.executable, '-c', script], start_new_session=True, stdout=subprocess.PIPE)
+        self.addCleanup(proc.stdout.close)
+        self.addCleanup(proc.wait)
+        proc.stdout.readline()
+        return proc
+
+    def test_orphans_share_one_grace_period(self):
+        stubborn = [self._spawn(ignore_term=True) for _ in range(3)]
+        polite = self._spawn(ignore_term=False)
+        targets = {-proc.pid for proc in stubborn} | {polite.pid}
+        began = time.monotonic()
+        killed = _terminate_all(targets, grace=0.5)
+        # one grace period for all of them, not one each
+        self.assertLess(time.monotonic() - began, 1.2)
+        self.assertEqual(killed, {-proc.pid for proc in stubborn})
+        for proc in stubborn + [polite]:
+            proc.wait(timeout=2)
+        self.assertEqual(_live_targets(targets), set())
+
+
+class LazyStartTests(SimpleTestCase):
+    def test_loading_the_app_starts_nothing(self):
+        # the test runner has set up Django and run migrate by now
+        self.assertFalse(supervisor.supervisor._started)
+        self.assertFalse(supervisor.elector.is_leader)
+        names = {thread.name for thread in threading.enumerate()}
+        self.assertFalse(names & {'leader-election', 'supervisor-control', 'log-pruner', 'process-sampler', 'log-rollups'})
+
+    def test_web_processes_compete_only_in_embedded_mode(self):
+        with mock.patch.object(supervisor.elector, 'start') as start:
+            with self.settings(SUPERVISOR_MODE='daemon'):
+                supervisor.start_for_web()
+            start.assert_not_called()
+            with self.settings(SUPERVISOR_MODE='embedded'):
+                supervisor.start_for_web()
+            start.assert_called_once_with(on_elected=supervisor.become_leader)
+
+
+class NotifierTests(SimpleTestCase):
+    def setUp(self):
+        self.notifier = DiscordNotifier('https://discord.invalid/webhook', window=60)
+
+    def test_off_without_a_webhook(self):
+        notifier = DiscordNotifier('')
+        self.assertFalse(notifier.notify('key', 'text'))
+        self.assertIsNone(notifier._thread)
+
+    def test_repeats_within_the_window_become_one_summary(self):
+        at = time.monotonic()
+        for i in range(4):
+            self.notifier._queue.put_nowait((7, f'crash {i}', "Command 'x' crashed", at + i))
+        self.notifier._take(0)
+        # the first goes out at once, the rest wait for the window to end
+        self.assertEqual(self.notifier._outbox, ['crash 0'])
+        self.assertEqual(self.notifier.coalesced, 2)
+        self.notifier._release_due(at + 30)
+        self.assertEqual(len(self.notifier._outbox), 1)
+        self.notifier._release_due(at + 60)
+        self.assertRegex(self.notifier._outbox[1], r"^Command 'x' crashed 3 times in the last \d+s\.$")
+
+    def test_lines_are_packed_into_few_messages(self):
+        message, rest = _pack(['a' * 900, 'b' * 900, 'c' * 900])
+        self.assertEqual(message, 'a' * 900 + '\n' + 'b' * 900)
+        self.assertEqual(rest, ['c' * 900])
+
+    def test_rate_limit_keeps_the_lines_for_later(self):
+        response = mock.Mock(status_code=429, headers={})
+        response.json.return_value = {'retry_after': 2.5}
+        self.notifier._session = mock.Mock()
+        self.notifier._session.post.return_value = response
+        self.notifier._outbox = ['crash 0']
+        self.notifier._send_outbox()
+        self.assertEqual(self.notifier._outbox, ['crash 0'])
+        self.assertEqual(self.notifier.rate_limited, 1)
+        self.assertGreater(self.notifier._blocked_until, time.monotonic() + 2)
+        # blocked: nothing is posted until Discord's retry_after has passed
+        self.notifier._send_outbox()
+        self.assertEqual(self.notifier._session.post.call_count, 1)
+
+
+@override_settings(LOG_RETENTION_DAYS=30)
+class RetentionTests(TestCase):
+    databases = '__all__'
+
+    def setUp(self):
+        self.now = timezone.now()
+        site = Site.objects.create(name='site', base_dir='', base_command='')
+        other = Site.objects.create(name='other', base_dir='', base_command='')
+        self.kept = _command(site, 'kept')
+        self.noisy = _command(site, 'noisy')
+        self.elsewhere = _command(other, 'elsewhere')
+        RetentionPolicy.objects.create(site=site, days=10)
+        RetentionPolicy.objects.create(command=self.kept, days=0)
+        RetentionPolicy.objects.create(command=self.noisy, level='DEBUG', days=1)
+        for command in (self.kept, self.noisy, self.elsewhere):
+            for age in (5, 20, 40):
+                self._log(command, age)
+        self._log(self.noisy, 2, 'DEBUG')
+
+    def _log(self, command, age, level='INFO'):
+        Log.objects.create(
+            site=command.site, command=command, level=level, message=f'{age} days',
+            created_at=self.now - timedelta(days=age),
+        )
+
+    def _left(self):
+        # no join: logs may live in their own database
+        names = dict(Command.objects.values_list('id', 'name'))
+        return sorted((names[command_id], level, message) for command_id, level, message in Log.objects.values_list('command_id', 'level', 'message'))
+
+    def test_most_specific_policy_wins(self):
+        prune_logs(batch_size=2, now=self.now)
+        self.assertEqual(self._left(), [
+            ('elsewhere', 'INFO', '20 days'), ('elsewhere', 'INFO', '5 days'),
+            ('kept', 'INFO', '20 days'), ('kept', 'INFO', '40 days'), ('kept', 'INFO', '5 days'),
+            ('noisy', 'INFO', '5 days'),
+        ])
+
+    def test_dry_run_only_counts(self):
+        results = prune_logs(dry_run=True, now=self.now)
+        self.assertEqual(sum(count for _, count in results), 4)
+        self.assertEqual(Log.objects.count(), 10)
+
+    def test_pruned_rows_are_archived_first(self):
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory, True)
+        doomed = set(Log.objects.filter(message__in=['20 days', '40 days'], command=self.noisy).values_list('id', flat=True))
+        prune_logs(archive=LogArchive(directory), now=self.now)
+        archived = []
+        for path in Path(directory).rglob('command-*.ndjson.gz'):
+            with gzip.open(path, 'rt') as f:
+                archived += [json.loads(line) for line in f]
+        self.assertEqual(len(archived), 4)
+        self.assertTrue(doomed <= {row['id'] for row in archived})
+        self.assertEqual({row['site'] for row in archived}, {'site', 'other'})
+        # one file per day and command
+        day = timezone.localtime(self.now - timedelta(days=40)).date().isoformat()
+        self.assertTrue(Path(directory, day, f'command-{self.noisy.id}.ndjson.gz').exists())
+
+
+class LogRouterTests(TestCase):
+    databases = '__all__'
+
+    def test_routing(self):
+        router = LogRouter()
+        for model in (Log, ProcessSample, LogRollup):
+            self.assertEqual(router.db_for_read(model), LOG_DATABASE)
+            self.assertEqual(router.db_for_write(model), LOG_DATABASE)
+        for model in (Site, Command, CommandRun, get_user_model()):
+            self.assertEqual(router.db_for_read(model), 'default')
+
+    def test_allow_migrate(self):
+        router = LogRouter()
+        self.assertTrue(router.allow_migrate(LOG_DATABASE, 'dashboard', 'log'))
+        self.assertFalse(router.allow_migrate('default', 'dashboard', 'log'))
+        self.assertTrue(router.allow_migrate('default', 'dashboard', 'command'))
+        self.assertFalse(router.allow_migrate(LOG_DATABASE, 'dashboard', 'command'))
+        self.assertFalse(router.allow_migrate(LOG_DATABASE, 'auth', 'user'))
+        # RunSQL/RunPython without a model only run on the main database
+        self.assertTrue(router.allow_migrate('default', 'dashboard'))
+        self.assertFalse(router.allow_migrate(LOG_DATABASE, 'dashboard'))
+
+    def test_deleting_a_site_or_command_detaches_its_logs(self):
+        site = Site.objects.create(name='site', base_dir='', base_command='')
+        command = _command(site)
+        log = Log.objects.create(site=site, command=command, message='kept')
+        command.delete()
+        log.refresh_from_db()
+        self.assertEqual((log.site_id, log.command_id), (site.id, None))
+        site.delete()
+        log.refresh_from_db()
+        self.assertIsNone(log.site_id)
+
+
+class SearchTests(TestCase):
+    databases = '__all__'
+
+    def setUp(self):
+        self.site = Site.objects.create(name='site', base_dir='', base_command='')
+        self.other = Site.objects.create(name='other', base_dir='', base_command='')
+        for site, message in (
+            (self.site, 'connection refused by upstream'),
+            (self.site, 'connected to cache'),
+            (self.site, 'disk full'),
+            (self.other, 'connection refused again'),
+        ):
+            Log.objects.create(site=site, message=message)
+
+    def _search(self, text, qs=None):
+        return [log.message for log in search_logs(qs if qs is not None else Log.objects.all(), text, limit=10)]
+
+    def test_query_syntax_is_neutralised(self):
+        self.assertEqual(fts_query('conn* "two words" OR -x'), '"conn"* "two words" "OR" "-x"')
+        self.assertEqual(fts_query('* ""'), '')
+
+    def test_every_term_must_match(self):
+        self.assertEqual(sorted(self._search('refused connection')), ['connection refused again', 'connection refused by upstream'])
+        self.assertEqual(self._search('conn* upstream'), ['connection refused by upstream'])
+        self.assertEqual(self._search('"refused by"'), ['connection refused by upstream'])
+
+    def test_filters_apply_to_matches(self):
+        self.assertEqual(
+            sorted(self._search('conn*', Log.objects.matching(site=self.site.id))),
+            ['connected to cache', 'connection refused by upstream'],
+        )
+
+    def test_deleted_rows_leave_the_index(self):
+        Log.objects.filter(message='disk full').delete()
+        self.assertEqual(self._search('disk'), [])
+
+    def test_logs_page_search(self):
+        self.client.force_login(get_user_model().objects.create_superuser('admin', 'admin@example.com', 'pw'))
+        response = self.client.get(reverse('dashboard:log_list'), {'q': 'refused', 'site': self.other.id})
+        self.assertEqual([log.message for log in response.context['logs']], ['connection refused again'])
+        self.assertTrue(response.context['searching'])
+
+
+class ExportTests(TestCase):
+    databases = '__all__'
+
+    def setUp(self):
+        self.site = Site.objects.create(name='site', base_dir='', base_command='')
+        self.command = _command(self.site)
+        at = timezone.now()
+        # two rows share a timestamp across a chunk boundary
+        for i, second in enumerate((0, 1, 1, 2, 3)):
+            Log.objects.create(
+                site=self.site, command=self.command, level='ERROR' if i == 2 else 'INFO', message=f'line {i}',
+                created_at=at + timedelta(seconds=second), fields={'n': i},
+            )
+
+    def test_ndjson_in_chunks(self):
+        chunks = list(export_logs(Log.objects.all(), chunk_size=2))
+        self.assertEqual(len(chunks), 3)
+        rows = [json.loads(line) for line in b''.join(chunks).decode().splitlines()]
+        self.assertEqual([row['message'] for row in rows], [f'line {i}' for i in range(5)])
+        self.assertEqual((rows[0]['site'], rows[0]['command'], rows[0]['fields']), ('site', 'web', {'n': 0}))
+
+    def test_gzip_csv(self):
+        data = gzip.decompress(b''.join(export_logs(Log.objects.all(), 'csv', compress=True, chunk_size=2)))
+        rows = list(csv.reader(io.StringIO(data.decode())))
+        self.assertEqual(rows[0], CSV_HEADER)
+        self.assertEqual([row[7] for row in rows[1:]], [f'line {i}' for i in range(5)])
+
+    def test_chunk_size_must_be_positive(self):
+        with self.assertRaises(ValueError):
+            list(export_logs(Log.objects.all(), chunk_size=0))
+        with self.assertRaisesMessage(CommandError, '--chunk-size must be at least 1'):
+            call_command('export_logs', '--chunk-size', '0')
+
+    def test_command_writes_the_filtered_logs(self):
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory, True)
+        path = os.path.join(directory, 'logs.ndjson')
+        call_command('export_logs', '--level', 'ERROR', '--chunk-size', '1', '-o', path)
+        with open(path) as f:
+            self.assertEqual([json.loads(line)['message'] for line in f], ['line 2'])
+
+    def test_view_streams_an_attachment(self):
+        self.client.force_login(get_user_model().objects.create_superuser('admin', 'admin@example.com', 'pw'))
+        url = reverse('dashboard:log_export')
+        response = self.client.get(url, {'format': 'csv', 'level': 'INFO'})
+        self.assertTrue(response.streaming)
+        self.assertRegex(response['Content-Disposition'], r'^attachment; filename="logs-[\d-]+\.csv"$')
+        self.assertEqual(len(b''.join(response.streaming_content).decode().splitlines()), 5)
+        self.assertEqual(self.client.get(url, {'format': 'xml'}).status_code, 400)
+
+
+class MetricsTests(TestCase):
+    databases = '__all__'
+
+    def test_sampler_sums_a_process_tree(self):
+        command = _command(Site.objects.create(name='site', base_dir='', base_command=''))
+        proc = subprocess.Popen(
+            [sys.executable, '-c', 'import subprocess, sys, time\n'
+             'subprocess.Popen([sys.executable, "-c", "import time; time.sleep(30)"])\n'
+             'print("ready", flush=True)\ntime.sleep(30)'],
+            start_new_session=True, stdout=subprocess.PIPE,
+        )
+        self.addCleanup(proc.stdout.close)
+        self.addCleanup(proc.wait)
+        self.addCleanup(_terminate_all, {-proc.pid}, 0)
+        proc.stdout.readline()
+        sampler = ProcessSampler(lambda: [(command.id, 'site', 'web', proc.pid)])
+        sampler.sample()
+        sampler.sample()
+        sample = sampler.latest[command.id]
+        self.assertEqual(sample['processes'], 2)
+        self.assertGreater(sample['rss_bytes'], 0)
+        # a finished minute is stored as one row
+        sampler._buckets[command.id].start -= timedelta(minutes=1)
+        sampler._persist()
+        stored = ProcessSample.objects.get(command_id=command.id)
+        self.assertEqual((stored.processes, stored.rss_bytes), (2, sample['rss_bytes']))
+
+    def test_render_without_a_supervisor(self):
+        self.assertEqual(
+            render_prometheus(None),
+            '# HELP ukb_supervisor_up Whether the supervisor answered this scrape.\n'
+            '# TYPE ukb_supervisor_up gauge\nukb_supervisor_up 0\n',
+        )
+
+    @override_settings(METRICS_TOKEN='s3cret')
+    def test_endpoint_needs_a_login_or_the_token(self):
+        _command(Site.objects.create(name='si"te', base_dir='', base_command=''))
+        url = reverse('dashboard:metrics')
+        self.assertEqual(self.client.get(url).status_code, 403)
+        self.assertEqual(self.client.get(url, HTTP_AUTHORIZATION='Bearer wrong').status_code, 403)
+        with mock.patch.object(supervisor.elector, 'is_leader', True):
+            response = self.client.get(url, HTTP_AUTHORIZATION='Bearer s3cret')
+        body = response.content.decode()
+        self.assertEqual(response.status_code, 200)
+        self.assertIn('ukb_supervisor_up 1\n', body)
+        self.assertIn('ukb_command_running{site="si\\"te",command="web"} 0\n', body)
+        self.assertIn('# TYPE ukb_log_lines_flushed_total counter\n', body)
+
+
+class SpillReplayTests(TransactionTestCase):
+    # a failed bulk_create must not run inside a test transaction
+    databases = '__all__'
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.directory, True)
+        self.site = Site.objects.create(name='site', base_dir='', base_command='')
+        self.command = _command(self.site, collapse_repeats=False)
+        self.writer = _Writer(spill=SpillBuffer(self.directory))
+
+    def _write(self, count):
+        for i in range(count):
+            self.writer.write(self.site, self.command, 'INFO', f'line {i}')
+
+    def test_lines_are_spilled_while_the_database_fails_and_replayed_after(self):
+        self._write(10)
+        with mock.patch.object(Log.objects, 'bulk_create', side_effect=OperationalError('database is locked')):
+            self.writer.flush()
+        self.assertEqual(Log.objects.count(), 0)
+        self.assertEqual(self.writer.spill.spilled, 10)
+        self.assertEqual(self.writer.dropped, 0)
+
+        self.assertTrue(self.writer._replay())
+        self.assertEqual(Log.objects.count(), 10)
+        self.assertEqual(self.writer.spill.replayed, 10)
+        self.assertFalse(self.writer.spill.has_pending())
+
+    def test_failed_replay_is_retried(self):
+        self._write(3)
+        with mock.patch.object(Log.objects, 'bulk_create', side_effect=OperationalError('database is locked')):
+            self.writer.flush()
+            self.assertFalse(self.writer._replay())
+        self.assertTrue(self.writer._replay())
+        self.assertEqual(Log.objects.count(), 3)
+
+    def test_replay_resumes_from_the_saved_offset(self):
+        self._write(4)
+        with mock.patch.object(Log.objects, 'bulk_create', side_effect=OperationalError('database is locked')):
+            self.writer.flush()
+        spill = self.writer.spill
+        self.assertEqual(len(spill.read_batch(2)), 2)
+        spill.commit(2)
+        # the process dies mid-replay; a later one claims its file
+        path, f = spill._replay
+        f.close()
+        dead = path.with_name('replay-999999999-1.ndjson')
+        os.rename(path, dead)
+        os.rename(f'{path}.offset', f'{dead}.offset')
+        entries = SpillBuffer(self.directory).read_batch(10)
+        self.assertEqual([entry.message for entry in entries], ['line 2', 'line 3'])
+
+    def test_rejected_row_does_not_block_its_batch(self):
+        self._write(5)
+        now = timezone.now()
+        self.writer._enqueue(self.writer._entry(self.site, self.command, 'INFO', 'bad', now, fields={'v': float('nan')}))
+        self._write(5)
+        self.writer.flush()
+        self.assertEqual(Log.objects.count(), 10)
+        self.assertEqual(self.writer.rejected, 1)
+        self.assertFalse(self.writer.spill.has_pending())
+
+
+class BenchTests(TestCase):
+    databases = '__all__'
+
+    def test_summary_percentiles(self):
+        self.assertEqual(bench.summary([]), {'count': 0})
+        result = bench.summary([i / 1000 for i in range(100, 0, -1)])
+        self.assertEqual(result, {'count': 100, 'p50': 51.0, 'p95': 96.0, 'p99': 100.0, 'max': 100.0})
+
+    def test_flatten_matches_tiers_by_row_count(self):
+        flat = bench.flatten({
+            'options': {'verbose': True},
+            'views': [{'rows': 10, 'pages': {'/logs/': {'p50': 1.5}}}],
+        })
+        self.assertEqual(flat, {'views.rows=10.rows': 10, 'views.rows=10.pages./logs/.p50': 1.5})
+
+    def test_seed_logs_tops_up_with_unmatchable_commands(self):
+        bench.seed_logs(30, batch_size=7)
+        self.assertEqual(Log.objects.count(), 30)
+        self.assertEqual(bench.seed_logs(30), 0.0)
+        self.assertEqual(Log.objects.count(), 30)
+        commands = Command.objects.filter(site__name__startswith=bench.SEED_SITE)
+        self.assertEqual(commands.count(), 20)
+        # the startup sweep matches host processes by command string
+        for command_string in commands.values_list('command_string', flat=True):
+            self.assertTrue(command_string.endswith(':not-a-command'))
+
+
+class IngestionPolicyTests(TestCase):
+    databases = '__all__'
+
+    def setUp(self):
+        self.site = Site.objects.create(name='site', base_dir='', base_command='')
+        self.writer = _Writer(flush_interval=60, rate_burst=1)
+
+    def test_repeats_are_collapsed(self):
+        command = _command(self.site)
+        for message in ('a', 'a', 'a', 'b', 'a'):
+            self.writer.write(self.site, command, 'INFO', message)
+        self.writer.flush()
+        rows = list(Log.objects.order_by('id').values_list('message', 'repeat_count'))
+        self.assertEqual(rows, [('a', 3), ('b', 1), ('a', 1)])
+        self.assertEqual(self.writer.collapsed, 2)
+
+    def test_repeats_kept_when_collapsing_is_off(self):
+        command = _command(self.site, collapse_repeats=False)
+        for _ in range(3):
+            self.writer.write(self.site, command, 'INFO', 'a')
+        self.writer.flush()
+        self.assertEqual(Log.objects.filter(repeat_count=1).count(), 3)
+
+    def test_rate_limit_suppresses_and_records_the_excess(self):
+        command = _command(self.site, collapse_repeats=False, log_rate_limit=5)
+        for i in range(12):
+            self.writer.write(self.site, command, 'INFO', f'line {i}')
+        self.writer.flush()
+        self.assertEqual(Log.objects.filter(message__startswith='line ').count(), 5)
+        marker = Log.objects.get(level='WARNING')
+        self.assertEqual(marker.message, '7 lines suppressed (over 5 lines/s)')
+        self.assertEqual(self.writer.suppressed, 7)
+
+    def test_token_bucket_refills(self):
+        command = _command(self.site, collapse_repeats=False, log_rate_limit=5)
+        start = timezone.now()
+        self.assertEqual(sum(self.writer._take_token(command, start) for _ in range(10)), 5)
+        # 0.4 s later two more lines are allowed
+        later = start + timedelta(seconds=0.4)
+        self.assertEqual(sum(self.writer._take_token(command, later) for _ in range(10)), 2)
+
+
+class ParserTests(SimpleTestCase):
+    def test_json_line(self):
+        level, message, logged_at, fields = parse_line(
+            '{"level": "warn", "msg": "disk low", "ts": 1700000000, "free": 3}', 'INFO',
+        )
+        self.assertEqual((level, message, fields), ('WARNING', 'disk low', {'free': 3}))
+        self.assertEqual(logged_at, datetime(2023, 11, 14, 22, 13, 20, tzinfo=dt_timezone.utc))
+
+    def test_json_without_message_is_kept_as_is(self):
+        self.assertEqual(parse_line('{"a": 1}', 'ERROR'), ('ERROR', '{"a": 1}', None, None))
+
+    def test_json_non_finite_numbers_become_strings(self):
+        fields = parse_line('{"msg": "x", "v": NaN, "w": -Infinity}', 'INFO')[3]
+        self.assertEqual(fields, {'v': 'NaN', 'w': '-Infinity'})
+
+    def test_python_basic_config(self):
+        self.assertEqual(
+            parse_line('WARNING:app.jobs:retrying', 'ERROR'), ('WARNING', 'retrying', None, {'logger': 'app.jobs'}),
+        )
+
+    def test_python_stamped(self):
+        level, message, logged_at, fields = parse_line('2026-10-18 15:58:47,123 ERROR django.request: boom', 'INFO')
+        self.assertEqual((level, message, fields), ('ERROR', 'boom', {'logger': 'django.request'}))
+        self.assertEqual((logged_at.second, logged_at.microsecond), (47, 123000))
+
+    def test_runserver_request_level_follows_status(self):
+        level, message, logged_at, fields = parse_line('[18/Oct/2026 15:58:47] "GET /x HTTP/1.1" 404 179', 'ERROR')
+        self.assertEqual(level, 'WARNING')
+        self.assertEqual(fields, {'method': 'GET', 'path': '/x', 'status': 404, 'size': 179})
+        self.assertEqual(parse_line('[18/Oct/2026 15:58:47] "POST /y HTTP/1.1" 500 10', 'INFO')[0], 'ERROR')
+
+    def test_runserver_startup_lines_are_info(self):
+        self.assertEqual(parse_line('Watching for file changes with StatReloader', 'ERROR')[0], 'INFO')
+
+    def test_plain_and_unknown_lines(self):
+        self.assertEqual(parse_line('WARNING:a:b', 'ERROR', 'plain'), ('ERROR', 'WARNING:a:b', None, None))
+        self.assertEqual(parse_line('hello', 'INFO'), ('INFO', 'hello', None, None))
+
+
+class ParsedLogTests(TestCase):
+    databases = '__all__'
+
+    def test_parsed_level_time_and_fields_are_stored(self):
+        site = Site.objects.create(name='site', base_dir='', base_command='')
+        writer = _Writer()
+        writer.write(site, _command(site, collapse_repeats=False), 'INFO', '{"level": "error", "msg": "boom", "ts": 1700000000, "n": 1}')
+        writer.write(site, _command(site, 'raw', log_format='plain', collapse_repeats=False), 'INFO', 'ERROR:x:y')
+        writer.flush()
+        parsed, raw = Log.objects.order_by('id')
+        self.assertEqual((parsed.level, parsed.message, parsed.fields), ('ERROR', 'boom', {'n': 1}))
+        self.assertEqual(parsed.logged_at, datetime(2023, 11, 14, 22, 13, 20, tzinfo=dt_timezone.utc))
+        self.assertEqual((raw.level, raw.message, raw.logged_at, raw.fields), ('INFO', 'ERROR:x:y', None, None))
+
+
+class RollupTests(TestCase):
+    databases = '__all__'
+
+    def setUp(self):
+        self.now = datetime(2026, 10, 18, 12, 30, 30, tzinfo=dt_timezone.utc)
+        self.site = Site.objects.create(name='site', base_dir='', base_command='')
+        self.command = _command(self.site)
+
+    def _row(self, period, bucket):
+        return LogRollup.objects.get(command_id=self.command.id, period=period, bucket=bucket)
+
+    def test_minute_counts_are_added_to_minute_and_hour_rows(self):
+        first, second = self.now.replace(minute=1, second=0), self.now.replace(minute=2, second=0)
+        write_rollups({(self.command.id, first): {'info': 2}, (self.command.id, second): {'info': 3, 'error': 1}})
+        write_rollups({(self.command.id, first): {'info': 1}})
+        self.assertEqual(self._row(LogRollup.MINUTE, first).info, 3)
+        hour = self._row(LogRollup.HOUR, self.now.replace(minute=0, second=0))
+        self.assertEqual((hour.info, hour.error), (6, 1))
+
+    def test_only_an_active_counter_counts(self):
+        counter = Rollups()
+        entry = Log(command_id=self.command.id, level='WARNING', created_at=self.now, repeat_count=3)
+        counter.count_logs([entry])
+        self.assertEqual(counter._pending, {})
+        with mock.patch.object(Rollups, 'active', new_callable=mock.PropertyMock, return_value=True):
+            counter.count_logs([entry])
+        counter.flush()
+        self.assertEqual(self._row(LogRollup.MINUTE, self.now.replace(second=0)).warning, 3)
+
+    def _history(self):
+        at = self.now - timedelta(minutes=10)
+        Log.objects.create(site=self.site, command=self.command, level='INFO', message='a', created_at=at, repeat_count=2)
+        Log.objects.create(site=self.site, command=self.command, level='ERROR', message='b', created_at=at)
+        run = CommandRun.objects.create(command=self.command, pid=1, exit_code=1, restart_count=1)
+        # started_at is auto_now_add
+        CommandRun.objects.filter(pk=run.pk).update(started_at=at - timedelta(minutes=10), stopped_at=at)
+
+    def test_rebuild_from_logs_and_runs(self):
+        self._history()
+        rebuild_rollups(self.now - timedelta(hours=1), now=self.now)
+        hour = self._row(LogRollup.HOUR, self.now.replace(minute=0, second=0))
+        self.assertEqual(
+            (hour.info, hour.error, hour.starts, hour.restarts, hour.crashes, hour.uptime_seconds),
+            (2, 1, 1, 1, 1, 600.0),
+        )
+        # a second rebuild replaces rather than adds
+        rebuild_rollups(self.now - timedelta(hours=1), now=self.now)
+        self.assertEqual(self._row(LogRollup.HOUR, hour.bucket).info, 2)
+
+    def test_overview_totals(self):
+        self._history()
+        rebuild_rollups(self.now - timedelta(hours=1), now=self.now)
+        [site] = overview(hours=2, now=self.now)
+        self.assertEqual(site['site'], self.site)
+        self.assertEqual(
+            (site['lines'], site['errors'], site['crashes'], site['running']), (3, 1, 1, 0),
+        )
+        self.assertEqual(site['commands'][0]['command'], self.command)
+        # ten minutes up out of the hour and a half since 11:00
+        self.assertEqual(site['uptime_percent'], round(100 * 600 / 5430, 1))
+
+    def test_overview_page(self):
+        self.client.force_login(get_user_model().objects.create_superuser('admin', 'admin@example.com', 'pw'))
+        self.assertContains(self.client.get(reverse('dashboard:overview')), 'site')
+
+
+class BulkTests(TestCase):
+    databases = '__all__'
+
+    def setUp(self):
+        self.supervisor = ProcessSupervisor(io_mode='threads')
+        site = Site.objects.create(name='site', base_dir='', base_command='')
+        self.commands = [_command(site, f'cmd-{i}', start_order=order) for i, order in enumerate((2, 1, 1, 1))]
+
+    def test_bad_concurrency_is_rejected_before_anything_stops(self):
+        with mock.patch.object(self.supervisor, 'stop_many') as stop_many:
+            for concurrency in (-1, 1.5, '2', True):
+                with self.assertRaises(ValueError):
+                    self.supervisor.bulk(self.commands, 'restart', concurrency=concurrency)
+        stop_many.assert_not_called()
+
+    def test_waves_start_in_order_and_at_most_concurrency_at_once(self):
+        lock, running, peak, order = threading.Lock(), [0], [0], []
+
+        def start(command):
+            with lock:
+                running[0] += 1
+                peak[0] = max(peak[0], running[0])
+                order.append(command.start_order)
+            time.sleep(0.05)
+            with lock:
+                running[0] -= 1
+            return {'outcome': 'started', 'pid': command.id, 'error': None}
+
+        with mock.patch.object(self.supervisor, '_start_one', side_effect=start), \
+                mock.patch.object(self.supervisor, 'stop_many', return_value={}) as stop_many:
+            result = self.supervisor.bulk(self.commands, 'restart', concurrency=2)
+        stop_many.assert_called_once()
+        self.assertEqual(order, [1, 1, 1, 2])
+        self.assertEqual(peak[0], 2)
+        self.assertEqual([c['name'] for c in result['commands']], ['cmd-1', 'cmd-2', 'cmd-3', 'cmd-0'])
+        self.assertTrue(all(c['outcome'] == 'started' for c in result['commands']))
+
+
+@mock.patch('dashboard.views.request_bulk', return_value={'seconds': 0.1, 'commands': []})
+class BulkViewTests(TestCase):
+    databases = '__all__'
+
+    def setUp(self):
+        self.site = Site.objects.create(name='site', base_dir='', base_command='')
+        _command(self.site)
+        self.admin = get_user_model().objects.create_superuser('admin', 'admin@example.com', 'pw')
+        self.client.force_login(self.admin)
+
+    def _post(self, **data):
+        return self.client.post(reverse('dashboard:command_bulk'), dict({'action': 'restart', 'site': self.site.id}, **data))
+
+    def test_concurrency(self, request_bulk):
+        self.assertEqual(self._post(concurrency='2').status_code, 200)
+        self.assertEqual(request_bulk.call_args.kwargs, {'concurrency': 2})
+        self._post(concurrency='')
+        self.assertEqual(request_bulk.call_args.kwargs, {'concurrency': None})
+
+    def test_invalid_input_is_a_bad_request(self, request_bulk):
+        for data in ({'concurrency': '-1'}, {'concurrency': 'abc'}, {'concurrency': '²'}, {'site': 'x'}, {'action': 'kill'}):
+            self.assertEqual(self._post(**data).status_code, 400, data)
+        request_bulk.assert_not_called()
+
+    def test_permissions(self, request_bulk):
+        self.client.force_login(get_user_model().objects.create_user('viewer', 'viewer@example.com', 'pw'))
+        self.assertEqual(self._post().status_code, 403)
+        self.assertEqual(self.client.get(reverse('dashboard:command_bulk')).status_code, 403)
+        request_bulk.assert_not_called()
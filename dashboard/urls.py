@@ -6,6 +6,8 @@ app_name = 'dashboard'
 urlpatterns = [
     path('', views.SiteListView.as_view(), name='dashboard_home'),
 
+    path('overview/', views.OverviewView.as_view(), name='overview'),
+
     # Sites
     path('sites/', views.SiteListView.as_view(), name='site_list'),
     path('sites/add/', views.SiteCreateView.as_view(), name='site_add'),
@@ -14,12 +16,23 @@ urlpatterns = [
 
     # Commands
     path('commands/', views.CommandListView.as_view(), name='command_list'),
+    path('commands/status.json', views.command_status_json_view, name='command_status_json'),
+    path('commands/bulk/', views.bulk_command_view, name='command_bulk'),
     path('commands/add/', views.CommandCreateView.as_view(), name='command_add'),
     path('commands/<int:pk>/edit/', views.CommandUpdateView.as_view(), name='command_edit'),
     path('commands/<int:pk>/delete/', views.CommandDeleteView.as_view(), name='command_delete'),
     path('commands/<int:pk>/start/', views.start_command_view, name='command_start'),
     path('commands/<int:pk>/stop/', views.stop_command_view, name='command_stop'),
+    path('commands/<int:pk>/tail/', views.command_tail_view, name='command_tail'),
+    path('commands/<int:pk>/tail.json', views.command_tail_json_view, name='command_tail_json'),
+    path('commands/<int:pk>/metrics.json', views.command_metrics_json_view, name='command_metrics_json'),
 
     # Logs
     path('logs/', views.LogListView.as_view(), name='log_list'),
+    path('logs/live/', views.LiveLogView.as_view(), name='log_live'),
+    path('logs/stream/', views.log_stream_view, name='log_stream'),
+    path('logs/export/', views.log_export_view, name='log_export'),
+
+    # Prometheus
+    path('metrics', views.metrics_view, name='metrics'),
 ]
@@ -1,12 +1,27 @@
+from datetime import datetime, timedelta, timezone as dt_timezone
+
 from django.shortcuts import render
 from django.urls import reverse_lazy
 from django.contrib.auth.mixins import LoginRequiredMixin, PermissionRequiredMixin
-from django.views.generic import ListView, CreateView, UpdateView, DeleteView
-from .models import Site, Command, Log
+from django.views.generic import ListView, CreateView, UpdateView, DeleteView, TemplateView
+from .models import Site, Command, CommandRun, Log, LOG_LEVELS
+from django.db.models import OuterRef, Subquery
+from django.conf import settings
+from django.core.exceptions import PermissionDenied
+from django.utils import timezone
+from django.utils.crypto import constant_time_compare
+from django.utils.dateparse import parse_datetime
 from django.contrib.auth.decorators import login_required, permission_required
 from django.shortcuts import get_object_or_404, redirect
-from django.http import HttpResponseForbidden, HttpResponse
-from .supervisor import supervisor
+from django.http import HttpResponseForbidden, HttpResponse, StreamingHttpResponse, JsonResponse
+from .supervisor import (
+    BULK_ACTIONS, request_bulk, request_start, request_stop, request_status, request_tail, request_follow, request_metrics, request_history,
+)
+from .metrics import render_prometheus
+from .logstream import tail_buffer
+from .search import search_logs
+from .export import EXPORT_FORMATS, export_logs
+from .rollups import overview
 from django.contrib import messages
 from .models import Log
 
@@ -45,21 +60,33 @@ class CommandListView(LoginRequiredMixin, ListView):
     template_name = 'dashboard/commands/list.html'
     context_object_name = 'commands'
 
+    def get_queryset(self):
+        # Current run state comes from correlated subqueries so the whole page
+        # is one query however many commands there are.
+        open_runs = CommandRun.objects.filter(command=OuterRef('pk'), stopped_at__isnull=True).order_by('-started_at')
+        last_stopped = CommandRun.objects.filter(command=OuterRef('pk'), stopped_at__isnull=False).order_by('-stopped_at')
+        return (
+            super().get_queryset()
+            .select_related('site')
+            .annotate(
+                current_pid=Subquery(open_runs.values('pid')[:1]),
+                current_started_at=Subquery(open_runs.values('started_at')[:1]),
+                current_restart_count=Subquery(open_runs.values('restart_count')[:1]),
+                last_exit_code=Subquery(last_stopped.values('exit_code')[:1]),
+            )
+            .order_by('site__name', 'name')
+        )
+
     def get_context_data(self, **kwargs):
         ctx = super().get_context_data(**kwargs)
         # identify running commands
-        running = set()
-        for c in ctx['commands']:
-            runs = c.runs.filter(stopped_at__isnull=True)
-            if runs.exists():
-                running.add(c.id)
-        ctx['running_command_ids'] = running
+        ctx['running_command_ids'] = {c.id for c in ctx['commands'] if c.current_started_at is not None}
         return ctx
 
 
 class CommandCreateView(LoginRequiredMixin, PermissionRequiredMixin, CreateView):
     model = Command
-    fields = ['site', 'name', 'command_string', 'active']
+    fields = ['site', 'name', 'command_string', 'active', 'log_format', 'collapse_repeats', 'log_rate_limit', 'start_order']
     template_name = 'dashboard/commands/form.html'
     success_url = reverse_lazy('dashboard:command_list')
     permission_required = 'dashboard.add_command'
@@ -67,7 +94,7 @@ class CommandCreateView(LoginRequiredMixin, PermissionRequiredMixin, CreateView)
 
 class CommandUpdateView(LoginRequiredMixin, PermissionRequiredMixin, UpdateView):
     model = Command
-    fields = ['site', 'name', 'command_string', 'active']
+    fields = ['site', 'name', 'command_string', 'active', 'log_format', 'collapse_repeats', 'log_rate_limit', 'start_order']
     template_name = 'dashboard/commands/form.html'
     success_url = reverse_lazy('dashboard:command_list')
     permission_required = 'dashboard.change_command'
@@ -80,59 +107,290 @@ class CommandDeleteView(LoginRequiredMixin, PermissionRequiredMixin, DeleteView)
     permission_required = 'dashboard.delete_command'
 
 
+_EPOCH = datetime(1970, 1, 1, tzinfo=dt_timezone.utc)
+
+# seconds of silence before an SSE keepalive comment is sent
+LOG_STREAM_KEEPALIVE = 15
+
+
+def _parse_time(value):
+    """Parse a datetime-local / ISO string from a query parameter into an aware datetime."""
+    if not value:
+        return None
+    try:
+        dt = parse_datetime(value)
+    except ValueError:
+        return None
+    if dt is not None and timezone.is_naive(dt):
+        dt = timezone.make_aware(dt)
+    return dt
+
+
+def _log_filters(request) -> dict:
+    """Site/command/level/time-range filters from the query string, for LogQuerySet.matching()."""
+    params = request.GET
+    return {
+        'site': params.get('site') or None,
+        'command': params.get('command') or None,
+        'level': params.get('level') or None,
+        'since': _parse_time(params.get('since')),
+        'until': _parse_time(params.get('until')),
+    }
+
+
+def _encode_cursor(log: Log) -> str:
+    delta = log.created_at - _EPOCH
+    micros = (delta.days * 86400 + delta.seconds) * 1_000_000 + delta.microseconds
+    return f"{micros}-{log.pk}"
+
+
+def _decode_cursor(value):
+    try:
+        micros, pk = value.split('-', 1)
+        return _EPOCH + timedelta(microseconds=int(micros)), int(pk)
+    except (AttributeError, ValueError, OverflowError):
+        return None
+
+
+class OverviewView(LoginRequiredMixin, TemplateView):
+    template_name = 'dashboard/overview.html'
+
+    def get_context_data(self, **kwargs):
+        ctx = super().get_context_data(**kwargs)
+        # rollups only: the page costs the same however many logs are stored
+        ctx['sites'] = overview(hours=24)
+        ctx['rollup_interval'] = getattr(settings, 'ROLLUP_FLUSH_INTERVAL', 10.0)
+        return ctx
+
+
 class LogListView(LoginRequiredMixin, PermissionRequiredMixin, ListView):
+    """Newest-first log browser using keyset pagination on (created_at, id).
+
+    `before` / `after` carry the cursor of the last / first row of the current
+    page, so every page is a single bounded index range scan no matter how
+    deep into the table it is. With a search term (`q`) the page is instead
+    the full-text matches ranked by relevance, paginated by `page` number.
+    """
+
     model = Log
     template_name = 'dashboard/logs/list.html'
     context_object_name = 'logs'
     permission_required = 'dashboard.view_logs'
+    page_size = 100
+
+    def filter_queryset(self, qs):
+        return qs.matching(**_log_filters(self.request))
 
     def get_queryset(self):
-        qs = super().get_queryset().order_by('-created_at')
-        site_id = self.request.GET.get('site')
-        cmd_id = self.request.GET.get('command')
-        if site_id:
-            qs = qs.filter(site_id=site_id)
-        if cmd_id:
-            qs = qs.filter(command_id=cmd_id)
-        return qs
+        # prefetch rather than join: logs may live in a different database (LOG_DATABASE_URL)
+        qs = self.filter_queryset(super().get_queryset()).prefetch_related('site', 'command__site')
+        self.search = self.request.GET.get('q', '').strip()
+        if self.search:
+            self.page = max(_int_param(self.request, 'page') or 1, 1)
+            rows = search_logs(qs, self.search, limit=self.page_size + 1, offset=(self.page - 1) * self.page_size)
+            self.has_newer = self.page > 1
+            self.has_older = len(rows) > self.page_size
+            return rows[:self.page_size]
+        before = _decode_cursor(self.request.GET.get('before'))
+        after = _decode_cursor(self.request.GET.get('after'))
+        self.has_newer = self.has_older = False
+        if after and not before:
+            ts, pk = after
+            qs = qs.after(ts, pk).order_by('created_at', 'id')
+            rows = list(qs[:self.page_size + 1])
+            self.has_newer = len(rows) > self.page_size
+            self.has_older = True
+            return rows[:self.page_size][::-1]
+        if before:
+            ts, pk = before
+            qs = qs.before(ts, pk)
+            self.has_newer = True
+        rows = list(qs.order_by('-created_at', '-id')[:self.page_size + 1])
+        self.has_older = len(rows) > self.page_size
+        return rows[:self.page_size]
+
+    def get_context_data(self, **kwargs):
+        ctx = super().get_context_data(**kwargs)
+        ctx['sites'] = Site.objects.all()
+        ctx['all_commands'] = Command.objects.all()
+        ctx['levels'] = LOG_LEVELS
+        logs = ctx['logs']
+        params = self.request.GET.copy()
+        params.pop('before', None)
+        params.pop('after', None)
+        if self.search:
+            ctx['searching'] = True
+            if self.has_older:
+                params['page'] = self.page + 1
+                ctx['older_query'] = params.urlencode()
+            if self.has_newer:
+                params['page'] = self.page - 1
+                ctx['newer_query'] = params.urlencode()
+            return ctx
+        if logs and self.has_older:
+            params['before'] = _encode_cursor(logs[-1])
+            ctx['older_query'] = params.urlencode()
+            params.pop('before')
+        if logs and self.has_newer:
+            params['after'] = _encode_cursor(logs[0])
+            ctx['newer_query'] = params.urlencode()
+        return ctx
+
+
+class LiveLogView(LoginRequiredMixin, PermissionRequiredMixin, TemplateView):
+    template_name = 'dashboard/logs/live.html'
+    permission_required = 'dashboard.view_logs'
 
     def get_context_data(self, **kwargs):
         ctx = super().get_context_data(**kwargs)
         ctx['sites'] = Site.objects.all()
         ctx['all_commands'] = Command.objects.all()
+        ctx['levels'] = LOG_LEVELS
         return ctx
 
 
+def _int_param(request, name):
+    try:
+        return int(request.GET[name])
+    except (KeyError, ValueError):
+        return None
+
+
+@login_required
+@permission_required('dashboard.view_logs', raise_exception=True)
+def log_stream_view(request):
+    """Server-Sent Events stream of log lines as the supervisor ingests them."""
+    batches = request_follow(
+        keepalive=LOG_STREAM_KEEPALIVE,
+        site_id=_int_param(request, 'site'),
+        command_id=_int_param(request, 'command'),
+        level=request.GET.get('level') or None,
+    )
+
+    def events():
+        try:
+            yield 'retry: 3000\n\n'
+            for batch in batches:
+                if not batch:
+                    # comment line keeps proxies from closing an idle stream
+                    yield ': keepalive\n\n'
+                    continue
+                yield ''.join(f'data: {payload}\n\n' for payload in batch)
+        except RuntimeError:
+            # supervisor went away; the browser reconnects after `retry`
+            return
+        finally:
+            batches.close()
+
+    response = StreamingHttpResponse(events(), content_type='text/event-stream')
+    response['Cache-Control'] = 'no-cache'
+    response['X-Accel-Buffering'] = 'no'
+    return response
+
+
+@login_required
+@permission_required('dashboard.view_logs', raise_exception=True)
+def log_export_view(request):
+    """Download the logs matching the logs page filters as NDJSON or CSV, optionally gzipped."""
+    fmt = request.GET.get('format', 'ndjson')
+    if fmt not in EXPORT_FORMATS:
+        return HttpResponse(f"Unknown format: {fmt}", status=400)
+    compress = request.GET.get('gzip') in ('1', 'true', 'on')
+    qs = Log.objects.matching(**_log_filters(request))
+    filename = f"logs-{timezone.now():%Y%m%d-%H%M%S}.{fmt}" + ('.gz' if compress else '')
+    response = StreamingHttpResponse(
+        export_logs(qs, fmt, compress=compress),
+        content_type='application/gzip' if compress else EXPORT_FORMATS[fmt],
+    )
+    response['Content-Disposition'] = f'attachment; filename="{filename}"'
+    response['X-Accel-Buffering'] = 'no'
+    return response
+
+
+def _tail_limit(request):
+    limit = _int_param(request, 'lines')
+    if limit is None or limit <= 0:
+        return tail_buffer.size
+    return min(limit, tail_buffer.size)
+
+
+@login_required
+@permission_required('dashboard.view_logs', raise_exception=True)
+def command_tail_view(request, pk):
+    cmd = get_object_or_404(Command.objects.select_related('site'), pk=pk)
+    try:
+        lines = request_tail(cmd.pk, _tail_limit(request))
+    except RuntimeError as e:
+        messages.error(request, f"Could not read output: {e}")
+        lines = []
+    return render(request, 'dashboard/commands/tail.html', {'command': cmd, 'lines': lines})
+
+
+@login_required
+@permission_required('dashboard.view_logs', raise_exception=True)
+def command_tail_json_view(request, pk):
+    """Recent output of one command straight from the supervisor's in-memory tail buffer."""
+    try:
+        lines = request_tail(pk, _tail_limit(request))
+    except RuntimeError as e:
+        return JsonResponse({'error': str(e)}, status=503)
+    return JsonResponse({'command': pk, 'lines': lines})
+
+
+@login_required
+def command_status_json_view(request):
+    """Runs the supervisor is currently watching, keyed by command id."""
+    try:
+        return JsonResponse({'commands': request_status()})
+    except RuntimeError as e:
+        return JsonResponse({'error': str(e)}, status=503)
+
+
+@login_required
+@permission_required('dashboard.view_logs', raise_exception=True)
+def command_metrics_json_view(request, pk):
+    """Per-minute CPU/memory/FD/IO history of one command (`minutes`, default 60) plus its latest sample."""
+    minutes = min(_int_param(request, 'minutes') or 60, 60 * 24 * 31)
+    try:
+        return JsonResponse(request_history(pk, minutes))
+    except RuntimeError as e:
+        return JsonResponse({'error': str(e)}, status=503)
+
+
+def metrics_view(request):
+    """Prometheus scrape endpoint.
+
+    Open to logged-in users who can view logs, or to requests bearing
+    `Authorization: Bearer <METRICS_TOKEN>` when that setting is set.
+    """
+    token = getattr(settings, 'METRICS_TOKEN', '')
+    bearer = request.headers.get('Authorization', '')
+    if not (token and constant_time_compare(bearer, f'Bearer {token}')) and not request.user.has_perm('dashboard.view_logs'):
+        return HttpResponse('Forbidden', status=403, content_type='text/plain')
+    try:
+        data = request_metrics()
+    except RuntimeError:
+        data = None
+    return HttpResponse(render_prometheus(data), content_type='text/plain; version=0.0.4; charset=utf-8')
+
+
 @login_required
 @permission_required('dashboard.add_command', raise_exception=True)
 def start_command_view(request, pk):
     if request.method != 'POST':
         return HttpResponseForbidden('POST required')
-    cmd = get_object_or_404(Command, pk=pk)
-    # First, aggressively kill any lingering system processes for this command
+    cmd = get_object_or_404(Command.objects.select_related('site'), pk=pk)
     try:
-        from .supervisor import _kill_matching_processes
-        patterns = []
-        if cmd.site.base_command:
-            patterns.append(f"{cmd.site.base_command} {cmd.command_string}")
-        patterns.append(cmd.command_string)
-        patterns.append(f"manage.py {cmd.command_string}")
-        _kill_matching_processes(patterns, site=cmd.site, command_obj=cmd)
-    except Exception:
-        pass
-
-    # ensure only one running in DB after cleanup
-    active = cmd.runs.filter(stopped_at__isnull=True)
-    if active.exists():
-        messages.info(request, f"Command '{cmd.name}' already running after cleanup.")
-        return redirect('dashboard:command_list')
-    try:
-        supervisor.start_command(cmd)
-        messages.success(request, f"Started command '{cmd.name}'.")
+        result = request_start(cmd)
     except RuntimeError as e:
         # Log the error to the Log model and show message to user
         Log.objects.create(site=cmd.site, command=cmd, level='ERROR', message=str(e))
         messages.error(request, f"Could not start command: {e}")
+        return redirect('dashboard:command_list')
+    if result['started']:
+        messages.success(request, f"Started command '{cmd.name}'.")
+    else:
+        messages.info(request, f"Command '{cmd.name}' already running after cleanup.")
     return redirect('dashboard:command_list')
 
 
@@ -141,7 +399,54 @@ def start_command_view(request, pk):
 def stop_command_view(request, pk):
     if request.method != 'POST':
         return HttpResponseForbidden('POST required')
-    cmd = get_object_or_404(Command, pk=pk)
-    supervisor.stop_command(cmd)
+    cmd = get_object_or_404(Command.objects.select_related('site'), pk=pk)
+    try:
+        request_stop(cmd)
+    except RuntimeError as e:
+        messages.error(request, f"Could not stop command: {e}")
     return redirect('dashboard:command_list')
 
+
+# what each bulk action needs, matching the single start and stop views
+_BULK_PERMISSIONS = {
+    'start': ['dashboard.add_command'],
+    'stop': ['dashboard.delete_command'],
+    'restart': ['dashboard.add_command', 'dashboard.delete_command'],
+}
+
+
+@login_required
+def bulk_command_view(request):
+    """Start, stop or restart every command of a site (`site`) or the selected ones (`command`, repeated)."""
+    if request.method != 'POST':
+        return HttpResponseForbidden('POST required')
+    action = request.POST.get('action')
+    if action not in BULK_ACTIONS:
+        return HttpResponse('Unknown action', status=400)
+    if not request.user.has_perms(_BULK_PERMISSIONS[action]):
+        raise PermissionDenied
+    commands = Command.objects.select_related('site')
+    if 'site' in request.POST:
+        if not request.POST['site'].isdigit():
+            return HttpResponse('Invalid site', status=400)
+        commands = commands.filter(site_id=request.POST['site'])
+    else:
+        commands = commands.filter(pk__in=[pk for pk in request.POST.getlist('command') if pk.isdigit()])
+    concurrency = request.POST.get('concurrency') or '0'
+    if not concurrency.isdecimal():
+        return HttpResponse('Invalid concurrency', status=400)
+    commands = list(commands)
+    if not commands:
+        return redirect('dashboard:command_list')
+    try:
+        result = request_bulk(commands, action, concurrency=int(concurrency) or None)
+    except RuntimeError as e:
+        result, error = None, str(e)
+    else:
+        error = None
+    return render(request, 'dashboard/commands/bulk_result.html', {
+        'action': action,
+        'result': result,
+        'error': error,
+        'failed': sum(1 for c in result['commands'] if c.get('outcome') == 'failed') if result else 0,
+    })
@@ -61,6 +61,13 @@ DATABASES = {
     'default': env.db_url_config(DATABASE_URL)
 }
 
+# Optional separate database for logs, so log bursts never lock out logins and
+# start/stop on the main one. Create its table with `migrate --database=logs`.
+LOG_DATABASE_URL = env('LOG_DATABASE_URL', default='')
+if LOG_DATABASE_URL:
+    DATABASES['logs'] = env.db_url_config(LOG_DATABASE_URL)
+    DATABASE_ROUTERS = ['dashboard.routers.LogRouter']
+
 AUTH_PASSWORD_VALIDATORS = []
 
 LANGUAGE_CODE = 'en-us'
@@ -82,3 +89,87 @@ DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
 
 # Optional Discord webhook URL for crash notifications
 DISCORD_WEBHOOK_URL = env('DISCORD_WEBHOOK_URL', default='')
+# Repeat crashes of a command within this many seconds are sent as one summary message
+DISCORD_COALESCE_WINDOW = env.float('DISCORD_COALESCE_WINDOW', default=60.0)
+
+# Batched log ingestion: lines are flushed once LOG_BATCH_SIZE are pending or
+# LOG_FLUSH_INTERVAL seconds have passed, holding at most LOG_QUEUE_SIZE in memory.
+LOG_BATCH_SIZE = env.int('LOG_BATCH_SIZE', default=500)
+LOG_FLUSH_INTERVAL = env.float('LOG_FLUSH_INTERVAL', default=0.25)
+LOG_QUEUE_SIZE = env.int('LOG_QUEUE_SIZE', default=50000)
+# Lines that don't fit in the queue, or whose batch fails to write, are kept in
+# LOG_SPILL_DIR (up to LOG_SPILL_MAX_BYTES) and replayed when the database
+# catches up; set it empty to drop them instead.
+LOG_SPILL_DIR = env('LOG_SPILL_DIR', default=str(BASE_DIR / '.log-spill'))
+LOG_SPILL_MAX_BYTES = env.int('LOG_SPILL_MAX_BYTES', default=1 << 30)
+# Per-command ingestion policies (Command.collapse_repeats / log_rate_limit):
+# a collapsed row spans at most LOG_COLLAPSE_WINDOW seconds of repeats, and a
+# rate-limited command may burst LOG_RATE_BURST seconds' worth of lines.
+LOG_COLLAPSE_WINDOW = env.float('LOG_COLLAPSE_WINDOW', default=60.0)
+LOG_RATE_BURST = env.float('LOG_RATE_BURST', default=5.0)
+# Formats tried, in order, to read a line's real level, time and fields (for
+# commands whose log format is "Detect"): names from dashboard.parsers or
+# dotted paths to your own parser functions.
+LOG_PARSERS = env.list('LOG_PARSERS', default=['json', 'python', 'runserver'])
+
+# Per-minute and per-hour line/run counts behind the overview page, written by
+# the supervising process every ROLLUP_FLUSH_INTERVAL seconds.
+ROLLUP_FLUSH_INTERVAL = env.float('ROLLUP_FLUSH_INTERVAL', default=10.0)
+ROLLUP_MINUTE_DAYS = env.int('ROLLUP_MINUTE_DAYS', default=2)
+ROLLUP_HOUR_DAYS = env.int('ROLLUP_HOUR_DAYS', default=90)
+
+# 'selector' multiplexes every supervised process on one I/O thread;
+# 'threads' uses a monitor thread plus two reader threads per process.
+SUPERVISOR_IO_MODE = env('SUPERVISOR_IO_MODE', default='selector')
+
+# Number of recent output lines kept in memory per command for the tail view
+LOG_TAIL_LINES = env.int('LOG_TAIL_LINES', default=500)
+
+# One process per host wins this lock and runs the supervisor; other
+# processes (e.g. extra Gunicorn workers) reach it through the control socket.
+SUPERVISOR_LOCK_FILE = env('SUPERVISOR_LOCK_FILE', default=str(BASE_DIR / '.supervisor.lock'))
+SUPERVISOR_SOCKET = env('SUPERVISOR_SOCKET', default=str(BASE_DIR / '.supervisor.sock'))
+
+# 'embedded': web processes elect a leader among themselves to supervise.
+# 'daemon': only `manage.py run_supervisor` supervises, so web restarts and
+# worker recycling never touch the child processes.
+SUPERVISOR_MODE = env('SUPERVISOR_MODE', default='embedded')
+
+# Auto-restart policy: the first crash restarts immediately, later quick crashes
+# back off exponentially from RESTART_BACKOFF_BASE up to RESTART_BACKOFF_MAX
+# seconds. A run lasting RESTART_STABLE_AFTER seconds resets the count, and
+# CRASH_LOOP_THRESHOLD quick crashes in a row park the command until started manually.
+RESTART_BACKOFF_BASE = env.float('RESTART_BACKOFF_BASE', default=1.0)
+RESTART_BACKOFF_MAX = env.float('RESTART_BACKOFF_MAX', default=300.0)
+RESTART_STABLE_AFTER = env.float('RESTART_STABLE_AFTER', default=60.0)
+CRASH_LOOP_THRESHOLD = env.int('CRASH_LOOP_THRESHOLD', default=5)
+
+# Seconds orphaned processes get to exit after SIGTERM during startup cleanup
+# before they are SIGKILLed; all orphans share this one deadline.
+SUPERVISOR_CLEANUP_GRACE = env.float('SUPERVISOR_CLEANUP_GRACE', default=2.0)
+
+# Bulk start/stop/restart: every selected command gets SIGTERM at once and
+# SUPERVISOR_STOP_GRACE seconds, shared, before SIGKILL; starts then run in
+# parallel, at most BULK_START_CONCURRENCY at a time (0 = no limit).
+SUPERVISOR_STOP_GRACE = env.float('SUPERVISOR_STOP_GRACE', default=5.0)
+BULK_START_CONCURRENCY = env.int('BULK_START_CONCURRENCY', default=0)
+
+# Log retention: rows older than LOG_RETENTION_DAYS (0 = keep forever) are
+# deleted, unless a retention policy set in the admin covers them. The leader
+# prunes every LOG_PRUNE_INTERVAL seconds (0 disables; `manage.py prune_logs`
+# does the same by hand), LOG_PRUNE_BATCH_SIZE rows per transaction. With
+# LOG_ARCHIVE_DIR set, pruned rows are first appended to per-day, per-command
+# NDJSON files compressed with LOG_ARCHIVE_COMPRESSION ('gzip' or 'zstd').
+LOG_RETENTION_DAYS = env.int('LOG_RETENTION_DAYS', default=0)
+LOG_PRUNE_INTERVAL = env.float('LOG_PRUNE_INTERVAL', default=3600.0)
+LOG_PRUNE_BATCH_SIZE = env.int('LOG_PRUNE_BATCH_SIZE', default=1000)
+LOG_ARCHIVE_DIR = env('LOG_ARCHIVE_DIR', default='')
+LOG_ARCHIVE_COMPRESSION = env('LOG_ARCHIVE_COMPRESSION', default='gzip')
+
+# Resource sampling of supervised process trees: every METRICS_SAMPLE_INTERVAL
+# seconds (0 disables), kept as per-minute history for METRICS_HISTORY_DAYS.
+# /metrics serves Prometheus; scrapers authenticate with
+# `Authorization: Bearer <METRICS_TOKEN>`.
+METRICS_SAMPLE_INTERVAL = env.float('METRICS_SAMPLE_INTERVAL', default=10.0)
+METRICS_HISTORY_DAYS = env.int('METRICS_HISTORY_DAYS', default=7)
+METRICS_TOKEN = env('METRICS_TOKEN', default='')
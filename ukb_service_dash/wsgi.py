@@ -3,3 +3,9 @@ from django.core.wsgi import get_wsgi_application
 
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'ukb_service_dash.settings')
 application = get_wsgi_application()
+
+# Join the supervisor leader election (a no-op when SUPERVISOR_MODE=daemon).
+# This runs for Gunicorn workers and `runserver`, but not other management commands.
+from dashboard.supervisor import start_for_web  # noqa: E402
+
+start_for_web()